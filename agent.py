@@ -1,14 +1,33 @@
 import os
-from mistralai import Mistral
+import asyncio
 import discord
 import json
+import time
 from youtube.download import download_audio
 from transcribe.audio2midi import audio2midi
-from transcribe.midi2score import midi2score, score2pdf
+from transcribe.transkun_worker import TranskunWorker
+from transcribe.chunked import transcribe_chunked, audio_duration, CHUNKED_MIN_SECONDS
+from transcribe.midi2score import lookup_score
+from transcribe.render_pool import RenderPool
+from transcribe.score_client import ScoringClient
+from cache import get_cache, make_key, file_digest
 from audio.audio_processor import AudioProcessor
+from audio.stem_store import StemStore
+from audio.pcm_cache import as_view, encode
+from youtube import search
 from youtube.search import search_youtube
-from prompts import SELECT_SONG_PROMPT
+from youtube.prefetch import Prefetcher
+from executor import StageExecutor
+from ingest import Ingest
+from config import env_int
+from pipeline import compile_requests, run_plan, UNKNOWN_REQUEST
+from intent import IntentParser, parse_reply
+from sessions import SessionManager, session_key
+from telemetry import telemetry
 MISTRAL_MODEL = "mistral-large-latest"
+# imported by warm_up() rather than when this module loads
+WARM_IO_MODULES = ("yt_dlp",)
+WARM_CPU_MODULES = ("torch", "demucs.pretrained", "demucs.apply")
 SYSTEM_PROMPT = """
 You are a helpful audio and music assistant. 
 You can be provided with a youtube link. 
@@ -46,142 +65,208 @@ SEARCH should be first if it exists, then TRIM, and the rest can be in any order
 
 class MistralAgent:
     def __init__(self):
-        MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
-
-        self.client = Mistral(api_key=MISTRAL_API_KEY)
+        # everything here is cheap to build: models, mistralai, yt_dlp and music21 are
+        # loaded when first used, or by warm_up() once the bot is connected
+        self._client = None
 
         self.audio_processor = AudioProcessor()
 
-        self.message_history = []
+        self.executor = StageExecutor()
 
-        self.youtube_to_audio_path = {}
+        self.stem_store = StemStore(self.executor, self.audio_processor)
 
-        self.last_audio_path = None
+        # downloads and decodes started before a request needs them: the links and uploads
+        # of a message while the LLM parses it, the top search result while it is posted
+        self.prefetcher = Prefetcher(self.executor, decode=as_view)
 
-        self.songs = []
+        # attachments, streamed in and stored by content hash
+        self.ingest = Ingest(self.executor)
 
-    async def handle_message(self, message: str, original_message: discord.Message):
-        print("Handling message...", message)
-        json_list = json.loads(message)
-
-        results = []
-
-        for obj in json_list:
-            if obj["type"] == "none":
-                return "I'm sorry, I don't understand that request."
-
-            if obj["type"] == "MIDI":
-                await original_message.reply(f"Working on transcribing to MIDI...")
-                audio_path = self.get_cached_audio_path(obj["youtube_link"], obj["file_path"])
-                midi_file_path = self.transcribe_to_midi(obj["youtube_link"], audio_path)
-                self.songs.append({"youtube_link": obj["youtube_link"], "file_path": midi_file_path, "name": ""})
-                results.append(("MIDI: ", midi_file_path))
-
-            if obj["type"] == "SHEET_MUSIC":
-                await original_message.reply(f"Working on converting to sheet music...this could take ~1 minute...")
-                audio_path = self.get_cached_audio_path(obj["youtube_link"], obj["file_path"])
-                midi_file_path = self.transcribe_to_midi(obj["youtube_link"], audio_path)
-                music_xml_path = self.convert_to_sheet_music(midi_file_path)
-                # pdf_file_path = score2pdf(music_xml_path)
-                # results.append(("PDF of sheet music: ", pdf_file_path))
-                self.songs.append({"youtube_link": obj["youtube_link"], "file_path": music_xml_path, "name": ""})
-                results.append(("Editable sheet music: ", music_xml_path))
-            
-            if obj["type"] == "TRIM":
-                await original_message.reply(f"Working on trimming audio...")
-                audio_path = self.get_cached_audio_path(obj["youtube_link"], "none")
-                audio_path = self.audio_processor.trim_audio(obj["youtube_link"], obj["start_time"], obj["end_time"], audio_path)
-                self.youtube_to_audio_path[obj["youtube_link"]] = audio_path
-                self.last_audio_path = audio_path
-                self.songs.append({"youtube_link": obj["youtube_link"], "file_path": audio_path, "name": ""})
-                results.append(("Trimmed audio: ", audio_path))
-
-            if obj["type"] == "SEARCH":
-                search_results = search_youtube(obj["query"])
-                if 'url' in search_results:
-                    self.last_audio_path = download_audio(search_results['url'])
-                    self.youtube_to_audio_path[search_results['url']] = self.last_audio_path
-                print("Search results: ", search_results)
-                self.songs.append({"youtube_link": search_results['url'], "file_path": None, "name": obj["query"]})
-                await original_message.reply(f"Working on searching for {obj['query']}...")
-                results.append(("Search results: ", search_results))
-
-            if obj["type"] == "STEM_SEPARATION":
-                await original_message.reply(f"Working on separating the audio into {obj['instrument']}...(takes ~30 seconds)")
-                audio_path = self.get_cached_audio_path(obj["youtube_link"], obj["file_path"])
-                audio_path = self.audio_processor.stem_seperation(obj["youtube_link"], audio_path, obj["instrument"])
-
-                self.youtube_to_audio_path[obj["youtube_link"]] = audio_path
-                self.last_audio_path = audio_path
-
-                self.songs.append({"youtube_link": obj["youtube_link"], "file_path": audio_path, "name": obj["instrument"]})
-                results.append((f"Stem separation for {obj['instrument']}: ", audio_path))
-
-        return results
-                
+        # resident transkun process; TRANSKUN_WORKER=0 falls back to one CLI run per request
+        self.transkun_worker = TranskunWorker() if env_int("TRANSKUN_WORKER", 1) else None
 
-    async def run(self, message: discord.Message, message_history: str):
-        # The simplest form of an agent
-        # Send the message's content to Mistral's API and return Mistral's response
+        # warm music21 processes for the PDFs that follow sheet music; RENDER_WORKERS=0 turns PDFs off
+        self.render_pool = RenderPool() if env_int("RENDER_WORKERS", 1) else None
 
-        songs_string = json.dumps(self.songs)
+        # pooled connections to the MusicXML scoring service
+        self.scoring = ScoringClient()
 
-        # put --- at the beginning and end of the songs_string
-        songs_string = "---" + songs_string + "---"
+        # plain requests are parsed locally and LLM replies are cached
+        self.intents = IntentParser()
 
-        messages = [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": message_history},
-            {"role": "user", "content": songs_string},
-            {"role": "user", "content": message.content},
-        ]
-
-        response = await self.client.chat.complete_async(
-            model=MISTRAL_MODEL,
-            messages=messages,
-        )
-
-        # also ask the LLM what is the most relevant song to the user's request
-        # and return that song
+        self.message_history = []
 
+        # songs, last audio and link -> audio per channel and user, evicted when idle
+        self.sessions = SessionManager()
+
+        # read when the metrics are rendered (the /metrics endpoint and !stats)
+        telemetry.register("executor", self.executor.metrics)
+        telemetry.register("artifact_cache", lambda: get_cache().stats())
+        telemetry.register("search_cache", lambda: search.search_cache.stats())
+        telemetry.register("prefetch", self.prefetcher.metrics)
+        telemetry.register("ingest", self.ingest.metrics)
+        telemetry.register("intents", self.intents.metrics)
+        telemetry.register("sessions", self.sessions.metrics)
+        telemetry.register("scoring", self.scoring.metrics)
+        if self.render_pool is not None:
+            telemetry.register("render", self.render_pool.metrics)
+
+    @property
+    def client(self):
+        if self._client is None:
+            from mistralai import Mistral
+
+            self._client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
+        return self._client
+
+    async def warm_up(self):
+        """
+        Loads in the background what the first requests would otherwise wait for: the
+        Mistral client, yt_dlp for the I/O stages, torch and demucs in the stage processes,
+        the transkun model in its worker and music21 in the PDF render workers.
+        """
+        started = time.perf_counter()
+        try:
+            await self.executor.run_io("lookup", lambda: self.client)
+            if self.transkun_worker is not None:
+                self.transkun_worker.start()
+            await self.executor.preload(io_modules=WARM_IO_MODULES, cpu_modules=WARM_CPU_MODULES)
+            if self.render_pool is not None:
+                await self.render_pool.warm()
+        except Exception as e:
+            # whatever did not load will load on first use
+            print(f"Warm-up failed after {time.perf_counter() - started:.1f} s: {e}")
+            return
+        print(f"Warmed up in {time.perf_counter() - started:.1f} s")
 
+    async def handle_message(self, message: str, original_message: discord.Message, on_result=None):
+        print("Handling message...", message)
+        json_list = parse_reply(message)
 
-        return await self.handle_message(response.choices[0].message.content, message)
+        # shared stages (e.g. the transcription behind both MIDI and SHEET_MUSIC) run once,
+        # and independent ones run side by side
+        with self.sessions.use(session_key(original_message.channel.id, original_message.author.id)) as session:
+            plan = compile_requests(json_list, self, session)
+            if plan.unknown and not plan.sinks:
+                return UNKNOWN_REQUEST
 
-    def transcribe_to_midi(self, youtube_link: str, audio_path: str):
-        # first download the audio from the youtube link
-        try:
-            audio_file_path = download_audio(youtube_link) if audio_path is None else audio_path
-        except Exception as e:
-            print("Error downloading audio:", e)
-            return "I'm sorry, I couldn't download the audio from the youtube link."
+            for sink in plan.sinks:
+                await original_message.reply(sink.progress)
 
-        print("Transcribing to MIDI...", audio_file_path)
+            return await run_plan(plan, on_result)
 
-        # convert the audio to midi
-        midi_file_path = audio2midi(audio_file_path)
+    async def run(self, message: discord.Message, message_history: str):
+        # The simplest form of an agent
+        # Send the message's content to Mistral's API and handle Mistral's response
+        requests = await self.parse_requests(message, message_history)
+        return await self.handle_message(requests, message)
+
+    async def parse_requests(self, message: discord.Message, message_history: str):
+        # turn the message into the JSON list of requests handled by handle_message
+        requests = self.intents.parse(message.content, has_attachment=bool(message.attachments))
+        if requests is not None:
+            print(f"Parsed requests locally in {self.intents.parse_times[-1] * 1000:.2f} ms")
+            return json.dumps(requests)
+
+        # the few songs the message most likely refers to, wrapped in --- at the beginning and end
+        session = self.sessions.get(session_key(message.channel.id, message.author.id))
+        songs_string = session.songs.prompt(message.content)
+
+        # the same message about the same songs gets the same answer
+        key = self.intents.cache_key(message.content, message_history + songs_string)
+        requests = self.intents.cached(key)
+        if requests is not None:
+            return json.dumps(requests)
 
-        # then route to the midi2score model
-        return midi_file_path
-        
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": message_history},
+            {"role": "user", "content": songs_string},
+            {"role": "user", "content": message.content},
+        ]
 
-    def convert_to_sheet_music(self, midi_file_path: str):
-        # first download the audio from the youtube link
-        try:
-            music_xml_file_path = midi2score(midi_file_path)
-        except Exception as e:
-            print("Error converting to sheet music:", e)
-            return "I'm sorry, I couldn't convert the MIDI file to sheet music."
-
-        return music_xml_file_path
-    
-    def get_cached_audio_path(self, youtube_link: str, file_path: str):
-        if file_path == "none":
-            if youtube_link in self.youtube_to_audio_path:
-                return self.youtube_to_audio_path[youtube_link]
-            elif youtube_link == "none":
-                return self.last_audio_path
-            else:
-                return None
-        else:
-            return file_path
+        started = time.perf_counter()
+        with telemetry.span("llm"):
+            response = await self.client.chat.complete_async(
+                model=MISTRAL_MODEL,
+                messages=messages,
+            )
+        print(f"Mistral replied in {time.perf_counter() - started:.2f} s")
+
+        requests = parse_reply(response.choices[0].message.content)
+        self.intents.remember(key, requests)
+        metrics = self.intents.metrics()
+        print(f"Served without the LLM: {metrics['served_without_llm']:.0%} of {metrics['requests']} messages")
+        return json.dumps(requests)
+
+    # The pipeline stages, each run in the executor's pools
+
+    async def download_audio(self, youtube_link: str, start_time=None, end_time=None):
+        # a ranged download is its own file: it claims only a prefetch of the same range
+        in_flight = self.prefetcher.claim(youtube_link, start_time, end_time)
+        if in_flight is not None:
+            try:
+                return await in_flight
+            except Exception as e:
+                print(f"Prefetched download failed, downloading again: {e}")
+        return await self.executor.run_io("download", download_audio, youtube_link, start_time, end_time)
+
+    def prefetch_search(self, candidates: list):
+        self.prefetcher.speculate(candidates)
+
+    async def search_youtube(self, query: str):
+        search_results = await self.executor.run_io("search", search_youtube, query)
+        print("Search results: ", search_results)
+        return search_results
+
+    async def decode_audio(self, audio_path: str):
+        # an upload may still be saving (and decoding) in the background
+        in_flight = self.prefetcher.claim(audio_path)
+        if in_flight is not None:
+            try:
+                await in_flight
+            except Exception as e:
+                print(f"Prefetched upload failed: {e}")
+        # decoded once per source; the stages below take the returned view instead of the file
+        return await self.executor.run_io("decode", as_view, audio_path)
+
+    async def encode_audio(self, audio):
+        return await self.executor.run_io("encode", encode, audio, "mp3")
+
+    async def trim_audio(self, audio, start_time: int, end_time: int):
+        return await self.executor.run_io("trim", self.audio_processor.trim_audio, None, start_time, end_time, audio)
+
+    async def stem_separation(self, audio, instrument: str):
+        return await self.stem_store.get(audio, instrument)
+
+    async def transcribe_to_midi(self, audio_path):
+        print("Transcribing to MIDI...", audio_path)
+        # long recordings are split into windows and transcribed on all cores
+        # the duration and the worker's cache check don't wait behind a running transcription
+        if await self.executor.run_io("decode", audio_duration, audio_path) > CHUNKED_MIN_SECONDS:
+            return await self.executor.run_io("transcribe", transcribe_chunked, audio_path)
+        if self.transkun_worker is not None:
+            future = await self.executor.run_io("lookup", self.transkun_worker.submit, audio_path)
+            with telemetry.span("transcribe"):
+                # a job lost to a crashed or restarted worker must not hang the request
+                return await asyncio.wait_for(asyncio.wrap_future(future), self.transkun_worker.timeout)
+        return await self.executor.run_cpu("transcribe", audio2midi, audio_path)
+
+    async def convert_to_sheet_music(self, midi_file_path: str):
+        key, cached_path = await self.executor.run_io("lookup", lookup_score, midi_file_path)
+        if cached_path:
+            return cached_path
+        with telemetry.span("score"):
+            score_path = await self.scoring.score(midi_file_path)
+        return await self.executor.run_io("lookup", get_cache().put, key, score_path)
+
+    async def render_pdf(self, score_path: str):
+        # printable sheet music, rendered in the background once the MusicXML has been sent
+        digest = await self.executor.run_io("lookup", file_digest, score_path)
+        key = make_key("pdf", digest)
+        cached_path = await self.executor.run_io("lookup", get_cache().get, key)
+        if cached_path:
+            return cached_path
+        with telemetry.span("render"):
+            pdf_path = await self.render_pool.render(score_path, digest)
+        return await self.executor.run_io("lookup", get_cache().put, key, pdf_path)
@@ -1,7 +1,12 @@
-from pydub import AudioSegment
 from youtube.download import download_audio
 import os
-import demucs.separate
+from cache import get_cache, make_key
+from audio.pcm_cache import PcmView, as_view, audio_identity, encode
+from config import env_int
+from audio.separation_engine import separate_with_engine
+
+STEM_MODEL = "htdemucs_6s"
+STEMS = ("vocals", "drums", "bass", "other", "piano", "guitar")
 
 class AudioProcessor:
     def __init__(self):
@@ -13,12 +18,8 @@ class AudioProcessor:
         else:
             audio_file_path = audio_path
 
-        audio_file_name = os.path.basename(audio_file_path)
-        output_file_path = os.path.join(os.getcwd(), "uploads", f"{start_time}_{end_time}_{audio_file_name}")
-        audio = AudioSegment.from_file(audio_file_path)
-        trimmed_audio = audio[start_time * 1000 : end_time * 1000]
-        trimmed_audio.export(output_file_path, format="mp3")
-        return output_file_path
+        # a view into the decoded source: nothing is copied or encoded until it is uploaded
+        return as_view(audio_file_path).slice(start_time, end_time)
     
     def stem_seperation(self, youtube_link: str, audio_path: str, instrument: str):
         if audio_path is None:
@@ -26,14 +27,33 @@ class AudioProcessor:
         else:
             audio_file_path = audio_path
 
-    
-        # run through stem seperation model demucs
-        demucs.separate.main(["--mp3", "-n", "htdemucs_6s", audio_file_path])
+        # a one-off call: only the stem asked for is written (StemStore keeps them all)
+        return self.separate_stems(audio_file_path, stems=(instrument,))[instrument]
+
+    def separate_stems(self, audio_path, model: str = STEM_MODEL, stems: tuple = STEMS):
+        cache = get_cache()
+        digest = audio_identity(audio_path)
+        found = {stem: cache.get(make_key("stem", digest, model=model, instrument=stem)) for stem in stems}
+        if all(found.values()):
+            return found
+
+        if env_int("SEPARATION_ENGINE", 1):
+            # preloaded model, bounded memory, and only the stems that are still missing (all of
+            # them by default: the model computes every stem in the same pass)
+            found.update(separate_with_engine(audio_path, [stem for stem in stems if not found[stem]], model))
+            return found
+
+        if isinstance(audio_path, PcmView):
+            # the CLI needs a file on disk
+            audio_path = encode(audio_path, "wav")
 
-        # get the output file path
-        base_name = os.path.splitext(os.path.basename(audio_file_path))[0]
-        output_file_path = os.path.join(os.getcwd(), "separated", "htdemucs_6s", base_name, f"{instrument}.mp3")
+        import demucs.separate
 
-        # return the output file path
-        return output_file_path
+        # run through stem seperation model demucs, writing to separated/<model>/<digest>/ so
+        # different files with the same name don't overwrite each other
+        demucs.separate.main(["--mp3", "-n", model, "--filename", digest + "/{stem}.{ext}", audio_path])
 
+        for stem in STEMS:
+            stem_path = os.path.join(os.getcwd(), "separated", model, digest, f"{stem}.mp3")
+            found[stem] = cache.put(make_key("stem", digest, model=model, instrument=stem), stem_path)
+        return found
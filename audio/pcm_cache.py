@@ -0,0 +1,133 @@
+# decode each source once into raw PCM on disk; trims are views into it
+
+import os
+import subprocess
+from dataclasses import dataclass
+from cache import get_cache, make_key, file_digest
+
+# every source is stored as 16-bit stereo at the rate demucs and transkun both use
+SAMPLE_RATE = 44100
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+FRAME_BYTES = CHANNELS * SAMPLE_WIDTH
+
+
+@dataclass(frozen=True)
+class PcmView:
+    """
+    A range of frames in a decoded source. Views are small and picklable, so they can be
+    handed to worker processes, which map the same file instead of decoding again.
+    Slicing never copies audio.
+    """
+
+    pcm_path: str
+    digest: str
+    name: str
+    start: int
+    end: int
+
+    @property
+    def frames(self):
+        return self.end - self.start
+
+    @property
+    def duration(self):
+        return self.frames / SAMPLE_RATE
+
+    @property
+    def identity(self):
+        # stands in for the file digest in cache keys of anything derived from this audio
+        if self.start == 0 and self.end == _total_frames(self.pcm_path):
+            return self.digest
+        return f"{self.digest}_{self.start}_{self.end}"
+
+    def slice(self, start_seconds: float, end_seconds: float):
+        return self.window(int(start_seconds * SAMPLE_RATE), int(end_seconds * SAMPLE_RATE))
+
+    def window(self, start_frame: int, end_frame: int):
+        # frames are relative to this view
+        start = min(self.end, self.start + start_frame)
+        end = min(self.end, self.start + end_frame)
+        return PcmView(self.pcm_path, self.digest, self.name, start, max(start, end))
+
+    def samples(self):
+        # int16 array of shape (frames, channels) backed by the memory-mapped file
+        import numpy as np
+        data = np.memmap(self.pcm_path, dtype=np.int16, mode="r").reshape(-1, CHANNELS)
+        return data[self.start:self.end]
+
+    def float32(self):
+        import numpy as np
+        return self.samples().astype(np.float32) / 32768.0
+
+
+def _total_frames(pcm_path: str):
+    return os.path.getsize(pcm_path) // FRAME_BYTES
+
+
+def decode(audio_path: str):
+    """
+    Returns a view over the whole of audio_path, decoding it with ffmpeg the first time the
+    content is seen and reusing the cached PCM afterwards.
+    """
+    cache = get_cache()
+    digest = file_digest(audio_path)
+    name = os.path.splitext(os.path.basename(audio_path))[0]
+    key = make_key("pcm", digest, rate=SAMPLE_RATE, channels=CHANNELS)
+
+    pcm_path = cache.get(key)
+    if not pcm_path:
+        pcm_path = os.path.join(os.getcwd(), "pcm", f"{digest}.s16")
+        os.makedirs(os.path.dirname(pcm_path), exist_ok=True)
+        partial_path = pcm_path + ".part"
+        subprocess.run(
+            ["ffmpeg", "-y", "-v", "error", "-i", audio_path, "-f", "s16le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), partial_path],
+            check=True,
+        )
+        os.replace(partial_path, pcm_path)
+        pcm_path = cache.put(key, pcm_path)
+
+    return PcmView(pcm_path, digest, name, 0, _total_frames(pcm_path))
+
+
+def as_view(audio):
+    # stages accept either a file path or a view
+    return audio if isinstance(audio, PcmView) else decode(audio)
+
+
+def audio_identity(audio):
+    return audio.identity if isinstance(audio, PcmView) else file_digest(audio)
+
+
+def audio_name(audio):
+    if isinstance(audio, PcmView):
+        if audio.identity == audio.digest:
+            return audio.name
+        return f"{audio.start / SAMPLE_RATE:g}_{audio.end / SAMPLE_RATE:g}_{audio.name}"
+    return os.path.splitext(os.path.basename(audio))[0]
+
+
+def encode(audio, format: str = "mp3", output_path: str = None):
+    """
+    Encodes a view (or returns a path as is) for upload. ffmpeg reads the PCM straight from
+    the mapped file. Encoded files are cached like any other artifact.
+    """
+    if not isinstance(audio, PcmView):
+        return audio
+
+    cache = get_cache()
+    key = make_key("encode", audio.identity, format=format)
+    cached_path = cache.get(key)
+    if cached_path:
+        return cached_path
+
+    output_path = output_path or os.path.join(os.getcwd(), "uploads", f"{audio_name(audio)}_{audio.digest[:8]}.{format}")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    command = ["ffmpeg", "-y", "-v", "error", "-f", "s16le", "-ac", str(CHANNELS), "-ar", str(SAMPLE_RATE), "-i", "pipe:0"]
+    if format == "mp3":
+        command += ["-b:a", "192k"]
+    process = subprocess.Popen(command + [output_path], stdin=subprocess.PIPE)
+    process.communicate(memoryview(audio.samples()).cast("B"))
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to encode {audio_name(audio)}")
+    return cache.put(key, output_path)
@@ -0,0 +1,175 @@
+# in-process demucs: keep the model loaded and separate long tracks segment by segment
+
+import os
+import subprocess
+import time
+from cache import get_cache, make_key
+from audio.pcm_cache import SAMPLE_RATE as PCM_SAMPLE_RATE, as_view
+
+SEGMENT_SECONDS = 30.0
+# each segment overlaps the previous one by this much and the two are crossfaded
+OVERLAP_SECONDS = 2.0
+# what demucs --mp3 writes
+MP3_BITRATE = "320k"
+
+
+def _encoder(output_path: str, channels: int, sample_rate: int):
+    # ffmpeg encoding the 16-bit PCM written to its stdin to mp3
+    return subprocess.Popen(
+        ["ffmpeg", "-y", "-v", "error", "-f", "s16le", "-ac", str(channels), "-ar", str(sample_rate), "-i", "pipe:0", "-b:a", MP3_BITRATE, output_path],
+        stdin=subprocess.PIPE,
+    )
+
+
+class SeparationEngine:
+    """
+    Holds one demucs model for the life of the process.
+
+    separate() reads the track from the PCM cache in fixed-length overlapping segments, runs the
+    model on one segment at a time and streams the requested stems straight into ffmpeg mp3
+    encoders (at the bitrate demucs --mp3 uses), so peak memory depends on the segment length
+    rather than the length of the track. The input is normalised with the whole track's
+    statistics, as demucs does, so the level doesn't jump between segments. Stems that were
+    not asked for are never encoded or written.
+    """
+
+    def __init__(self, model_name: str, device: str = None, segment_seconds: float = SEGMENT_SECONDS, overlap_seconds: float = OVERLAP_SECONDS):
+        import torch
+        from demucs.pretrained import get_model
+
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        started = time.perf_counter()
+        self.model = get_model(model_name)
+        self.model.to(self.device)
+        self.model.eval()
+        self.load_time = time.perf_counter() - started
+
+        self.model_name = model_name
+        self.segment_seconds = segment_seconds
+        self.overlap_seconds = overlap_seconds
+
+    @property
+    def sources(self):
+        return list(self.model.sources)
+
+    def separate(self, audio_path, stems: list, output_dir: str):
+        import torch
+        from demucs.apply import apply_model
+        from demucs.audio import convert_audio
+
+        indices = [self.sources.index(stem) for stem in stems]
+        sample_rate = self.model.samplerate
+        channels = self.model.audio_channels
+        segment = int(self.segment_seconds * sample_rate)
+        overlap = int(self.overlap_seconds * sample_rate)
+
+        source = as_view(audio_path)
+        # segment boundaries are counted in PCM frames, then converted if the model runs at another rate
+        scale = PCM_SAMPLE_RATE / sample_rate
+        total = int(source.frames / scale)
+
+        # demucs expects roughly unit-variance input; one mean and std for the whole track
+        mean, std = _mono_stats(source)
+
+        os.makedirs(output_dir, exist_ok=True)
+        paths = {stem: os.path.join(output_dir, f"{stem}.mp3") for stem in stems}
+        encoders = {stem: _encoder(path + ".part.mp3", channels, sample_rate) for stem, path in paths.items()}
+
+        def write(block):
+            # block: (len(stems), channels, samples) float tensor
+            pcm = (block.clamp(-1, 1) * 32767).to(torch.int16)
+            for stem, stem_pcm in zip(stems, pcm):
+                try:
+                    encoders[stem].stdin.write(stem_pcm.t().contiguous().numpy().tobytes())
+                except BrokenPipeError:
+                    raise RuntimeError(f"ffmpeg stopped encoding the {stem} stem")
+
+        fade_in = torch.linspace(0, 1, overlap)
+        tail = None
+        position = 0
+        finished = False
+        try:
+            with torch.no_grad():
+                while position < total:
+                    window = source.window(int(position * scale), int((position + segment) * scale))
+                    wav = torch.from_numpy(window.float32().T.copy())
+                    if scale != 1 or wav.shape[0] != channels:
+                        wav = convert_audio(wav, PCM_SAMPLE_RATE, sample_rate, channels)
+                    if wav.shape[-1] == 0:
+                        break
+
+                    out = apply_model(self.model, ((wav - mean) / std)[None].to(self.device), device=self.device, progress=False)[0]
+                    out = (out[indices] * std + mean).cpu()
+
+                    if tail is not None:
+                        k = min(overlap, out.shape[-1], tail.shape[-1])
+                        out[..., :k] = tail[..., :k] * (1 - fade_in[:k]) + out[..., :k] * fade_in[:k]
+
+                    last = wav.shape[-1] < segment or position + segment >= total
+                    if last:
+                        write(out)
+                        break
+                    write(out[..., :-overlap])
+                    tail = out[..., -overlap:]
+                    position += segment - overlap
+            finished = True
+        finally:
+            for encoder in encoders.values():
+                try:
+                    encoder.stdin.close()
+                except BrokenPipeError:
+                    pass
+                encoder.wait()
+            for stem, path in paths.items():
+                partial_path = path + ".part.mp3"
+                if finished and encoders[stem].returncode == 0:
+                    os.replace(partial_path, path)
+                elif os.path.exists(partial_path):
+                    os.remove(partial_path)
+
+        failed = [stem for stem, encoder in encoders.items() if encoder.returncode != 0]
+        if failed:
+            raise RuntimeError(f"ffmpeg failed to encode the {', '.join(failed)} stem")
+        return paths
+
+
+def _mono_stats(source):
+    # mean and standard deviation of the mono mix of a whole PcmView, read a segment at a time
+    import numpy as np
+
+    count, total, squares = 0, 0.0, 0.0
+    step = int(SEGMENT_SECONDS * PCM_SAMPLE_RATE)
+    for start in range(0, source.frames, step):
+        mono = source.window(start, start + step).float32().mean(axis=1, dtype=np.float64)
+        count += len(mono)
+        total += mono.sum()
+        squares += (mono * mono).sum()
+    if count == 0:
+        return 0.0, 1.0
+    mean = total / count
+    # demucs uses the sample standard deviation
+    variance = max(0.0, (squares - count * mean * mean) / max(1, count - 1))
+    return float(mean), float(variance ** 0.5) + 1e-8
+
+
+_engines = {}
+
+
+def get_engine(model_name: str):
+    # one engine per model per process, so the weights are loaded once
+    if model_name not in _engines:
+        _engines[model_name] = SeparationEngine(model_name)
+    return _engines[model_name]
+
+
+def separate_with_engine(audio_path, stems: list, model_name: str):
+    """
+    Separates only the requested stems of audio_path (a path or a PcmView) into
+    separated/<model>/<identity>/ and registers them in the artifact cache.
+    Returns a dict of stem -> path.
+    """
+    cache = get_cache()
+    digest = as_view(audio_path).identity
+    output_dir = os.path.join(os.getcwd(), "separated", model_name, digest)
+    paths = get_engine(model_name).separate(audio_path, stems, output_dir)
+    return {stem: cache.put(make_key("stem", digest, model=model_name, instrument=stem), path) for stem, path in paths.items()}
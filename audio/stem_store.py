@@ -0,0 +1,46 @@
+# one demucs run per song: every stem request for the same audio shares it
+
+import asyncio
+from cache import get_cache, make_key
+from audio.audio_processor import STEM_MODEL
+from audio.pcm_cache import audio_identity
+
+
+def lookup_stem(audio_path, model: str, instrument: str):
+    digest = audio_identity(audio_path)
+    return digest, get_cache().get(make_key("stem", digest, model=model, instrument=instrument))
+
+
+class StemStore:
+    """
+    Answers stem requests from completed separations, keyed by audio content hash and model,
+    so asking for "drums" after "vocals" on the same song needs no new model run.
+
+    Every separation keeps all of the model's stems, since the forward pass computes them
+    anyway. While one is running, further requests for any stem of the same audio wait on
+    it instead of starting their own.
+    """
+
+    def __init__(self, executor, audio_processor, model: str = STEM_MODEL):
+        self.executor = executor
+        self.audio_processor = audio_processor
+        self.model = model
+        self._inflight = {}
+
+    async def get(self, audio_path, instrument: str):
+        digest, stem_path = await self.executor.run_io("lookup", lookup_stem, audio_path, self.model, instrument)
+        if stem_path:
+            return stem_path
+
+        key = (digest, self.model)
+        separation = self._inflight.get(key)
+        if separation is None:
+            separation = asyncio.ensure_future(
+                self.executor.run_cpu("separate", self.audio_processor.separate_stems, audio_path, self.model)
+            )
+            self._inflight[key] = separation
+            separation.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # shielded so one cancelled request doesn't cancel the run the others are waiting on
+        stems = await asyncio.shield(separation)
+        return stems[instrument]
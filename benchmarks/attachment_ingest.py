@@ -0,0 +1,133 @@
+# Saving a message's attachments: one after another and buffered, against the ingest stage.
+#
+#   python -m benchmarks.attachment_ingest --files 4 --seconds 120 --bandwidth 4
+#
+# Serves --files generated recordings (ffmpeg sine tones, --seconds long) from a local
+# aiohttp server throttled to --bandwidth MB/s per download, like Discord's CDN. "sequential"
+# is the old on_message: each attachment read whole into memory and written out in turn.
+# "ingest" is Ingest.fetch for all of them at once; "re-upload" sends the same files again,
+# which should be recognized by hash, and "oversized" one past INGEST_MAX_BYTES. Reports
+# wall time and the Python heap peak. Needs aiohttp, ffmpeg and ffprobe.
+
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from executor import StageExecutor
+from ingest import Ingest, attachment_path
+
+
+def make_recordings(directory: str, files: int, seconds: int):
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, f"take{i}.wav")
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency={220 + 110 * i}:duration={seconds}", path],
+            check=True,
+        )
+        paths.append(path)
+    return paths
+
+
+async def serve(directory: str, bandwidth: float):
+    from aiohttp import web
+
+    async def send(request):
+        response = web.StreamResponse()
+        await response.prepare(request)
+        chunk = 1 << 16
+        with open(os.path.join(directory, request.match_info["name"]), "rb") as f:
+            for block in iter(lambda: f.read(chunk), b""):
+                await response.write(block)
+                await asyncio.sleep(len(block) / (bandwidth * 1024 ** 2))
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_get("/{name}", send)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+async def sequential(base_url: str, names: list):
+    # what attachment.save() did: the whole body in memory, then written out
+    import aiohttp
+
+    async with aiohttp.ClientSession() as session:
+        for name in names:
+            async with session.get(f"{base_url}/{name}") as response:
+                body = await response.read()
+            path = os.path.join(os.getcwd(), "uploads", name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(body)
+
+
+async def ingest_all(ingest: Ingest, base_url: str, names: list, round_id: int):
+    results = await asyncio.gather(
+        *(ingest.fetch(f"{base_url}/{name}", name, attachment_path(f"{round_id}{i}", name)) for i, name in enumerate(names)),
+        return_exceptions=True,
+    )
+    return [r for r in results if isinstance(r, Exception)]
+
+
+async def timed(label: str, coroutine):
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    errors = await coroutine
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+    note = f"  ({len(errors)} rejected: {errors[0]})" if errors else ""
+    print(f"{label:<12} {elapsed:>7.2f}s {peak:>8.1f}MB{note}")
+
+
+async def main(args):
+    source = tempfile.mkdtemp(prefix="ingest-source-")
+    paths = make_recordings(source, args.files, args.seconds)
+    names = [os.path.basename(path) for path in paths]
+    size = os.path.getsize(paths[0]) / 1024 ** 2
+    print(f"{args.files} files of {size:.1f} MB at {args.bandwidth} MB/s each")
+
+    runner, base_url = await serve(source, args.bandwidth)
+    executor = StageExecutor()
+    ingest = Ingest(executor, concurrency=args.files)
+    small = Ingest(executor, max_bytes=int(size * 1024 ** 2 / 2))
+    tracemalloc.start()
+    try:
+        print(f"{'':<12} {'wall':>8} {'heap peak':>10}")
+        await timed("sequential", sequential(base_url, names))
+        await timed("ingest", ingest_all(ingest, base_url, names, 1))
+        await timed("re-upload", ingest_all(ingest, base_url, names, 2))
+        await timed("oversized", ingest_all(small, base_url, names[:1], 3))
+        print(f"ingest: {ingest.metrics()}")
+    finally:
+        tracemalloc.stop()
+        await ingest.close()
+        await small.close()
+        await runner.cleanup()
+        executor.shutdown()
+        shutil.rmtree(source, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--seconds", type=int, default=120)
+    parser.add_argument("--bandwidth", type=float, default=4.0, help="MB/s per download")
+    args = parser.parse_args()
+    # the uploads, results and artifact cache go in a scratch directory
+    home = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="ingest-")
+    os.chdir(workdir)
+    try:
+        asyncio.run(main(args))
+    finally:
+        os.chdir(home)
+        shutil.rmtree(workdir, ignore_errors=True)
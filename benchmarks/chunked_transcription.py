@@ -0,0 +1,136 @@
+# Correctness and scaling of chunked transcription.
+#
+#   python -m benchmarks.chunked_transcription --minutes 10 --workers 1 2 4 8
+#
+# Part 1 always runs: known notes are cut into overlapping windows (with onset jitter)
+# and merged back, checking that overlaps are deduplicated and held notes stitched. It
+# exits non-zero if a note is lost or comes out twice.
+# Part 2 needs transkun, and is skipped without it: it renders synthetic piano-like tones
+# with known pitches to a WAV file, transcribes it whole and in chunks, and reports note
+# recall and speedup against the number of worker processes.
+
+import argparse
+import math
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import wave
+from transcribe.chunked import merge_chunk_notes, windows, transcribe_chunked
+from audio.pcm_cache import SAMPLE_RATE
+
+
+def synthetic_notes(seconds: float, seed: int = 0):
+    rng = random.Random(seed)
+    notes = []
+    t = 0.5
+    while t < seconds - 3:
+        length = rng.choice([0.25, 0.5, 1.0, 2.0, 8.0])
+        notes.append((t, min(t + length, seconds - 0.5), rng.randrange(48, 84), 90))
+        t += rng.uniform(0.3, 1.2)
+    return notes
+
+
+def match(expected: list, found: list, tolerance: float = 0.05):
+    # fraction of expected notes with a same-pitch onset within tolerance, and of those, ends within tolerance
+    onsets = ends = 0
+    for start, end, pitch, _ in expected:
+        hits = [note for note in found if note[2] == pitch and abs(note[0] - start) <= tolerance]
+        if hits:
+            onsets += 1
+            ends += abs(hits[0][1] - end) <= max(tolerance, 0.1 * (end - start))
+    return onsets / len(expected), ends / max(onsets, 1)
+
+
+def check_merge(seconds: float):
+    rng = random.Random(1)
+    notes = synthetic_notes(seconds)
+    chunks = []
+    for window_start, window_end in windows(seconds):
+        seen = []
+        for start, end, pitch, velocity in notes:
+            if end > window_start and start < window_end:
+                jitter = rng.uniform(-0.01, 0.01)
+                seen.append((max(start, window_start) + jitter, min(end, window_end) + jitter, pitch, velocity))
+        chunks.append((window_start, window_end, seen))
+
+    merged = merge_chunk_notes(chunks)
+    onset_recall, end_accuracy = match(notes, merged)
+    duplicates = len(merged) - len(notes)
+    print(f"merge check: {len(notes)} notes over {len(chunks)} windows -> {len(merged)} merged, "
+          f"onset recall {onset_recall:.3f}, ends correct {end_accuracy:.3f}, extra notes {duplicates}")
+    # a note lost or doubled at a window boundary is a merge bug
+    return onset_recall == 1.0 and duplicates <= 0
+
+
+def render(notes: list, seconds: float, path: str):
+    # decaying harmonics, close enough to a piano for the transcriber
+    samples = [0.0] * int(seconds * SAMPLE_RATE)
+    for start, end, pitch, _ in notes:
+        frequency = 440.0 * 2 ** ((pitch - 69) / 12)
+        first, last = int(start * SAMPLE_RATE), int(end * SAMPLE_RATE)
+        for n in range(first, last):
+            t = (n - first) / SAMPLE_RATE
+            envelope = math.exp(-3 * t) * min(1.0, (last - n) / 200)
+            samples[n] += 0.15 * envelope * sum(math.sin(2 * math.pi * frequency * h * t) / h for h in (1, 2, 3))
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(b"".join(struct.pack("<h", int(max(-1.0, min(1.0, s)) * 32767)) for s in samples))
+
+
+def read_notes(midi_path: str):
+    import pretty_midi
+    midi = pretty_midi.PrettyMIDI(midi_path)
+    return [(n.start, n.end, n.pitch, n.velocity) for instrument in midi.instruments for n in instrument.notes]
+
+
+def scaling(seconds: float, worker_counts: list):
+    from transcribe.transkun_worker import TranskunWorker
+
+    tmp = tempfile.mkdtemp()
+    audio_path = os.path.join(tmp, "synthetic.wav")
+    notes = synthetic_notes(seconds, seed=2)
+    render(notes, seconds, audio_path)
+
+    # baseline: the resident worker with its model already loaded, one process for the whole file
+    worker = TranskunWorker(device="cpu")
+    worker.submit(audio_path, os.path.join(tmp, "whole.mid"), use_cache=False).result()
+    started = time.perf_counter()
+    worker.submit(audio_path, os.path.join(tmp, "whole.mid"), use_cache=False).result()
+    whole_time = time.perf_counter() - started
+    worker.stop()
+    whole_recall, _ = match(notes, read_notes(os.path.join(tmp, "whole.mid")))
+    print(f"whole file, one process: {whole_time:.1f}s, onset recall {whole_recall:.3f}")
+
+    for workers in worker_counts:
+        output_path = os.path.join(tmp, f"chunked_{workers}.mid")
+        # first call warms the pool (each process loads the model), the second is timed
+        transcribe_chunked(audio_path, output_path, workers=workers, use_cache=False)
+        started = time.perf_counter()
+        transcribe_chunked(audio_path, output_path, workers=workers, use_cache=False)
+        elapsed = time.perf_counter() - started
+        recall, _ = match(notes, read_notes(output_path))
+        print(f"chunked, {workers} workers: {elapsed:.1f}s, speedup {whole_time / elapsed:.2f}x, onset recall {recall:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=10)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--merge-only", action="store_true")
+    args = parser.parse_args()
+
+    if not check_merge(args.minutes * 60):
+        print("merge check failed: notes were lost or duplicated between windows")
+        sys.exit(1)
+    if not args.merge_only:
+        try:
+            import transkun  # noqa: F401
+        except ImportError:
+            print("transkun is not installed: skipping part 2 (pass --merge-only to run just part 1)")
+        else:
+            scaling(args.minutes * 60, args.workers)
@@ -0,0 +1,74 @@
+# Decode/encode time on a TRIM -> STEM_SEPARATION + MIDI chain: per-stage pydub decoding vs the PCM cache.
+#
+#   python -m benchmarks.decode_once song.mp3 --start 30 --end 90
+#
+# Only the audio handling around the models is timed (the models themselves are the same
+# either way). Both chains encode the trimmed mp3 once, for the reply. Needs ffmpeg.
+# Runs in a temporary directory so the bot's own cache is left alone.
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+
+def old_chain(audio_path: str, start: float, end: float, workdir: str):
+    import numpy as np
+    from pydub import AudioSegment
+
+    def load(path):
+        # what demucs and transkun each did with their input file
+        audio = AudioSegment.from_file(path).set_frame_rate(44100)
+        samples = np.array(audio.get_array_of_samples()).reshape(-1, audio.channels)
+        return samples.astype(np.float32) / 32768.0
+
+    trimmed_path = os.path.join(workdir, "trimmed.mp3")
+    AudioSegment.from_file(audio_path)[start * 1000:end * 1000].export(trimmed_path, format="mp3")
+    load(trimmed_path)  # separation input
+    load(trimmed_path)  # transcription input
+
+
+def new_chain(audio_path: str, start: float, end: float):
+    from audio.pcm_cache import decode, encode
+
+    trimmed = decode(audio_path).slice(start, end)
+    encode(trimmed, "mp3")  # the reply
+    trimmed.float32()  # separation input
+    trimmed.float32()  # transcription input
+
+
+def main(args):
+    audio_path = os.path.abspath(args.audio)
+    workdir = tempfile.mkdtemp(prefix="decode-once-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        rows = []
+        for run in range(args.repeat):
+            started = time.perf_counter()
+            old_chain(audio_path, args.start, args.end, workdir)
+            old_time = time.perf_counter() - started
+
+            # the first run decodes the source; later runs find it (and the trim's mp3) in the cache
+            started = time.perf_counter()
+            new_chain(audio_path, args.start, args.end)
+            new_time = time.perf_counter() - started
+            rows.append((run, old_time, new_time))
+
+        print(f"{'run':<6} {'per stage':>10} {'pcm cache':>10} {'saved':>8}")
+        for run, old_time, new_time in rows:
+            label = "cold" if run == 0 else "warm"
+            print(f"{label:<6} {old_time:>9.2f}s {new_time:>9.2f}s {old_time - new_time:>7.2f}s")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("audio")
+    parser.add_argument("--start", type=float, default=30)
+    parser.add_argument("--end", type=float, default=90)
+    parser.add_argument("--repeat", type=int, default=3)
+    main(parser.parse_args())
@@ -0,0 +1,169 @@
+# Posting results: the old reply per result against the delivery stage, on a simulated Discord.
+#
+#   python -m benchmarks.delivery --limit 10 --bandwidth 8
+#
+# The stand-in channel takes --bandwidth MB/s per upload plus a fixed round trip, allows
+# five messages per five seconds (more wait out the rate limit, as discord.py does after a
+# 429) and rejects a message whose files add up to more than --limit MB. Each scenario's
+# results arrive at the times the pipeline would post them. "before" is the old
+# send_results, one reply per result; "after" is Delivery.post. Reports the time from a
+# result arriving to its reply being sent, and the share of results that never made it.
+# The audio is generated with ffmpeg (also needed for the re-encoding); needs discord.py.
+
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from collections import deque
+from types import SimpleNamespace
+import discord
+from delivery import Delivery
+from executor import StageExecutor
+
+ROUND_TRIP = 0.25
+RATE_COUNT = 5
+RATE_SECONDS = 5.0
+
+
+def tone(path: str, seconds: int, bitrate: str = None):
+    args = ["ffmpeg", "-v", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}", "-ac", "2"]
+    if bitrate:
+        args += ["-b:a", bitrate]
+    subprocess.run(args + [path], check=True)
+    return path
+
+
+def make_files(directory: str):
+    files = {}
+    with open(os.path.join(directory, "song.mid"), "wb") as f:
+        f.write(os.urandom(20 * 1024))
+    files["midi"] = f.name
+    with open(os.path.join(directory, "song.musicxml"), "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<score-partwise version="4.0">' + "<note/>" * 40000 + "</score-partwise>\n")
+    files["musicxml"] = f.name
+    for stem in ("vocals", "drums", "bass", "other"):
+        files[stem] = tone(os.path.join(directory, f"{stem}.wav"), 180)
+    files["trim"] = tone(os.path.join(directory, "long_trim.mp3"), 720, "192k")
+    for i in range(6):
+        with open(os.path.join(directory, f"take{i}.mid"), "wb") as f:
+            f.write(os.urandom(15 * 1024))
+        files[f"take{i}"] = f.name
+    return files
+
+
+def scenarios(files: dict):
+    # name -> [(seconds after the first result, label, value)]
+    return {
+        "sheet music": [(0.0, "MIDI: ", files["midi"]), (0.05, "Editable sheet music: ", files["musicxml"])],
+        "four stems": [(0.0, f"Stem separation for {stem}: ", files[stem]) for stem in ("vocals", "drums", "bass", "other")],
+        "long trim": [(0.0, "Trimmed audio: ", files["trim"])],
+        "six MIDIs": [(0.02 * i, "MIDI: ", files[f"take{i}"]) for i in range(6)] + [(0.1, "Search results: ", None)],
+    }
+
+
+class SimulatedChannel:
+    def __init__(self, limit: int, bandwidth: float):
+        self.id = 1
+        self.limit = limit
+        self.bandwidth = bandwidth
+        self.sent = deque()
+
+    async def send(self, files: list):
+        # wait out the rate limit
+        while len(self.sent) >= RATE_COUNT and time.perf_counter() - self.sent[0] < RATE_SECONDS:
+            await asyncio.sleep(self.sent[0] + RATE_SECONDS - time.perf_counter())
+        if len(self.sent) >= RATE_COUNT:
+            self.sent.popleft()
+        self.sent.append(time.perf_counter())
+        size = 0
+        for file in files:
+            size += file.fp.seek(0, os.SEEK_END)
+            file.close()
+        if size > self.limit:
+            await asyncio.sleep(ROUND_TRIP)
+            raise discord.DiscordException("413 Payload Too Large")
+        await asyncio.sleep(ROUND_TRIP + size / (self.bandwidth * 1024 ** 2))
+
+
+class SimulatedMessage:
+    def __init__(self, channel: SimulatedChannel, message_id: int):
+        self.id = message_id
+        self.channel = channel
+        self.guild = SimpleNamespace(filesize_limit=channel.limit)
+
+    async def reply(self, content=None, file=None, files=None):
+        await self.channel.send([file] if file else list(files or []))
+
+
+async def legacy_send(message, res: str, file_path):
+    # the old send_results for one result
+    if file_path:
+        try:
+            await message.reply(res, file=discord.File(file_path))
+        except Exception:
+            return False
+    else:
+        await message.reply(res)
+    return True
+
+
+async def run(results: list, send):
+    async def one(at: float, label: str, value):
+        await asyncio.sleep(at)
+        arrived = time.perf_counter()
+        sent = await send(label, value)
+        return time.perf_counter() - arrived, sent
+
+    outcomes = await asyncio.gather(*(one(*result) for result in results))
+    latencies = [seconds for seconds, _ in outcomes]
+    failed = sum(1 for _, sent in outcomes if not sent)
+    return sum(latencies) / len(latencies), max(latencies), failed / len(outcomes)
+
+
+async def main(args):
+    source = tempfile.mkdtemp(prefix="delivery-source-")
+    files = make_files(source)
+    executor = StageExecutor()
+    delivery = Delivery(executor)
+    limit = int(args.limit * 1024 ** 2)
+
+    print(f"{'scenario':<14} {'before mean':>12} {'max':>7} {'failed':>7}   {'after mean':>11} {'max':>7} {'failed':>7}")
+    totals = {"before": [], "after": []}
+    try:
+        for i, (name, results) in enumerate(scenarios(files).items()):
+            # a fresh channel each time, so one scenario's rate limit doesn't slow the next
+            message = SimulatedMessage(SimulatedChannel(limit, args.bandwidth), 2 * i)
+            before = await run(results, lambda label, value: legacy_send(message, label, value))
+            message = SimulatedMessage(SimulatedChannel(limit, args.bandwidth), 2 * i + 1)
+            after = await run(results, lambda label, value: delivery.post(message, label, value))
+            totals["before"].append(before[2] * len(results))
+            totals["after"].append(after[2] * len(results))
+            print(
+                f"{name:<14} {before[0]:>11.2f}s {before[1]:>6.2f}s {before[2]:>7.0%}   "
+                f"{after[0]:>10.2f}s {after[1]:>6.2f}s {after[2]:>7.0%}"
+            )
+        count = sum(len(results) for results in scenarios(files).values())
+        print(f"failure rate: before {sum(totals['before']) / count:.0%}, after {sum(totals['after']) / count:.0%}")
+        print(f"delivery: {delivery.metrics()}")
+    finally:
+        executor.shutdown()
+        shutil.rmtree(source, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=float, default=10, help="upload limit, MB")
+    parser.add_argument("--bandwidth", type=float, default=8, help="upload speed, MB/s")
+    args = parser.parse_args()
+    # re-encoded files and the artifact cache go in a scratch directory
+    home = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="delivery-")
+    os.chdir(workdir)
+    try:
+        asyncio.run(main(args))
+    finally:
+        os.chdir(home)
+        shutil.rmtree(workdir, ignore_errors=True)
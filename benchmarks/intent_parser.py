@@ -0,0 +1,94 @@
+# Share of messages the intent parser serves without an LLM call, and how long parsing takes.
+#
+#   python -m benchmarks.intent_parser [--repeat 3] [--verbose]
+#
+# Messages that miss the fast path are "answered" by a stub LLM; repeating the corpus shows
+# what the response cache adds once the same messages come back with the same song context.
+# Exits non-zero if the fast path answers one of the FALL_THROUGH messages, whose meaning
+# (a negation, an exclusion) its rules would get wrong.
+
+import argparse
+import json
+import sys
+import time
+from intent import IntentParser
+
+LINK = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+MESSAGES = [
+    f"Create sheet music for this song: {LINK}",
+    f"Can you convert this to MIDI: {LINK}",
+    f"midi and sheet music please {LINK}",
+    f"Trim this audio from 1:30 to 2:45: {LINK}",
+    "trim https://youtu.be/dQw4w9WgXcQ from 90s to 120s and give me the midi",
+    f"Separate this audio and give me the vocals {LINK}",
+    f"isolate the drums and bass from {LINK}",
+    f"stems for {LINK}",
+    "Search for a performance of Fur Elise and provide me sheet music",
+    "Separate this audio and give me the vocals",
+    "give me the first 30 seconds of the last song",
+    f"what key is this in? {LINK}",
+    f"separate the piano and make sheet music of it {LINK}",
+    f"transcribe {LINK} but not the intro",
+]
+
+# must go to the LLM
+FALL_THROUGH = [
+    f"Convert {LINK} to midi, no sheet music please",
+    f"Separate the vocals from the other instruments {LINK}",
+    f"just the midi of {LINK}, no score",
+    f"only the drums stem of {LINK}",
+    f"separate {LINK} into stems except the bass",
+    f"sheet music of {LINK} instead of midi",
+]
+MESSAGES += FALL_THROUGH
+
+
+def main(args):
+    parser = IntentParser()
+    for _ in range(args.repeat):
+        for text in MESSAGES:
+            requests = parser.parse(text)
+            if requests is None:
+                key = parser.cache_key(text, "---[]---")
+                requests = parser.cached(key)
+                if requests is None:
+                    requests = [{"type": "MIDI", "youtube_link": "none", "file_path": "none"}]
+                    parser.remember(key, requests)
+                    source = "llm"
+                else:
+                    source = "cache"
+            else:
+                source = "fast path"
+            if args.verbose:
+                print(f"{source:<10} {text[:60]:<60} {json.dumps(requests)[:120]}")
+
+    metrics = parser.metrics()
+    fast = sum(1 for text in MESSAGES if IntentParser().parse(text) is not None)
+
+    # time the parser on its own, on hits and misses alike
+    started = time.perf_counter()
+    rounds = 2000
+    for _ in range(rounds):
+        for text in MESSAGES:
+            parser.parse(text)
+    per_message = (time.perf_counter() - started) / (rounds * len(MESSAGES))
+    times = parser.metrics()
+
+    print(f"corpus: {len(MESSAGES)} messages, {fast} ({fast / len(MESSAGES):.0%}) on the fast path")
+    print(f"over {args.repeat} passes: served without LLM {metrics['served_without_llm']:.0%} "
+          f"(fast path {metrics['fast_path']}, cache hits {metrics['cache_hits']}, llm calls {metrics['llm_calls']})")
+    print(f"parse time: mean {per_message * 1e6:.1f} us, p50 {times['parse_time_p50'] * 1e6:.1f} us, p95 {times['parse_time_p95'] * 1e6:.1f} us")
+
+    wrong = [(text, requests) for text in FALL_THROUGH for requests in [IntentParser().parse(text)] if requests is not None]
+    for text, requests in wrong:
+        print(f"should have gone to the LLM: {text!r} -> {json.dumps(requests)}")
+    if wrong:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--verbose", action="store_true")
+    main(parser.parse_args())
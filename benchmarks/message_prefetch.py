@@ -0,0 +1,127 @@
+# Time to first artifact with and without fetching a message's links and uploads during the LLM call.
+#
+#   python -m benchmarks.message_prefetch --scale 0.1
+#
+# A stub LLM, downloader, upload and decode with fixed delays (seconds below, multiplied by
+# --scale) stand in for Mistral, yt_dlp, Discord and ffmpeg; times are reported unscaled.
+# "after LLM" is the old order: uploads saved before the LLM call, links downloaded after it.
+
+import argparse
+import asyncio
+import functools
+import time
+from types import SimpleNamespace
+from executor import StageExecutor
+from pipeline import compile_requests, run_plan
+from youtube.prefetch import Prefetcher
+
+STAGE_SECONDS = {
+    "llm": 1.5,
+    "download": 4.0,
+    "upload": 1.0,
+    "decode": 0.5,
+    "transcribe": 2.0,
+    "score": 3.0,
+}
+
+LINK = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+UPLOAD = "uploads/recording.mp3"
+
+MESSAGES = {
+    "MIDI of a link": (f"midi of {LINK} please", [], [
+        {"type": "MIDI", "youtube_link": LINK, "file_path": "none"},
+    ]),
+    "SHEET_MUSIC of a link": (f"can I get sheet music for {LINK}", [], [
+        {"type": "SHEET_MUSIC", "youtube_link": LINK, "file_path": "none"},
+    ]),
+    "MIDI of an upload": ("transcribe this one", [UPLOAD], [
+        {"type": "MIDI", "youtube_link": "none", "file_path": UPLOAD},
+    ]),
+}
+
+
+class StubStages:
+    def __init__(self, scale: float):
+        self.scale = scale
+        self.executor = StageExecutor(io_workers=8)
+        self.prefetcher = Prefetcher(self.executor, download=self._download, decode=self._decode)
+        # what the artifact and PCM caches would hold by now
+        self.downloaded = set()
+        self.decoded = set()
+
+    def _sleep(self, stage: str):
+        time.sleep(STAGE_SECONDS[stage] * self.scale)
+
+    def _download(self, url, start_time=None, end_time=None, cancel=None):
+        if url not in self.downloaded:
+            self._sleep("download")
+            self.downloaded.add(url)
+        return "uploads/song.mp3"
+
+    def _decode(self, path):
+        if path not in self.decoded:
+            self._sleep("decode")
+            self.decoded.add(path)
+        return path
+
+    async def save_upload(self, path):
+        await asyncio.sleep(STAGE_SECONDS["upload"] * self.scale)
+        return path
+
+    async def download_audio(self, youtube_link, start_time=None, end_time=None):
+        in_flight = self.prefetcher.claim(youtube_link)
+        if in_flight is not None:
+            return await in_flight
+        return await self.executor.run_io("download", self._download, youtube_link)
+
+    async def decode_audio(self, path):
+        in_flight = self.prefetcher.claim(path)
+        if in_flight is not None:
+            await in_flight
+        return await self.executor.run_io("decode", self._decode, path)
+
+    async def transcribe_to_midi(self, audio):
+        await asyncio.sleep(STAGE_SECONDS["transcribe"] * self.scale)
+        return "results/song.mid"
+
+    async def convert_to_sheet_music(self, midi):
+        await asyncio.sleep(STAGE_SECONDS["score"] * self.scale)
+        return "results/song.musicxml"
+
+
+async def handle(text: str, uploads: list, requests: list, scale: float, prefetch: bool):
+    stages = StubStages(scale)
+    session = SimpleNamespace(youtube_to_audio_path={}, last_audio_path=None, last_link=None, songs=[])
+    saves = {path: functools.partial(stages.save_upload, path) for path in uploads}
+    started = time.perf_counter()
+    first = []
+
+    async def on_result(label, value):
+        if not first:
+            first.append(time.perf_counter() - started)
+
+    if prefetch:
+        stages.prefetcher.prefetch_message(text, saves)
+    else:
+        for save in saves.values():
+            await save()
+    # the stub LLM
+    await asyncio.sleep(STAGE_SECONDS["llm"] * scale)
+    await run_plan(compile_requests(requests, stages, session), on_result)
+    stages.executor.shutdown()
+    return first[0]
+
+
+async def main(args):
+    print(f"{'message':<24} {'after LLM':>10} {'during LLM':>11} {'saved':>7}")
+    for name, (text, uploads, requests) in MESSAGES.items():
+        after = await handle(text, uploads, requests, args.scale, prefetch=False)
+        during = await handle(text, uploads, requests, args.scale, prefetch=True)
+        print(f"{name:<24} {after / args.scale:>9.1f}s {during / args.scale:>10.1f}s {(after - during) / args.scale:>6.1f}s")
+    print(f"(times are in unscaled stage seconds; LLM {STAGE_SECONDS['llm']}s, download {STAGE_SECONDS['download']}s; --scale {args.scale})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=0.1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,113 @@
+# PDF rendering: the inline score2pdf call against the warm render pool, on the CPU.
+#
+#   python -m benchmarks.pdf_render --scores 8 --measures 32 --workers 2
+#
+# Generates --scores random piano scores of --measures measures as MusicXML, then renders
+# each one: "inline" calls score2pdf one after another in a fresh process (as the SHEET_MUSIC
+# path would, the music21 import landing on the first call), "pool" submits them all to a
+# RenderPool that was warmed beforehand, and "pool again" renders the same scores once more,
+# finding them parsed. Reports renders per minute and per-render latency. Needs music21 and
+# LilyPond.
+
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from transcribe.render_pool import RenderPool
+
+INLINE = """
+import json, sys, time
+from transcribe.midi2score import score2pdf
+latencies = []
+for path in sys.argv[1:]:
+    started = time.perf_counter()
+    score2pdf(path)
+    latencies.append(time.perf_counter() - started)
+print(json.dumps(latencies))
+"""
+
+
+def make_scores(directory: str, count: int, measures: int, seed: int = 0):
+    from music21 import note, stream
+
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        part = stream.Part()
+        for _ in range(measures * 4):
+            part.append(note.Note(rng.randint(48, 84), quarterLength=rng.choice([0.5, 1.0, 1.0, 2.0])))
+        path = os.path.join(directory, f"score{i}.musicxml")
+        stream.Score([part]).write("musicxml", fp=path)
+        paths.append(path)
+    return paths
+
+
+def digest(path: str):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def summary(label: str, latencies: list, elapsed: float):
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2]
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{label:<12} {len(latencies) / elapsed * 60:>8.1f} {p50:>7.2f}s {p95:>7.2f}s {ordered[-1]:>7.2f}s")
+
+
+def inline(paths: list):
+    import json
+
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-c", INLINE, *paths], capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), time.perf_counter() - started
+
+
+async def pooled(pool: RenderPool, paths: list, output_dir: str):
+    async def one(path: str):
+        started = time.perf_counter()
+        output_path = os.path.join(output_dir, os.path.basename(path).replace(".musicxml", ".pdf"))
+        await pool.render(path, digest(path), output_path)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(one(path) for path in paths))
+    return list(latencies), time.perf_counter() - started
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="pdf-render-")
+    try:
+        paths = make_scores(workdir, args.scores, args.measures)
+        print(f"{'':<12} {'per min':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+        latencies, elapsed = inline(paths)
+        summary("inline", latencies, elapsed)
+
+        pool = RenderPool(workers=args.workers, cache_size=args.scores)
+        started = time.perf_counter()
+        await pool.warm()
+        print(f"(pool of {args.workers} warmed up in {time.perf_counter() - started:.1f}s)")
+        try:
+            for label in ("pool", "pool again"):
+                output_dir = os.path.join(workdir, label.replace(" ", "_"))
+                os.makedirs(output_dir)
+                latencies, elapsed = await pooled(pool, paths, output_dir)
+                summary(label, latencies, elapsed)
+            print(f"render pool: {pool.metrics()}")
+        finally:
+            pool.shutdown()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scores", type=int, default=8)
+    parser.add_argument("--measures", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
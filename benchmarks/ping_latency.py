@@ -0,0 +1,90 @@
+# Does the bot stay responsive while a separation runs? !ping latency during a long CPU job.
+#
+#   python -m benchmarks.ping_latency --seconds 5 --max-ms 50
+#
+# Starts a fake separation (a CPU-bound loop of --seconds) through StageExecutor.run_cpu on
+# the "separate" stage, and while it runs calls bot.ping every --interval seconds with a
+# stand-in command context, timing each call from when it was due to when "Pong!" was sent.
+# Without discord.py installed the ping command can't be imported, and the same timing is
+# taken of a bare event-loop wake-up instead. Exits non-zero if the worst latency is over
+# --max-ms, or if the separation finished before any ping was timed.
+
+import argparse
+import asyncio
+import sys
+import time
+from executor import StageExecutor
+
+
+def fake_separation(seconds: float):
+    # busy, like demucs, rather than sleeping
+    deadline = time.perf_counter() + seconds
+    spins = 0
+    while time.perf_counter() < deadline:
+        spins += 1
+    return spins
+
+
+class Context:
+    # what ping uses of a commands.Context
+    def __init__(self):
+        self.sent_at = None
+
+    async def send(self, content):
+        self.sent_at = time.perf_counter()
+
+
+async def ping_once():
+    try:
+        from bot import ping
+    except ImportError:
+        ping = None
+
+    due = time.perf_counter()
+    if ping is None:
+        await asyncio.sleep(0)
+        return time.perf_counter() - due
+    ctx = Context()
+    await ping(ctx)
+    return ctx.sent_at - due
+
+
+async def main(args):
+    executor = StageExecutor(cpu_workers=1)
+    # start the worker process first, so the timing is of the separation and not of spawning
+    await executor.run_cpu("separate", fake_separation, 0)
+
+    separation = asyncio.ensure_future(executor.run_cpu("separate", fake_separation, args.seconds))
+    latencies = []
+    while not separation.done():
+        # sleeping overshoots by however long the loop was blocked; that counts too
+        due = time.perf_counter() + args.interval
+        await asyncio.sleep(args.interval)
+        late = time.perf_counter() - due
+        latencies.append(late + await ping_once())
+    await separation
+    executor.shutdown()
+
+    try:
+        import bot  # noqa: F401
+        what = "!ping"
+    except ImportError:
+        what = "event loop wake-up (discord.py is not installed)"
+    if not latencies:
+        print("the separation finished before any ping was timed; raise --seconds")
+        sys.exit(1)
+    worst = max(latencies) * 1000
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2] * 1000
+    print(f"{what} during a {args.seconds:.0f} s separation: {len(latencies)} pings, p50 {p50:.2f} ms, max {worst:.2f} ms")
+    if worst > args.max_ms:
+        print(f"too slow: over {args.max_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--max-ms", type=float, default=50.0)
+    asyncio.run(main(parser.parse_args()))
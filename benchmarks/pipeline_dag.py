@@ -0,0 +1,149 @@
+# Wall-clock time of common multi-request messages: the stage graph vs the old sequential loop.
+#
+#   python -m benchmarks.pipeline_dag --scale 0.05
+#
+# Stages are stubs that sleep for a fixed time (seconds below, multiplied by --scale),
+# so this measures scheduling only, not the models.
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+from pipeline import compile_requests, run_plan
+
+STAGE_SECONDS = {
+    "download": 4.0,
+    "decode": 0.5,
+    "encode": 0.5,
+    "search": 1.5,
+    "trim": 1.0,
+    "separate": 30.0,
+    "transcribe": 20.0,
+    "score": 8.0,
+}
+
+LINK = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+MESSAGES = {
+    "MIDI + SHEET_MUSIC": [
+        {"type": "MIDI", "youtube_link": LINK, "file_path": "none"},
+        {"type": "SHEET_MUSIC", "youtube_link": LINK, "file_path": "none"},
+    ],
+    "MIDI + SHEET_MUSIC + STEM": [
+        {"type": "MIDI", "youtube_link": LINK, "file_path": "none"},
+        {"type": "SHEET_MUSIC", "youtube_link": LINK, "file_path": "none"},
+        {"type": "STEM_SEPARATION", "youtube_link": LINK, "file_path": "none", "instrument": "vocals"},
+    ],
+    "TRIM + MIDI + SHEET_MUSIC": [
+        {"type": "TRIM", "youtube_link": LINK, "start_time": 90, "end_time": 165},
+        {"type": "MIDI", "youtube_link": LINK, "file_path": "none"},
+        {"type": "SHEET_MUSIC", "youtube_link": LINK, "file_path": "none"},
+    ],
+    "SEARCH + SHEET_MUSIC + STEM": [
+        {"type": "SEARCH", "query": "fur elise"},
+        {"type": "SHEET_MUSIC", "youtube_link": "none", "file_path": "none"},
+        {"type": "STEM_SEPARATION", "youtube_link": "none", "file_path": "none", "instrument": "piano"},
+    ],
+}
+
+
+class StubStages:
+    def __init__(self, scale: float):
+        self.scale = scale
+        self.calls = 0
+
+    async def _stage(self, name: str, value):
+        self.calls += 1
+        await asyncio.sleep(STAGE_SECONDS[name] * self.scale)
+        return value
+
+    async def download_audio(self, youtube_link, start_time=None, end_time=None):
+        return await self._stage("download", "uploads/song.mp3")
+
+    async def decode_audio(self, audio_path):
+        return await self._stage("decode", audio_path)
+
+    async def encode_audio(self, audio):
+        return await self._stage("encode", audio)
+
+    async def search_youtube(self, query):
+        return await self._stage("search", [{"title": query, "url": LINK, "duration": 200}])
+
+    def prefetch_search(self, candidates):
+        pass
+
+    async def trim_audio(self, audio_path, start_time, end_time):
+        return await self._stage("trim", f"uploads/{start_time}_{end_time}_song.mp3")
+
+    async def stem_separation(self, audio_path, instrument):
+        return await self._stage("separate", f"separated/{instrument}.mp3")
+
+    async def transcribe_to_midi(self, audio_path):
+        return await self._stage("transcribe", "results/song.mid")
+
+    async def convert_to_sheet_music(self, midi_file_path):
+        return await self._stage("score", "results/song.musicxml")
+
+
+def new_session():
+    return SimpleNamespace(youtube_to_audio_path={}, last_audio_path=None, last_link=None, songs=[])
+
+
+async def sequential(json_list, stages, session):
+    # the loop handle_message used to run: one request at a time, nothing shared
+    for obj in json_list:
+        link = obj.get("youtube_link", "none")
+        cached = session.youtube_to_audio_path.get(link) if link != "none" else session.last_audio_path
+        if obj["type"] in ("MIDI", "SHEET_MUSIC"):
+            audio = cached or await stages.download_audio(link)
+            midi = await stages.transcribe_to_midi(audio)
+            if obj["type"] == "SHEET_MUSIC":
+                await stages.convert_to_sheet_music(midi)
+        if obj["type"] == "TRIM":
+            audio = cached or await stages.download_audio(link)
+            session.youtube_to_audio_path[link] = session.last_audio_path = await stages.trim_audio(audio, obj["start_time"], obj["end_time"])
+        if obj["type"] == "SEARCH":
+            result = await stages.search_youtube(obj["query"])
+            session.last_audio_path = await stages.download_audio(result[0]["url"])
+        if obj["type"] == "STEM_SEPARATION":
+            audio = cached or await stages.download_audio(link)
+            session.youtube_to_audio_path[link] = session.last_audio_path = await stages.stem_separation(audio, obj["instrument"])
+
+
+async def graph(json_list, stages, session):
+    first = []
+    started = time.perf_counter()
+
+    async def on_result(label, value):
+        if not first:
+            first.append(time.perf_counter() - started)
+
+    await run_plan(compile_requests(json_list, stages, session), on_result)
+    return first[0] if first else None
+
+
+async def main(args):
+    print(f"{'message':<30} {'sequential':>11} {'graph':>8} {'first result':>13} {'speedup':>8} {'stage runs':>11}")
+    for name, json_list in MESSAGES.items():
+        stages = StubStages(args.scale)
+        started = time.perf_counter()
+        await sequential(json_list, stages, new_session())
+        sequential_time = time.perf_counter() - started
+        sequential_calls = stages.calls
+
+        stages = StubStages(args.scale)
+        started = time.perf_counter()
+        first = await graph(json_list, stages, new_session())
+        graph_time = time.perf_counter() - started
+
+        print(
+            f"{name:<30} {sequential_time / args.scale:>10.1f}s {graph_time / args.scale:>7.1f}s "
+            f"{first / args.scale:>12.1f}s {sequential_time / graph_time:>7.2f}x {sequential_calls:>5} -> {stages.calls:<3}"
+        )
+    print(f"(times are in unscaled stage seconds; --scale {args.scale})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", type=float, default=0.02)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,126 @@
+# Bytes fetched and time taken by download_audio for a trim window vs the whole track.
+#
+#   python -m benchmarks.ranged_download --minutes 60 --start 600 --end 630
+#
+# A local HTTP server stands in for YouTube: it serves an ffmpeg-generated mp3 of the given
+# length, honours Range requests and counts the bytes it sends. Needs yt_dlp and ffmpeg.
+# Runs in a temporary directory so the bot's own cache is left alone.
+
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    media_path = None
+    bytes_sent = 0
+    requests = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def _respond(self, send_body: bool):
+        size = os.path.getsize(self.media_path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+
+        with self.lock:
+            MediaHandler.requests += 1
+        with open(self.media_path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                block = f.read(min(1 << 16, remaining))
+                if not block:
+                    break
+                try:
+                    self.wfile.write(block)
+                except (BrokenPipeError, ConnectionResetError):
+                    # ffmpeg hangs up once it has read what it needs
+                    break
+                remaining -= len(block)
+                with self.lock:
+                    MediaHandler.bytes_sent += len(block)
+
+
+def make_media(path: str, minutes: float):
+    subprocess.run(
+        ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={minutes * 60}",
+         "-ac", "2", "-b:a", "128k", path],
+        check=True,
+    )
+
+
+def measure(fn):
+    MediaHandler.bytes_sent = MediaHandler.requests = 0
+    started = time.perf_counter()
+    path = fn()
+    return time.perf_counter() - started, MediaHandler.bytes_sent, MediaHandler.requests, os.path.getsize(path)
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="ranged-download-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    server = None
+    try:
+        from youtube.download import download_audio
+
+        media_path = os.path.join(workdir, "livestream.mp3")
+        make_media(media_path, args.minutes)
+        MediaHandler.media_path = media_path
+        server = ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}/livestream.mp3"
+
+        rows = [
+            ("full", measure(lambda: download_audio(url))),
+            (f"{args.start:g}-{args.end:g}s", measure(lambda: download_audio(url, args.start, args.end))),
+        ]
+        print(f"source: {args.minutes:g} min, {os.path.getsize(media_path) / 1e6:.1f} MB")
+        print(f"{'download':<12} {'time':>8} {'fetched':>11} {'requests':>9} {'output':>10}")
+        for name, (seconds, fetched, requests, output) in rows:
+            print(f"{name:<12} {seconds:>7.2f}s {fetched / 1e6:>9.2f}MB {requests:>9} {output / 1e6:>8.2f}MB")
+        print(f"ranged fetch is {rows[1][1][1] / max(1, rows[0][1][1]):.1%} of the full download")
+    finally:
+        if server is not None:
+            server.shutdown()
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--minutes", type=float, default=60)
+    parser.add_argument("--start", type=float, default=600)
+    parser.add_argument("--end", type=float, default=630)
+    main(parser.parse_args())
@@ -0,0 +1,284 @@
+# Offline end-to-end benchmark: replay a message trace through MistralAgent with local stand-ins.
+#
+#   python -m benchmarks.replay --synthetic 200 --rate 0.05 --scale 0.02 --json results.json
+#   python -m benchmarks.replay --trace messages.jsonl --baseline results.json
+#
+# Every message goes through what on_message and run_job do with it: prefetching its links
+# and uploads, MistralAgent.run (intent parsing, the LLM, handle_message and the stage graph)
+# and the session updates, with Mistral, YouTube, transkun, demucs, ffmpeg and the scoring
+# service replaced by the stand-ins in benchmarks/standins.py. Messages arrive at their
+# trace times (multiplied by --scale, like every latency); reported times are unscaled.
+#
+# A trace is JSON lines of {"at": seconds, "channel": id, "user": id, "content": text} with
+# optional "attachments" (file names), "reply" (the request list the LLM would return) and
+# "follow_up" (sent only once the channel's earlier messages were answered, as someone
+# asking about "that one" would).
+# --save-trace writes the synthetic one out. --json saves the results and --baseline prints
+# them next to an earlier run's, so the same trace can be compared between commits.
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from benchmarks.standins import DEFAULT_SERVICES, StandIns, parse_overrides
+
+LINKS = 40
+PIECES = ["fur elise", "moonlight sonata", "clair de lune", "gymnopedie no 1", "canon in d", "river flows in you"]
+
+
+def link(n: int):
+    return f"https://www.youtube.com/watch?v=video{n:06d}"
+
+
+def synthetic(count: int, rate: float, seed: int = 0, channels: int = 20):
+    """
+    A mix of the messages the bot sees, with links repeating on a skewed distribution and
+    follow-ups that refer back to the channel's last song.
+    """
+    rng = random.Random(seed)
+    weights = [1 / (i + 1) for i in range(LINKS)]
+    at = 0.0
+    trace = []
+    seen = set()
+    for i in range(count):
+        at += rng.expovariate(rate) if rate else 0.0
+        channel = rng.randrange(channels)
+        url = link(rng.choices(range(LINKS), weights)[0])
+        kind = rng.choices(["sheet", "midi", "trim", "stem", "search", "follow_up", "upload"], [4, 3, 1, 2, 1, 2, 1])[0]
+        if kind == "follow_up" and channel not in seen:
+            kind = "sheet"
+        # MIDI and sheet music leave the session no audio for "that one" to refer to
+        if kind in ("trim", "stem", "search", "upload"):
+            seen.add(channel)
+        # one user per channel, so follow-ups find the song whichever way sessions are keyed
+        entry = {"at": round(at, 3), "channel": channel, "user": 1000 + channel}
+        if kind == "sheet":
+            entry.update(content=f"sheet music for {url}", reply=[{"type": "SHEET_MUSIC", "youtube_link": url, "file_path": "none"}])
+        elif kind == "midi":
+            entry.update(content=f"can you turn {url} into midi", reply=[{"type": "MIDI", "youtube_link": url, "file_path": "none"}])
+        elif kind == "trim":
+            entry.update(content=f"trim {url} from 0:30 to 1:00", reply=[{"type": "TRIM", "youtube_link": url, "start_time": 30, "end_time": 60}])
+        elif kind == "stem":
+            entry.update(
+                content=f"I'd love to hear just the vocals of {url} if that's possible",
+                reply=[{"type": "STEM_SEPARATION", "youtube_link": url, "file_path": "none", "instrument": "vocals"}],
+            )
+        elif kind == "search":
+            piece = rng.choice(PIECES)
+            entry.update(
+                content=f"find me a recording of {piece} and make sheet music of it",
+                reply=[{"type": "SEARCH", "query": piece}, {"type": "SHEET_MUSIC", "youtube_link": "none", "file_path": "none"}],
+            )
+        elif kind == "follow_up":
+            entry.update(follow_up=True, content="now give me the piano part of that one", reply=[{"type": "STEM_SEPARATION", "youtube_link": "none", "file_path": "none", "instrument": "piano"}])
+        else:
+            entry.update(
+                content="transcribe what I just played", attachments=[f"recording{i}.mp3"],
+                reply=[{"type": "MIDI", "youtube_link": "none", "file_path": "none"}],
+            )
+        trace.append(entry)
+    return trace
+
+
+def load_trace(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class _Named:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class ReplayMessage:
+    # what MistralAgent reads from a discord.Message
+    def __init__(self, message_id: int, entry: dict):
+        self.id = message_id
+        self.content = entry["content"]
+        self.channel = _Named(id=entry.get("channel", 0))
+        self.author = _Named(id=entry.get("user", 0), bot=False)
+        self.attachments = [_Named(filename=name) for name in entry.get("attachments", [])]
+        self.replies = []
+
+    async def reply(self, content=None, **kwargs):
+        self.replies.append(content)
+
+
+async def save_upload(path: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(os.urandom(4096))
+    return path
+
+
+async def deliver(agent, message: ReplayMessage):
+    from ingest import attachment_path
+    from intent import fast_parse
+    from sessions import session_key
+    from telemetry import telemetry
+
+    # on_message: note uploads in the session and start fetching, then parse and run
+    with telemetry.request(message.id):
+        history = ""
+        uploads = {}
+        for i, attachment in enumerate(message.attachments):
+            path = attachment_path(f"{message.id}{i}", attachment.filename)
+            uploads[path] = functools.partial(save_upload, path)
+            with agent.sessions.use(session_key(message.channel.id, message.author.id)) as session:
+                session.last_audio_path = path
+                session.songs.append({"youtube_link": None, "file_path": path, "name": attachment.filename})
+            history += f"----Uploaded file: {attachment.filename}---\n"
+        with agent.sessions.use(session_key(message.channel.id, message.author.id)) as session:
+            have = {vid for vid, path in session.youtube_to_audio_path.items() if os.path.exists(path)}
+        agent.prefetcher.prefetch_message(message.content, uploads, fast_parse(message.content, bool(message.attachments)), have)
+        return await agent.run(message, history)
+
+
+def percentile(values: list, q: float):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+async def replay(trace: list, stand_ins: StandIns, scale: float):
+    from agent import MistralAgent
+    from pipeline import UNKNOWN_REQUEST
+    from telemetry import telemetry
+
+    agent = MistralAgent()
+    await stand_ins.install(agent)
+    telemetry.histograms.clear()
+    telemetry.counters.clear()
+    telemetry.traces.clear()
+
+    latencies = []
+    failed = []
+    # channel -> the runs of its messages so far
+    sent = {}
+
+    async def run(message_id: int, entry: dict, earlier: list):
+        await asyncio.sleep(max(0.0, entry.get("at", 0.0) * scale - (time.perf_counter() - started)))
+        if entry.get("follow_up"):
+            await asyncio.gather(*earlier, return_exceptions=True)
+        message = ReplayMessage(message_id, entry)
+        arrived = time.perf_counter()
+        try:
+            results = await deliver(agent, message)
+            # a request that failed comes back with its failure message and no value
+            failures = 0 if isinstance(results, str) else sum(1 for label, value in results if value is None and label != UNKNOWN_REQUEST)
+        except Exception as e:
+            print(f"Message {message_id} failed: {e}")
+            failures = 1
+        latencies.append((time.perf_counter() - arrived) / scale)
+        failed.append(failures)
+
+    started = time.perf_counter()
+    runs = []
+    for i, entry in enumerate(trace):
+        earlier = sent.setdefault(entry.get("channel", 0), [])
+        runs.append(asyncio.ensure_future(run(i, entry, list(earlier))))
+        earlier.append(runs[-1])
+    await asyncio.gather(*runs)
+    elapsed = time.perf_counter() - started
+
+    summary = telemetry.stage_summary()
+    intents = agent.intents.metrics()
+    prefetch = agent.prefetcher.metrics()
+    await stand_ins.close(agent)
+    agent.executor.shutdown()
+    return {
+        "messages": len(trace),
+        "seconds": elapsed / scale,
+        "throughput_per_min": len(trace) / (elapsed / scale) * 60,
+        "latency_p50": percentile(latencies, 0.5),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_max": max(latencies) if latencies else 0.0,
+        "failed_requests": sum(failed),
+        "stages": {stage: {"runs": runs, "p50": p50 / scale, "p95": p95 / scale, "errors": errors} for stage, (runs, p50, p95, errors) in summary.items()},
+        "served_without_llm": intents["served_without_llm"],
+        "prefetch": prefetch,
+        "stand_ins": stand_ins.metrics(),
+    }
+
+
+def report(results: dict, baseline: dict = None):
+    def compare(key, fmt, unit=""):
+        value = results[key]
+        text = format(value, fmt) + unit
+        if baseline is None or key not in baseline:
+            return text
+        before = baseline[key]
+        change = (value - before) / before if before else 0.0
+        return f"{text} ({change:+.0%})"
+
+    print(f"messages {results['messages']}, failed requests {results['failed_requests']}, served without the LLM {results['served_without_llm']:.0%}")
+    print(f"throughput  {compare('throughput_per_min', '.1f', ' messages/min')}")
+    print(f"latency     p50 {compare('latency_p50', '.1f', 's')}  p95 {compare('latency_p95', '.1f', 's')}  max {compare('latency_max', '.1f', 's')}")
+    print(f"peak RSS    {compare('peak_rss_mb', '.0f', ' MB')}" + (f", Python heap peak {compare('heap_peak_mb', '.0f', ' MB')}" if "heap_peak_mb" in results else ""))
+    print()
+    print(f"{'stage':<20} {'runs':>6} {'p50':>8} {'p95':>8} {'errors':>7}" + (f" {'p95 before':>11}" if baseline else ""))
+    for stage, row in results["stages"].items():
+        line = f"{stage:<20} {row['runs']:>6} {row['p50']:>7.2f}s {row['p95']:>7.2f}s {row['errors']:>7}"
+        if baseline:
+            before = baseline.get("stages", {}).get(stage)
+            line += f" {before['p95']:>10.2f}s" if before else f" {'-':>11}"
+        print(line)
+
+
+def main(args):
+    trace = load_trace(args.trace) if args.trace else synthetic(args.synthetic, args.rate, args.seed)
+    if args.save_trace:
+        with open(args.save_trace, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in trace)
+
+    services = parse_overrides(DEFAULT_SERVICES, args.latency, args.failures, args.concurrency)
+    replies = {entry["content"]: entry["reply"] for entry in trace if "reply" in entry}
+    stand_ins = StandIns(services, args.scale, replies)
+
+    # the agent keeps its caches, sessions and files under the working directory
+    home = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    os.chdir(workdir)
+    if args.tracemalloc:
+        tracemalloc.start()
+    try:
+        results = asyncio.run(replay(trace, stand_ins, args.scale))
+    finally:
+        os.chdir(home)
+        shutil.rmtree(workdir, ignore_errors=True)
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if args.tracemalloc:
+        results["heap_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trace", help="JSON lines trace to replay instead of a synthetic one")
+    parser.add_argument("--synthetic", type=int, default=200, help="messages in the synthetic trace")
+    parser.add_argument("--rate", type=float, default=0.05, help="synthetic messages per (unscaled) second")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-trace")
+    parser.add_argument("--scale", type=float, default=0.02)
+    parser.add_argument("--latency", nargs="*", default=[], help="stand-in latencies, e.g. llm=0.5 download=2")
+    parser.add_argument("--failures", nargs="*", default=[], help="stand-in failure rates, e.g. score=0.1")
+    parser.add_argument("--concurrency", nargs="*", default=[], help="calls a stand-in serves at once, e.g. download=2")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report the Python heap peak (slower)")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    main(parser.parse_args())
@@ -0,0 +1,94 @@
+# Load test for the job scheduler, driven by a fake Discord message source.
+#
+#   python -m benchmarks.scheduler_load --users 20 --messages 200 --workers 4
+#
+# One "heavy" user sends a burst at the start while the others trickle messages in.
+# Reports queue metrics plus how long each user waited for their first result, which
+# shows whether round-robin keeps the light users from being stuck behind the burst.
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from scheduler import JobScheduler, ACCEPTED, DEFERRED, REJECTED
+
+
+class FakeMessageSource:
+    def __init__(self, users: int, channels: int, messages: int, burst: int, seed: int = 0):
+        self.users = users
+        self.channels = channels
+        self.messages = messages
+        self.burst = burst
+        self.random = random.Random(seed)
+
+    async def __aiter__(self):
+        message_id = 0
+        # the heavy user dumps a burst of sheet music requests first
+        for _ in range(self.burst):
+            message_id += 1
+            yield 0, 0, message_id
+        for _ in range(self.messages - self.burst):
+            message_id += 1
+            await asyncio.sleep(self.random.expovariate(200))
+            yield self.random.randrange(1, self.users), self.random.randrange(self.channels), message_id
+
+
+async def main(args):
+    rng = random.Random(args.seed)
+    first_done = {}
+    started = time.perf_counter()
+
+    async def handler(job):
+        # stand-in for a pipeline: mostly short, sometimes a long separation
+        await asyncio.sleep(rng.choice([args.service, args.service, args.service * 5]))
+        first_done.setdefault(job.user_id, time.perf_counter() - started)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        scheduler = JobScheduler(
+            handler,
+            db_path=os.path.join(tmp, "queue.sqlite3"),
+            workers=args.workers,
+            high_water=args.high_water,
+            max_depth=args.max_depth,
+        )
+        await scheduler.start()
+
+        replies = {ACCEPTED: 0, DEFERRED: 0, REJECTED: 0}
+        source = FakeMessageSource(args.users, args.channels, args.messages, args.burst, args.seed)
+        async for user_id, channel_id, message_id in source:
+            status, _ = await scheduler.submit(user_id, channel_id, message_id, {"requests": "[]"})
+            replies[status] += 1
+
+        while scheduler.metrics()["queue_depth"] or scheduler.running:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        await scheduler.stop()
+
+    metrics = scheduler.metrics()
+    print(f"messages: {args.messages}  workers: {args.workers}  elapsed: {elapsed:.2f}s")
+    print(f"replies: accepted={replies[ACCEPTED]} deferred={replies[DEFERRED]} rejected={replies[REJECTED]}")
+    print(f"completed: {metrics['completed']}  failed: {metrics['failed']}  throughput: {metrics['completed'] / elapsed:.1f} jobs/s")
+    for name in ("wait_time", "service_time"):
+        summary = metrics[name]
+        print(f"{name}: mean={summary['mean'] * 1000:.0f}ms p95={summary['p95'] * 1000:.0f}ms max={summary['max'] * 1000:.0f}ms")
+
+    light = [t for user_id, t in first_done.items() if user_id != 0]
+    if light:
+        print(f"first result for light users: mean={sum(light) / len(light) * 1000:.0f}ms max={max(light) * 1000:.0f}ms")
+    print(f"first result for the burst user: {first_done.get(0, 0) * 1000:.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--service", type=float, default=0.02)
+    parser.add_argument("--high-water", type=int, default=40)
+    parser.add_argument("--max-depth", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,107 @@
+# Throughput of the scoring client against a local stand-in for the scoring service.
+#
+#   python -m benchmarks.scoring_client --jobs 200 --latency 0.2 --error-rate 0.1 --garbage-rate 0.05
+#
+# The stand-in answers POST /invocations after --latency seconds (+-50%), returning a 503 for
+# --error-rate of requests and an HTML error page with status 200 for --garbage-rate of them.
+# Each concurrency level gets a fresh client; the old one-connection-per-request blocking
+# requests.post loop is run for comparison at concurrency 1. Needs aiohttp (and requests).
+
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+from transcribe.score_client import ScoringClient, ScoringError
+
+MUSICXML = b'<?xml version="1.0" encoding="UTF-8"?>\n<score-partwise version="4.0">' + b"<part/>" * 2000 + b"</score-partwise>\n"
+ERROR_PAGE = b"<!DOCTYPE html><html><body><h1>Internal error</h1></body></html>"
+
+
+async def start_server(args):
+    from aiohttp import web
+
+    rng = random.Random(0)
+
+    async def invocations(request):
+        form = await request.post()
+        form["file"].file.read()
+        await asyncio.sleep(args.latency * rng.uniform(0.5, 1.5))
+        roll = rng.random()
+        if roll < args.error_rate:
+            return web.Response(status=503, text="busy")
+        if roll < args.error_rate + args.garbage_rate:
+            return web.Response(body=ERROR_PAGE, content_type="text/html")
+        return web.Response(body=MUSICXML, content_type="application/xml")
+
+    app = web.Application()
+    app.router.add_post("/invocations", invocations)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/invocations"
+
+
+def blocking_post(url: str, midi_path: str, output_path: str):
+    # what _midi2score used to do: a new connection per file, no status check
+    import requests
+
+    with open(midi_path, "rb") as f:
+        response = requests.post(url, files={"file": f})
+    with open(output_path, "w") as f:
+        f.write(response.text)
+
+
+async def run_level(url: str, concurrency: int, midi_paths: list, workdir: str):
+    client = ScoringClient(url=url, batch_url="", concurrency=concurrency, retries=3, breaker_failures=1000)
+    outputs = [os.path.join(workdir, f"out_{concurrency}_{i}.musicxml") for i in range(len(midi_paths))]
+    started = time.perf_counter()
+    results = await client.score_batch(midi_paths, outputs)
+    elapsed = time.perf_counter() - started
+    await client.close()
+    failed = sum(1 for result in results if isinstance(result, ScoringError))
+    return elapsed, failed, client.metrics()
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix="scoring-client-")
+    runner, url = await start_server(args)
+    try:
+        midi_path = os.path.join(workdir, "song.mid")
+        with open(midi_path, "wb") as f:
+            f.write(os.urandom(20 * 1024))
+        midi_paths = [midi_path] * args.jobs
+
+        print(f"{'client':<14} {'jobs/s':>8} {'failed':>7} {'retries':>8} {'p50':>8} {'p95':>8}")
+        if args.baseline:
+            jobs = min(args.jobs, 50)
+            started = time.perf_counter()
+            for i in range(jobs):
+                await asyncio.to_thread(blocking_post, url, midi_path, os.path.join(workdir, f"old_{i}.musicxml"))
+            print(f"{'requests x1':<14} {jobs / (time.perf_counter() - started):>8.1f} {'?':>7} {0:>8}")
+
+        for concurrency in args.concurrency:
+            elapsed, failed, metrics = await run_level(url, concurrency, midi_paths, workdir)
+            print(
+                f"{'pool x' + str(concurrency):<14} {args.jobs / elapsed:>8.1f} {failed:>7} {metrics['retries']:>8} "
+                f"{metrics['latency_p50'] * 1000:>6.0f}ms {metrics['latency_p95'] * 1000:>6.0f}ms"
+            )
+        print("(the old loop writes error pages out as .musicxml, so its failures go unnoticed)")
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--jobs", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--garbage-rate", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--no-baseline", dest="baseline", action="store_false")
+    asyncio.run(main(parser.parse_args()))
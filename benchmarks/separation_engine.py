@@ -0,0 +1,69 @@
+# Peak RSS and speed of stem separation: demucs CLI-style call vs the in-process engine.
+#
+#   python -m benchmarks.separation_engine song.mp3 [--stems vocals]
+#
+# Each variant runs in a fresh child process so peak RSS is measured separately. Needs
+# demucs and ffmpeg. Reported speed is seconds of wall time per minute of audio, on CPU.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+MODEL = "htdemucs_6s"
+
+
+def child(mode: str, audio_path: str, stems: list, out_dir: str):
+    started = time.perf_counter()
+    if mode == "cli":
+        import demucs.separate
+        demucs.separate.main(["--mp3", "-n", MODEL, "-d", "cpu", "-o", out_dir, audio_path])
+        load_time = None
+    else:
+        from audio.separation_engine import SeparationEngine
+        engine = SeparationEngine(MODEL, device="cpu")
+        load_time = engine.load_time
+        engine.separate(audio_path, stems, out_dir)
+        if mode == "engine-warm":
+            # second track with the model already loaded
+            started = time.perf_counter()
+            engine.separate(audio_path, stems, out_dir)
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": elapsed, "load_seconds": load_time, "peak_rss_mb": peak_kb / 1024}))
+
+
+def duration_minutes(audio_path: str):
+    from demucs.audio import AudioFile
+    return AudioFile(audio_path).duration / 60
+
+
+def main(args):
+    minutes = duration_minutes(args.audio)
+    print(f"{os.path.basename(args.audio)}: {minutes:.1f} min of audio, stems: {', '.join(args.stems)}")
+    for mode in ("cli", "engine", "engine-warm"):
+        with tempfile.TemporaryDirectory() as out_dir:
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.separation_engine", "--child", mode, "--stems", *args.stems, "--", args.audio, out_dir],
+                check=True, capture_output=True, text=True,
+            ).stdout.strip().splitlines()[-1]
+        result = json.loads(output)
+        load = f", model load {result['load_seconds']:.1f}s" if result["load_seconds"] is not None else ""
+        print(f"{mode:<12} {result['seconds'] / minutes:6.1f} s per minute of audio, peak RSS {result['peak_rss_mb']:7.0f} MB{load}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--child", default=None)
+    parser.add_argument("--stems", nargs="+", default=["vocals"])
+    parser.add_argument("audio")
+    parser.add_argument("out_dir", nargs="?", default=tempfile.gettempdir())
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.audio, args.stems, args.out_dir)
+    else:
+        main(args)
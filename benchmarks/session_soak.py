@@ -0,0 +1,72 @@
+# Soak test of the session manager: many channels sending requests, RSS sampled as it runs.
+#
+#   python -m benchmarks.session_soak --channels 5000 --requests 300000 --memory-mb 16 [--persist]
+#
+# Each request pins a channel's session and records a song and an audio path, the way the
+# pipeline's effects do. Channel activity is skewed (a few busy channels, a long tail), so
+# the LRU has something to keep. Steady-state RSS should flatten once the memory cap is hit.
+
+import argparse
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+from sessions import SessionManager
+
+
+def rss_mb():
+    # current RSS on Linux, peak RSS elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="session-soak-")
+    rng = random.Random(0)
+    manager = SessionManager(
+        db_path=os.path.join(workdir, "sessions.sqlite3"),
+        memory_bytes=args.memory_mb * 1024 ** 2,
+        persist=args.persist,
+    )
+    weights = [1 / (i + 1) for i in range(args.channels)]
+    channels = rng.choices(range(args.channels), weights, k=args.requests)
+
+    print(f"{'requests':>9} {'sessions':>9} {'estimate':>9} {'rss':>8} {'evictions':>10} {'req/s':>8}")
+    started = time.perf_counter()
+    baseline = rss_mb()
+    samples = []
+    try:
+        for i, channel in enumerate(channels, 1):
+            with manager.use(f"{channel}:{rng.randrange(4)}") as session:
+                vid = f"{rng.randrange(10 ** 6):011d}"
+                path = f"/bot/uploads/{vid}.mp3"
+                session.youtube_to_audio_path[vid] = path
+                session.last_audio_path = path
+                session.songs.append({"youtube_link": f"https://youtu.be/{vid}", "file_path": path, "name": f"song {vid}"})
+
+            if i % (args.requests // 10) == 0:
+                metrics = manager.metrics()
+                samples.append(rss_mb())
+                print(
+                    f"{i:>9} {metrics['sessions']:>9} {metrics['bytes'] / 1024 ** 2:>7.1f}MB {samples[-1]:>6.1f}MB "
+                    f"{metrics['evictions']:>10} {i / (time.perf_counter() - started):>8.0f}"
+                )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    steady = samples[len(samples) // 2:]
+    print(f"baseline RSS {baseline:.1f} MB; steady state (second half) {min(steady):.1f}-{max(steady):.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--channels", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=300000)
+    parser.add_argument("--memory-mb", type=int, default=16)
+    parser.add_argument("--persist", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,77 @@
+# Prompt size and selection time of the song context as the history grows.
+#
+#   python -m benchmarks.song_context [--sizes 10 100 1000 10000 100000]
+#
+# Compares the old prompt (the whole songs list as JSON) with SongContext.prompt() for a few
+# messages, on a synthetic history of searches, trims, stems and uploads.
+
+import argparse
+import json
+import random
+import time
+from song_context import SongContext, estimate_tokens
+
+WORDS = (
+    "fur elise moonlight sonata clair de lune nocturne prelude waltz etude canon gymnopedie "
+    "bohemian rhapsody imagine yesterday hallelujah wonderwall hotel california stairway heaven "
+    "river flows in you comptine ete la valse amelie interstellar experience nuvole bianche"
+).split()
+STEMS = ("vocals", "drums", "bass", "other", "piano", "guitar")
+QUERIES = (
+    "make sheet music of the moonlight sonata one",
+    "give me the vocals of that hotel california search",
+    "trim the nocturne from 0:30 to 1:00",
+    "midi of my upload please",
+)
+
+
+def history(size: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(size):
+        name = " ".join(rng.sample(WORDS, 3))
+        vid = f"{i:011d}"
+        kind = rng.random()
+        if kind < 0.3:
+            yield {"youtube_link": f"https://www.youtube.com/watch?v={vid}", "file_path": None, "name": name}
+        elif kind < 0.6:
+            yield {"youtube_link": f"https://youtu.be/{vid}", "file_path": f"/bot/uploads/30_60_{vid}.mp3", "name": ""}
+        elif kind < 0.85:
+            stem = rng.choice(STEMS)
+            yield {"youtube_link": f"https://youtu.be/{vid}", "file_path": f"/bot/separated/htdemucs_6s/{vid}/{stem}.wav", "name": stem}
+        else:
+            upload = name.replace(" ", "_") + ".mp3"
+            yield {"youtube_link": None, "file_path": f"/bot/uploads/{upload}", "name": upload}
+
+
+def main(args):
+    print(f"{'entries':>8} {'full prompt':>12} {'selected':>9} {'entries':>8} {'select':>10} {'append':>9}")
+    for size in args.sizes:
+        songs = list(history(size))
+        context = SongContext(max_entries=size)
+
+        started = time.perf_counter()
+        for song in songs:
+            context.append(song)
+        append_time = (time.perf_counter() - started) / size
+
+        full_tokens = estimate_tokens("---" + json.dumps(songs) + "---")
+
+        started = time.perf_counter()
+        rounds = max(1, 2000 // len(QUERIES))
+        for _ in range(rounds):
+            prompts = [context.prompt(query) for query in QUERIES]
+        select_time = (time.perf_counter() - started) / (rounds * len(QUERIES))
+
+        selected_tokens = max(estimate_tokens(prompt) for prompt in prompts)
+        selected_entries = max(len(context.select(query)) for query in QUERIES)
+        print(
+            f"{size:>8} {full_tokens:>10} t {selected_tokens:>7} t {selected_entries:>8} "
+            f"{select_time * 1e3:>7.3f} ms {append_time * 1e6:>6.1f} us"
+        )
+    print("(t = estimated prompt tokens; selected/entries are the largest over the sample messages)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000, 100000])
+    main(parser.parse_args())
@@ -0,0 +1,270 @@
+# Local stand-ins for the bot's external dependencies, for running the agent offline.
+#
+# Each stand-in has a Service model: a latency (seconds, +-jitter), how many calls it serves
+# at once and how often a call fails. install() plugs them into a MistralAgent in place of
+# Mistral, yt_dlp, transkun, demucs and the scoring service; the agent's own code (intent
+# parsing, sessions, the stage graph, prefetching, caches, the scoring client) runs as is.
+# ffmpeg is stood in for too, since the stand-in files are not real audio.
+
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class Service:
+    latency: float
+    jitter: float = 0.5
+    # calls served at once; 0 is unlimited
+    concurrency: int = 0
+    failure_rate: float = 0.0
+
+    def delay(self, rng: random.Random, scale: float):
+        return self.latency * scale * rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+# rough production figures, in seconds
+DEFAULT_SERVICES = {
+    "llm": Service(1.5),
+    "search": Service(1.5),
+    "download": Service(4.0, concurrency=4),
+    "decode": Service(0.5),
+    "trim": Service(0.2),
+    "transcribe": Service(20.0),
+    "separate": Service(30.0),
+    "score": Service(8.0, concurrency=4),
+}
+
+
+def parse_overrides(services: dict, latencies: list = (), failures: list = (), concurrency: list = ()):
+    """
+    Applies name=value overrides from the command line, e.g. ["download=2", "llm=0.5"].
+    """
+    services = {name: Service(**vars(service)) for name, service in services.items()}
+    for field, pairs in (("latency", latencies), ("failure_rate", failures), ("concurrency", concurrency)):
+        for pair in pairs or ():
+            name, value = pair.split("=")
+            setattr(services[name], field, type(getattr(services[name], field))(float(value)))
+    return services
+
+
+class Failure(RuntimeError):
+    pass
+
+
+class _Limiter:
+    # latency, concurrency and failures of one service, for calls made on threads
+    def __init__(self, name: str, service: Service, scale: float, seed: int = 0):
+        self.name = name
+        self.service = service
+        self.scale = scale
+        self.rng = random.Random(f"{name}:{seed}")
+        self.slots = threading.BoundedSemaphore(service.concurrency) if service.concurrency else None
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def _roll(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.service.delay(self.rng, self.scale)
+            failed = self.rng.random() < self.service.failure_rate
+            self.failures += failed
+        return delay, failed
+
+    def call(self, cancel: threading.Event = None):
+        delay, failed = self._roll()
+        if self.slots is not None:
+            self.slots.acquire()
+        try:
+            deadline = time.monotonic() + delay
+            while time.monotonic() < deadline:
+                if cancel is not None and cancel.is_set():
+                    raise Failure(f"{self.name} cancelled")
+                time.sleep(min(0.01, max(0.0, deadline - time.monotonic())))
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+        if failed:
+            raise Failure(f"{self.name} failed")
+
+    async def call_async(self):
+        delay, failed = self._roll()
+        await asyncio.sleep(delay)
+        if failed:
+            raise Failure(f"{self.name} failed")
+
+
+def _write(path: str, seed: str, size: int = 4096):
+    # deterministic content, so the artifact cache sees the same file as the same file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    block = hashlib.sha256(seed.encode()).digest()
+    with open(path, "wb") as f:
+        f.write(block * (size // len(block)))
+    return path
+
+
+def transcribe(service: Service, scale: float, audio_path):
+    # runs in the stage process pool, like audio2midi; concurrency comes from the stage limit
+    limiter = _Limiter("transcribe", service, scale, seed=hash(str(audio_path)))
+    limiter.call()
+    name = os.path.splitext(os.path.basename(str(audio_path)))[0]
+    return _write(os.path.join(os.getcwd(), "results", f"{name}.mid"), f"midi:{audio_path}")
+
+
+class StandInAudio:
+    """
+    Trims and separations for AudioProcessor's place; picklable, since separations run in
+    the stage process pool.
+    """
+
+    def __init__(self, separate: Service, trim: Service, scale: float):
+        self.separate = separate
+        self.trim = trim
+        self.scale = scale
+
+    def trim_audio(self, youtube_link, start_time, end_time, audio_path=None):
+        _Limiter("trim", self.trim, self.scale, seed=hash(str(audio_path))).call()
+        base = os.path.splitext(os.path.basename(str(audio_path)))[0]
+        return _write(os.path.join(os.getcwd(), "uploads", f"{base}_{start_time}_{end_time}.mp3"), f"trim:{audio_path}:{start_time}:{end_time}")
+
+    def separate_stems(self, audio_path, model: str, stems: tuple = None):
+        from audio.audio_processor import STEMS
+        from cache import get_cache, make_key, file_digest
+
+        # all of them by default, like AudioProcessor.separate_stems
+        stems = stems or STEMS
+
+        _Limiter("separate", self.separate, self.scale, seed=hash(str(audio_path))).call()
+        digest = file_digest(audio_path)
+        found = {}
+        for stem in stems:
+            path = _write(os.path.join(os.getcwd(), "separated", model, digest, f"{stem}.mp3"), f"{digest}:{stem}")
+            found[stem] = get_cache().put(make_key("stem", digest, model=model, instrument=stem), path)
+        return found
+
+
+class _Reply:
+    def __init__(self, content: str):
+        self.choices = [type("Choice", (), {"message": type("Message", (), {"content": content})()})()]
+
+
+class StandInMistral:
+    """
+    Answers chat.complete_async with the reply recorded for the message (the last user
+    turn), or {"type": "none"} when there is none.
+    """
+
+    def __init__(self, limiter: _Limiter, replies: dict):
+        self.limiter = limiter
+        self.replies = replies
+        self.chat = self
+
+    async def complete_async(self, model: str, messages: list):
+        await self.limiter.call_async()
+        return _Reply(json.dumps(self.replies.get(messages[-1]["content"], [{"type": "none"}])))
+
+
+class StandIns:
+    """
+    The stand-ins for one run, with call and failure counts per service.
+    """
+
+    def __init__(self, services: dict, scale: float, replies: dict = None):
+        self.services = services
+        self.scale = scale
+        self.limiters = {name: _Limiter(name, service, scale) for name, service in services.items()}
+        self.mistral = StandInMistral(self.limiters["llm"], replies or {})
+        self.audio = StandInAudio(services["separate"], services["trim"], scale)
+        self.scorer = None
+
+    def download(self, video_url, start_time=None, end_time=None, cancel=None):
+        from youtube.links import video_id
+
+        vid = video_id(video_url)
+        suffix = f"_{start_time}_{end_time}" if start_time is not None else ""
+        path = os.path.join(os.getcwd(), "uploads", f"{vid}{suffix}.mp3")
+        if os.path.exists(path):
+            return path
+        self.limiters["download"].call(cancel)
+        return _write(path, f"audio:{vid}{suffix}")
+
+    def extract(self, query: str, max_results: int):
+        self.limiters["search"].call()
+        slug = hashlib.sha256(query.encode()).hexdigest()[:8]
+        return {"entries": [
+            {"title": f"{query} take {i}", "url": f"https://www.youtube.com/watch?v={slug}{i:03d}", "duration": 150 + 10 * i}
+            for i in range(min(max_results, 5))
+        ]}
+
+    def decode(self, audio_path):
+        # stands in for the ffmpeg decode; the stand-in files are passed along as they are
+        self.limiters["decode"].call()
+        return audio_path
+
+    async def start_scorer(self):
+        """
+        Serves POST /invocations on a local port the way the scoring service does.
+        Returns the URL.
+        """
+        from aiohttp import web
+
+        limiter = self.limiters["score"]
+        slots = asyncio.Semaphore(limiter.service.concurrency) if limiter.service.concurrency else None
+
+        async def invocations(request):
+            form = await request.post()
+            form["file"].file.read()
+            if slots is not None:
+                await slots.acquire()
+            try:
+                await limiter.call_async()
+            except Failure:
+                return web.Response(status=503, text="busy")
+            finally:
+                if slots is not None:
+                    slots.release()
+            return web.Response(body=b'<?xml version="1.0" encoding="UTF-8"?>\n<score-partwise version="4.0"/>\n', content_type="application/xml")
+
+        app = web.Application()
+        app.router.add_post("/invocations", invocations)
+        self.scorer = web.AppRunner(app)
+        await self.scorer.setup()
+        site = web.TCPSite(self.scorer, "127.0.0.1", 0)
+        await site.start()
+        return f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/invocations"
+
+    async def install(self, agent):
+        """
+        Points agent's external calls at the stand-ins. Call from inside the event loop.
+        """
+        import agent as agent_module
+        from transcribe.score_client import ScoringClient
+        from youtube.search import search_youtube
+
+        agent._client = self.mistral
+        agent_module.download_audio = self.download
+        agent.prefetcher.download = self.download
+        agent_module.search_youtube = functools.partial(search_youtube, extractor=self.extract)
+        agent_module.as_view = self.decode
+        agent.prefetcher.decode = self.decode
+        # the stand-in files are short: always the single-pass transcription
+        agent_module.audio_duration = lambda audio: 60.0
+        agent.transkun_worker = None
+        agent_module.audio2midi = functools.partial(transcribe, self.services["transcribe"], self.scale)
+        agent.audio_processor = agent.stem_store.audio_processor = self.audio
+        agent.scoring = ScoringClient(url=await self.start_scorer(), batch_url="")
+
+    async def close(self, agent):
+        await agent.scoring.close()
+        if self.scorer is not None:
+            await self.scorer.cleanup()
+
+    def metrics(self):
+        return {name: {"calls": limiter.calls, "failures": limiter.failures} for name, limiter in self.limiters.items()}
@@ -0,0 +1,77 @@
+# Import time and memory of the bot entry point, each module measured in a fresh interpreter.
+#
+#   python -m benchmarks.startup --repeat 3 --max-seconds 2 --max-rss 300
+#
+# Reports wall time and peak RSS for importing each target, and which heavy libraries the
+# import dragged in. Those should load only when their stage first runs (or in the warm-up
+# after on_ready), so any listed for bot/agent is a regression, as is exceeding --max-seconds
+# or --max-rss (MB): either makes the script exit non-zero. Needs the bot's own dependencies.
+
+import argparse
+import json
+import subprocess
+import sys
+
+TARGETS = ["bot", "agent", "pipeline"]
+# for comparison: what the entry point used to import up front
+HEAVY = ["torch", "demucs", "music21", "pydub", "yt_dlp", "mistralai", "transkun"]
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+error = None
+try:
+    __import__({target!r})
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+elapsed = time.perf_counter() - started
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{"seconds": elapsed, "rss_mb": rss, "heavy": heavy, "error": error}}))
+"""
+
+
+def measure(target: str):
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(target=target, heavy=HEAVY)],
+        capture_output=True, text=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    print(f"{'import':<18} {'seconds':>8} {'peak RSS':>10}  heavy modules loaded")
+    failed = False
+    for target in args.targets:
+        runs = [measure(target) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["seconds"])
+        if best["error"]:
+            print(f"{target:<18} {'-':>8} {'-':>10}  could not import: {best['error']}")
+            failed |= target in ("bot", "agent")
+            continue
+        print(f"{target:<18} {best['seconds']:>7.2f}s {best['rss_mb']:>8.0f}MB  {', '.join(best['heavy']) or '-'}")
+        if target in ("bot", "agent"):
+            failed |= bool(best["heavy"])
+            failed |= args.max_seconds is not None and best["seconds"] > args.max_seconds
+            failed |= args.max_rss is not None and best["rss_mb"] > args.max_rss
+
+    if args.heavy:
+        for name in HEAVY:
+            run = measure(name)
+            note = f"  ({run['error']})" if run["error"] else ""
+            seconds = f"{run['seconds']:>7.2f}s" if not run["error"] else f"{'-':>8}"
+            print(f"{name:<18} {seconds} {run['rss_mb']:>8.0f}MB{note}")
+
+    if failed:
+        print("startup regression: see the bot/agent rows above")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--targets", nargs="+", default=TARGETS)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--max-rss", type=float, default=None)
+    parser.add_argument("--no-heavy", dest="heavy", action="store_false", help="skip timing the heavy libraries on their own")
+    main(parser.parse_args())
@@ -0,0 +1,66 @@
+# Cost of the stage spans at different sampling rates.
+#
+#   python -m benchmarks.telemetry_overhead --spans 200000 --jobs 5000
+#
+# Times an empty span on its own, then a no-op job through StageExecutor.run_io (which wraps
+# every job in a span) at each TRACE_SAMPLE percentage, against the bare thread-pool call.
+
+import argparse
+import asyncio
+import functools
+import time
+from executor import StageExecutor
+import executor as executor_module
+from telemetry import Telemetry
+
+
+def noop():
+    return None
+
+
+async def bare_jobs(executor, jobs: int):
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    for _ in range(jobs):
+        await loop.run_in_executor(executor.io_pool, functools.partial(noop))
+    return (time.perf_counter() - started) / jobs
+
+
+def span_cost(spans: int, sample: int):
+    telemetry = Telemetry(sample_percent=sample)
+    started = time.perf_counter()
+    for i in range(spans):
+        with telemetry.span("lookup"):
+            pass
+    return (time.perf_counter() - started) / spans
+
+
+async def stage_jobs(executor, jobs: int, sample: int):
+    telemetry = Telemetry(sample_percent=sample)
+    # executor.py looks its telemetry up at call time
+    executor_module.telemetry = telemetry
+    started = time.perf_counter()
+    for i in range(jobs):
+        with telemetry.request(i):
+            await executor.run_io("lookup", noop)
+    return (time.perf_counter() - started) / jobs, telemetry
+
+
+async def main(args):
+    executor = StageExecutor(io_workers=1)
+    bare = await bare_jobs(executor, args.jobs)
+    print(f"{'sample':>7} {'span alone':>11} {'run_io job':>11} {'vs bare':>8} {'traces':>7}")
+    for sample in args.samples:
+        job, telemetry = await stage_jobs(executor, args.jobs, sample)
+        alone = span_cost(args.spans, sample)
+        print(f"{sample:>6}% {alone * 1e6:>9.2f}us {job * 1e6:>9.1f}us {(job - bare) * 1e6:>+6.1f}us {len(telemetry.traces):>7}")
+    print(f"(bare thread-pool call {bare * 1e6:.1f}us per job)")
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spans", type=int, default=200000)
+    parser.add_argument("--jobs", type=int, default=5000)
+    parser.add_argument("--samples", type=int, nargs="+", default=[0, 1, 10, 100])
+    asyncio.run(main(parser.parse_args()))
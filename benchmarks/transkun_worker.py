@@ -0,0 +1,57 @@
+# Per-job transcription latency: one transkun CLI run per request vs the resident worker.
+#
+#   python -m benchmarks.transkun_worker clip1.mp3 clip2.mp3 --repeat 3
+#
+# Needs transkun and its model weights installed. The cache is bypassed so every job
+# really runs. The worker rows split each job into model load, decode and inference.
+
+import argparse
+import os
+import tempfile
+import time
+from concurrent.futures import wait
+from transcribe.audio2midi import run_transkun, pick_device
+from transcribe.transkun_worker import TranskunWorker
+
+
+def main(args):
+    device = args.device or pick_device()
+    jobs = [os.path.abspath(path) for path in args.audio] * args.repeat
+    out_dir = tempfile.mkdtemp()
+
+    print(f"device: {device}, jobs: {len(jobs)}")
+    print("subprocess per request:")
+    subprocess_times = []
+    for i, audio_path in enumerate(jobs):
+        started = time.perf_counter()
+        run_transkun(audio_path, os.path.join(out_dir, f"cli_{i}.mid"), device=device)
+        subprocess_times.append(time.perf_counter() - started)
+        print(f"  job {i}: {subprocess_times[-1]:.2f}s")
+
+    worker = TranskunWorker(device=device)
+    print("resident worker, one job at a time:")
+    for i, audio_path in enumerate(jobs):
+        worker.submit(audio_path, os.path.join(out_dir, f"worker_{i}.mid"), use_cache=False).result()
+        timings = worker.timings[-1]
+        print(f"  job {i}: total {timings['total']:.2f}s = load {timings['load']:.2f}s + decode {timings['decode']:.2f}s + inference {timings['inference']:.2f}s + queue {timings['queue']:.2f}s")
+
+    print("resident worker, all jobs submitted together (batched when short):")
+    started = time.perf_counter()
+    futures = [worker.submit(path, os.path.join(out_dir, f"batch_{i}.mid"), use_cache=False) for i, path in enumerate(jobs)]
+    wait(futures)
+    batch_time = time.perf_counter() - started
+    worker.stop()
+
+    warm = [t["total"] for t in list(worker.timings)[1:len(jobs)]]
+    print(f"subprocess mean: {sum(subprocess_times) / len(subprocess_times):.2f}s/job")
+    if warm:
+        print(f"worker warm mean: {sum(warm) / len(warm):.2f}s/job (first job incl. model load: {worker.timings[0]['total']:.2f}s)")
+    print(f"worker batched: {batch_time:.2f}s for {len(jobs)} jobs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("audio", nargs="+")
+    parser.add_argument("--repeat", type=int, default=2)
+    parser.add_argument("--device", default=None)
+    main(parser.parse_args())
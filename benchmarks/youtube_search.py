@@ -0,0 +1,140 @@
+# Search cache hit rate, time to first reply and follow-up wait with speculative prefetch.
+#
+#   python -m benchmarks.youtube_search --messages 200 --scale 0.01
+#
+# A fake extractor (1.5 s per search) and a fake downloader (4 s, cancellable) stand in for
+# yt_dlp; times are reported in unscaled seconds. Each conversation is a SEARCH message, a
+# pause while the user reads the results, then a SHEET_MUSIC follow-up on either the top hit
+# or (--other-rate of the time) another candidate. Queries repeat with a skewed distribution.
+
+import argparse
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+from executor import StageExecutor
+from pipeline import compile_requests, run_plan
+from youtube import search
+from youtube.prefetch import Prefetcher
+
+SEARCH_SECONDS = 1.5
+DOWNLOAD_SECONDS = 4.0
+READ_SECONDS = 3.0
+PIECES = ["fur elise", "moonlight sonata", "clair de lune", "gymnopedie", "nocturne", "river flows in you",
+          "canon in d", "la campanella", "prelude", "waltz"]
+QUERIES = [f"{piece} {variant}" for piece in PIECES for variant in ("", "piano", "easy", "live")]
+
+
+class FakeStages:
+    def __init__(self, scale: float, prefetch: bool):
+        self.scale = scale
+        self.executor = StageExecutor(io_workers=16)
+        self.prefetch = prefetch
+        self.prefetcher = Prefetcher(self.executor, download=self._download)
+        self.downloads = 0
+        self.downloaded = set()
+
+    def _extract(self, query, max_results):
+        time.sleep(SEARCH_SECONDS * self.scale)
+        slug = search.normalize_query(query).replace(" ", "")
+        return {"entries": [
+            {"title": f"{query} ({kind})", "url": f"https://www.youtube.com/watch?v={slug}{i:03d}", "duration": 180 + i}
+            for i, kind in enumerate(["piano", "orchestra", "live", "tutorial", "slow"])
+        ]}
+
+    def _download(self, url, start_time=None, end_time=None, cancel=None):
+        if url in self.downloaded:
+            return f"uploads/{url[-11:]}.mp3"
+        self.downloads += 1
+        for _ in range(20):
+            if cancel is not None and cancel.is_set():
+                raise RuntimeError("cancelled")
+            time.sleep(DOWNLOAD_SECONDS * self.scale / 20)
+        self.downloaded.add(url)
+        return f"uploads/{url[-11:]}.mp3"
+
+    async def search_youtube(self, query):
+        return await self.executor.run_io("search", search.search_youtube, query, extractor=self._extract)
+
+    def prefetch_search(self, candidates):
+        if self.prefetch:
+            self.prefetcher.speculate(candidates)
+
+    async def download_audio(self, youtube_link, start_time=None, end_time=None):
+        in_flight = self.prefetcher.claim(youtube_link)
+        if in_flight is not None:
+            try:
+                return await in_flight
+            except Exception:
+                pass
+        return await self.executor.run_io("download", self._download, youtube_link)
+
+    async def decode_audio(self, path):
+        return path
+
+    async def transcribe_to_midi(self, audio):
+        return "results/song.mid"
+
+    async def convert_to_sheet_music(self, midi):
+        return "results/song.musicxml"
+
+
+async def conversation(stages, query: str, pick_other: bool):
+    session = SimpleNamespace(youtube_to_audio_path={}, last_audio_path=None, last_link=None, songs=[])
+    started = time.perf_counter()
+    replied = []
+
+    async def on_result(label, value):
+        replied.append(time.perf_counter() - started)
+
+    await run_plan(compile_requests([{"type": "SEARCH", "query": query}], stages, session), on_result)
+    candidates = search.search_cache.get((search.normalize_query(query), 10, 300))
+    await asyncio.sleep(READ_SECONDS * stages.scale)
+
+    follow_up = [{"type": "SHEET_MUSIC", "youtube_link": candidates[1]["url"] if pick_other else "none", "file_path": "none"}]
+    asked = time.perf_counter()
+    await run_plan(compile_requests(follow_up, stages, session))
+    return replied[0], time.perf_counter() - asked
+
+
+async def run(args, prefetch: bool):
+    search.search_cache = search.SearchCache()
+    rng = random.Random(0)
+    stages = FakeStages(args.scale, prefetch)
+    weights = [1 / (i + 1) for i in range(len(QUERIES))]
+    jobs = [conversation(stages, rng.choices(QUERIES, weights)[0], rng.random() < args.other_rate) for _ in range(args.messages)]
+
+    results = []
+    for i in range(0, len(jobs), args.concurrent):
+        results += await asyncio.gather(*jobs[i:i + args.concurrent])
+    stages.executor.shutdown()
+
+    replies = sorted(reply for reply, _ in results)
+    waits = sorted(wait for _, wait in results)
+    return {
+        "reply_p50": replies[len(replies) // 2] / args.scale,
+        "wait_p50": waits[len(waits) // 2] / args.scale,
+        "wait_p95": waits[int(len(waits) * 0.95)] / args.scale,
+        "hit_rate": search.search_cache.stats()["hit_rate"],
+        "downloads": stages.downloads,
+        "prefetch": stages.prefetcher.metrics(),
+    }
+
+
+async def main(args):
+    print(f"{'mode':<12} {'first reply':>12} {'follow-up p50':>14} {'p95':>7} {'cache hits':>11} {'downloads':>10} {'cancelled':>10}")
+    for prefetch in (False, True):
+        r = await run(args, prefetch)
+        print(
+            f"{'prefetch' if prefetch else 'on demand':<12} {r['reply_p50']:>11.2f}s {r['wait_p50']:>13.2f}s {r['wait_p95']:>6.2f}s "
+            f"{r['hit_rate']:>10.0%} {r['downloads']:>10} {r['prefetch']['cancelled']:>10}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--concurrent", type=int, default=10)
+    parser.add_argument("--other-rate", type=float, default=0.2)
+    parser.add_argument("--scale", type=float, default=0.01)
+    asyncio.run(main(parser.parse_args()))
@@ -1,33 +1,89 @@
 import os
+import asyncio
 import discord
+import functools
 import logging
-import subprocess
 from discord.ext import commands
 from dotenv import load_dotenv
+
+# Load the environment variables, before the imports below: some of them read their
+# settings when they load (the scoring URLs, the search cache, telemetry sampling)
+load_dotenv()
+
 from agent import MistralAgent
+from scheduler import JobScheduler, DEFERRED, REJECTED
+from sessions import session_key
+from intent import fast_parse
+from ingest import IngestError, attachment_path, check_attachment
+from delivery import Delivery
+from config import env_int
+from telemetry import telemetry, serve as serve_metrics
 
 PREFIX = "!"
 
 # Setup logging
 logger = logging.getLogger("discord")
 
-# Load the environment variables
-load_dotenv()
+# Get the token from the environment variables
+token = os.getenv("DISCORD_TOKEN")
 
-# Create the bot with all intents
-# The message content and members intent must be enabled in the Discord Developer Portal for the bot to work.
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+# built in main(), not when this module loads: the stage, chunk, transkun and render worker
+# processes are spawned, and spawned processes run the main module's top level again
+bot = None
+agent = None
+scheduler = None
+delivery = None
 
-# Import the Mistral agent from the agent.py file
-agent = MistralAgent()
 
+async def run_job(job):
+    # runs a queued request once a worker picks it up (possibly after a restart)
+    # spans join the ones recorded while the message was parsed, under the message ID
+    with telemetry.request(job.message_id):
+        channel = bot.get_channel(job.channel_id) or await bot.fetch_channel(job.channel_id)
+        message = await channel.fetch_message(job.message_id)
 
-# Get the token from the environment variables
-token = os.getenv("DISCORD_TOKEN")
+        # each result is posted as soon as its branch of the pipeline finishes
+        async def post(res, file_path):
+            await delivery.post(message, res, file_path)
+            if agent.render_pool is not None and isinstance(file_path, str) and file_path.endswith(".musicxml"):
+                # the PDF follows when it's ready, without holding up the job
+                task = asyncio.ensure_future(send_pdf(message, file_path))
+                renders.add(task)
+                task.add_done_callback(renders.discard)
+
+        response = await agent.handle_message(job.payload["requests"], message, on_result=post)
+        if isinstance(response, str):
+            await delivery.send(message, response)
+    print(telemetry.describe(job.message_id))
+
+
+async def job_failed(job, error: Exception):
+    # a job whose handler raised, or one dropped after crashing the bot too many times
+    channel = bot.get_channel(job.channel_id) or await bot.fetch_channel(job.channel_id)
+    message = await channel.fetch_message(job.message_id)
+    await message.reply("I'm sorry, something went wrong while working on your request. Please try again.")
+
+
+# PDF renders still running (kept so the tasks are not garbage collected)
+renders = set()
+
+
+async def send_pdf(message: discord.Message, score_path: str):
+    with telemetry.request(message.id):
+        try:
+            pdf_path = await agent.render_pdf(score_path)
+        except Exception as e:
+            print(f"Rendering {score_path} to PDF failed: {e}")
+            return
+        await delivery.post(message, "Printable sheet music: ", pdf_path)
+
+
+# the background warm-up started once connected (kept so the task is not garbage collected)
+warm_up = None
+# the /metrics endpoint, started once connected
+metrics_server = None
 
 
-@bot.event
 async def on_ready():
     """
     Called when the client is done preparing the data received from Discord.
@@ -37,6 +93,19 @@ async def on_ready():
     """
     logger.info(f"{bot.user} has connected to Discord!")
 
+    # start the workers (this also resumes jobs that were queued before a restart)
+    await scheduler.start()
+
+    # Prometheus text format on 127.0.0.1:METRICS_PORT
+    global metrics_server
+    if metrics_server is None:
+        metrics_server = await serve_metrics()
+
+    # load the models and heavy libraries in the background; WARM_UP=0 leaves them to first use
+    global warm_up
+    if warm_up is None and env_int("WARM_UP", 1):
+        warm_up = asyncio.create_task(agent.warm_up())
+
     MESSAGE = """
     🎵 Hello! I'm the Songscription Bot! 🤖 I'm here to help you with all your music transcription needs! 
 
@@ -70,7 +139,6 @@ async def on_ready():
         
 
 
-@bot.event
 async def on_message(message: discord.Message):
     """
     Called when a message is sent in any channel the bot can see.
@@ -86,50 +154,60 @@ async def on_message(message: discord.Message):
     if message.author.bot or message.content.startswith("!"):
         return
     
-    if message.attachments:
+    # the message ID names this request in the stage timings, through to its queued job
+    with telemetry.request(message.id):
+        # start fetching the message's links and uploads now, so they download and decode while
+        # the LLM works out what to do with them
+        uploads = {}
         for attachment in message.attachments:
             file_name = attachment.filename
-            file_path = os.path.join(os.getcwd(), 'uploads', file_name)
-
-            if file_name.endswith(".mp4"):
-                # convert to mp3
-                file_path = os.path.join(os.getcwd(), 'uploads', file_name.replace(".mp4", ".mp3"))
-                subprocess.run(["ffmpeg", "-i", attachment.url, file_path])
-            else:
-                await attachment.save(file_path)
-
-            agent.last_audio_path = file_path
-            agent.songs.append({"youtube_link": None,"file_path": file_path, "name": file_name})
-        message_history += f"----Uploaded file: {file_name}---\n"
-    # Process the message with the agent you wrote
-    # Open up the agent.py file to customize the agent
-    logger.info(f"Processing message from {message.author}: {message.content}")
-
-    # reply to the user with an initial message
-    await message.reply("Got it! Give me a moment to work on your requests...")
-
-    # message_history = []
-    # async for msg in message.channel.history(limit=2):
-    #     message_history.append(msg.content)
-
-
-    response = await agent.run(message, message_history) # a list of tuples ("message", "file_path")
-
-    for res, file_path in response:
-        if isinstance(file_path, dict): 
-            # convert the dict to a string
-            reply = res + "\n" + file_path["url"]
-            await message.reply(reply)
-        elif file_path and (file_path.endswith(".mp3") or file_path.endswith(".wav") or file_path.endswith(".mid") or file_path.endswith(".musicxml")):
-            try: 
-                print(f"Sending file: {file_path}, with message: {res}")
-                # file_path = os.path.join(os.getcwd(), file_path)
-                await message.reply(res, file=discord.File(file_path))
-            except Exception as e:
-                logger.error(f"Error sending file: {e}")
-        else:
-            # Send the response back to the channel
-            await message.reply(res)
+            # wrong type or too big: say so now rather than after downloading it
+            try:
+                check_attachment(file_name, attachment.size)
+            except IngestError as e:
+                await message.reply(str(e))
+                continue
+            file_path = attachment_path(attachment.id, file_name)
+            uploads[file_path] = functools.partial(save_attachment, message, attachment, file_path)
+
+            with agent.sessions.use(session_key(message.channel.id, message.author.id)) as session:
+                session.last_audio_path = file_path
+                session.songs.append({"youtube_link": None,"file_path": file_path, "name": file_name})
+            message_history += f"----Uploaded file: {file_name}---\n"
+        # a message the fast path understands says exactly what to fetch (e.g. only a TRIM's window)
+        with agent.sessions.use(session_key(message.channel.id, message.author.id)) as session:
+            have = {vid for vid, path in session.youtube_to_audio_path.items() if os.path.exists(path)}
+        agent.prefetcher.prefetch_message(message.content, uploads, fast_parse(message.content, bool(message.attachments)), have)
+
+        # Process the message with the agent you wrote
+        # Open up the agent.py file to customize the agent
+        logger.info(f"Processing message from {message.author}: {message.content}")
+
+        # reply to the user with an initial message
+        await message.reply("Got it! Give me a moment to work on your requests...")
+
+        # message_history = []
+        # async for msg in message.channel.history(limit=2):
+        #     message_history.append(msg.content)
+
+
+        requests = await agent.parse_requests(message, message_history)
+
+        status, position = await scheduler.submit(message.author.id, message.channel.id, message.id, {"requests": requests})
+        if status == REJECTED:
+            await message.reply("I'm swamped with requests right now, please try again in a few minutes.")
+        elif status == DEFERRED:
+            await message.reply(f"It's busy right now, you are #{position} in line.")
+
+
+async def save_attachment(message: discord.Message, attachment: discord.Attachment, file_path: str):
+    # all of a message's attachments are fetched at once, as prefetches
+    try:
+        with telemetry.span("attachment"):
+            return await agent.ingest.fetch(attachment.url, attachment.filename, file_path, attachment.size)
+    except IngestError as e:
+        await message.reply(str(e))
+        raise
 
 
 # Commands
@@ -137,15 +215,29 @@ async def on_message(message: discord.Message):
 
 # This example command is here to show you how to add commands to the bot.
 # Run !ping with any number of arguments to see the command in action.
-# Feel free to delete this if your project will not need commands.
-@bot.command(name="ping", help="Pings the bot.")
+# Feel free to delete this if your project will not need commands (they are registered in main()).
 async def ping(ctx, *, arg=None):
     if arg is None:
         await ctx.send("Pong!")
     else:
         await ctx.send(f"Pong! Your argument was {arg}")
 
-@bot.command(name="help", help="Shows the list of available commands and features")
+
+async def stats(ctx):
+    lines = [f"{'stage':<20} {'runs':>6} {'p50':>8} {'p95':>8} {'errors':>6}"]
+    for stage, (count, p50, p95, errors) in telemetry.stage_summary().items():
+        lines.append(f"{stage:<20} {count:>6} {p50:>7.2f}s {p95:>7.2f}s {errors:>6}")
+
+    gauges = telemetry.gauges()
+    lines.append("")
+    lines.append(f"queued {gauges.get('scheduler_queue_depth', 0):.0f}, running {gauges.get('scheduler_running', 0):.0f}")
+    lines.append(
+        f"cache hits: artifacts {gauges.get('artifact_cache_hit_rate', 0):.0%}, searches {gauges.get('search_cache_hit_rate', 0):.0%}, "
+        f"messages parsed without the LLM {gauges.get('intents_served_without_llm', 0):.0%}"
+    )
+    await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+
 async def help_command(ctx):
     help_text = """
         **🎵 Music Transcription Bot Help 🎵**
@@ -155,6 +247,7 @@ async def help_command(ctx):
         **Commands:**
         `!help` - Shows this help message
         `!ping` - Check if the bot is responsive
+        `!stats` - Shows how long each pipeline stage takes (p50 and p95)
 
         **Features:**
         1. **MIDI Conversion**
@@ -173,5 +266,35 @@ async def help_command(ctx):
 """
     await ctx.send(help_text)
 
-# Start the bot, connecting it to the gateway
-bot.run(token)
+
+def main():
+    global bot, agent, scheduler, delivery
+
+    # Create the bot with all intents
+    # The message content and members intent must be enabled in the Discord Developer Portal for the bot to work.
+    intents = discord.Intents.all()
+    bot = commands.Bot(command_prefix=PREFIX, intents=intents, help_command=None)
+    bot.event(on_ready)
+    bot.event(on_message)
+    bot.command(name="ping", help="Pings the bot.")(ping)
+    bot.command(name="stats", help="Shows how long each pipeline stage takes")(stats)
+    bot.command(name="help", help="Shows the list of available commands and features")(help_command)
+
+    # Import the Mistral agent from the agent.py file
+    agent = MistralAgent()
+
+    # Queue in front of the agent: requests run on a few workers, taking turns between users
+    scheduler = JobScheduler(run_job, on_failure=job_failed)
+    telemetry.register("scheduler", scheduler.metrics)
+
+    # replies sized to the guild's upload limit, bundled and sent side by side
+    delivery = Delivery(agent.executor)
+    telemetry.register("delivery", delivery.metrics)
+
+    # Start the bot, connecting it to the gateway.
+    bot.run(token)
+
+
+if __name__ == "__main__":
+    main()
+
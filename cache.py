@@ -0,0 +1,139 @@
+# persistent, content-addressed cache for pipeline artifacts (downloads, stems, MIDI, MusicXML)
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from config import env_int
+
+CACHE_DIRS = ("uploads", "results", "separated", "pcm")
+
+
+def make_key(stage: str, source: str, **params):
+    """
+    Builds a cache key from a stage name, a canonical source (video ID or content hash)
+    and the parameters that change the stage's output, e.g. model name or trim range.
+    """
+    return stage + ":" + source + ":" + json.dumps(params, sort_keys=True)
+
+
+# (path, size, mtime) -> sha256, so repeated lookups of the same file don't rehash it
+_digests = {}
+
+
+def file_digest(path: str):
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digests:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha.update(block)
+        _digests[memo_key] = sha.hexdigest()
+    return _digests[memo_key]
+
+
+def remember_digest(path: str, digest: str):
+    # for files whose hash was worked out while they were written
+    stat = os.stat(path)
+    _digests[(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)] = digest
+
+
+class ArtifactCache:
+    """
+    Maps cache keys to files under uploads/, results/, separated/ and pcm/.
+
+    The index lives in SQLite so it survives restarts and is shared by the stage worker
+    processes. When the cached files exceed the byte budget, the least recently used
+    ones are deleted. Hit, miss and eviction counts are kept in the same database.
+    """
+
+    def __init__(self, db_path: str = None, budget_bytes: int = None):
+        self.db_path = db_path or os.path.join(os.getcwd(), "cache.sqlite3")
+        self.budget_bytes = budget_bytes or env_int("ARTIFACT_CACHE_BYTES", 5 * 1024 ** 3)
+        self.roots = [os.path.join(os.getcwd(), name) for name in CACHE_DIRS]
+
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS artifacts (key TEXT PRIMARY KEY, path TEXT, size INTEGER, last_access REAL)")
+            db.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)")
+
+    def _connect(self):
+        # a short-lived connection per call keeps this safe across threads and processes
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _count(self, db, name: str, amount: int = 1):
+        db.execute(
+            "INSERT INTO stats (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + ?",
+            (name, amount, amount),
+        )
+
+    def get(self, key: str):
+        with self._connect() as db:
+            row = db.execute("SELECT path FROM artifacts WHERE key = ?", (key,)).fetchone()
+            if row and os.path.exists(row[0]):
+                db.execute("UPDATE artifacts SET last_access = ? WHERE key = ?", (time.time(), key))
+                self._count(db, "hits")
+                return row[0]
+            if row:
+                # the file was removed behind our back
+                db.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+            self._count(db, "misses")
+            return None
+
+    def put(self, key: str, path: str):
+        if not path or not os.path.exists(path):
+            return path
+        path = os.path.abspath(path)
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO artifacts (key, path, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, path, os.path.getsize(path), time.time()),
+            )
+            self._evict(db, keep=key)
+        return path
+
+    def _evict(self, db, keep: str):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+        if total <= self.budget_bytes:
+            return
+        rows = db.execute("SELECT key, path, size FROM artifacts WHERE key != ? ORDER BY last_access", (keep,)).fetchall()
+        for key, path, size in rows:
+            if total <= self.budget_bytes:
+                break
+            db.execute("DELETE FROM artifacts WHERE key = ?", (key,))
+            # several keys can point at one file (e.g. a download and a zero-length trim of it)
+            still_used = db.execute("SELECT 1 FROM artifacts WHERE path = ?", (path,)).fetchone()
+            if not still_used and self._owns(path) and os.path.exists(path):
+                os.remove(path)
+            total -= size
+            self._count(db, "evictions")
+
+    def _owns(self, path: str):
+        return any(os.path.commonpath([root, path]) == root for root in self.roots)
+
+    def stats(self):
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT name, value FROM stats").fetchall())
+            entries, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts").fetchone()
+        hits, misses = counts.get("hits", 0), counts.get("misses", 0)
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": counts.get("evictions", 0),
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+            "bytes": total,
+            "budget_bytes": self.budget_bytes,
+        }
+
+
+_cache = None
+
+
+def get_cache():
+    # one instance per process; the stage worker processes each create their own
+    global _cache
+    if _cache is None:
+        _cache = ArtifactCache()
+    return _cache
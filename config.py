@@ -0,0 +1,12 @@
+import os
+
+
+def env_int(name: str, default: int):
+    """
+    Reads an integer setting from the environment, falling back to the default when
+    the variable is unset or empty (as it is in .example.env).
+    """
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
@@ -0,0 +1,259 @@
+# posting results back to Discord: fitted to the upload limit, bundled and sent side by side
+
+import asyncio
+import os
+import time
+from collections import deque
+import discord
+from cache import get_cache, make_key, file_digest
+from config import env_int
+from ingest import probe_duration, run_command
+from telemetry import telemetry
+
+FILE_EXTENSIONS = (".mp3", ".wav", ".mid", ".musicxml", ".pdf")
+AUDIO_EXTENSIONS = (".mp3", ".wav")
+# Discord's limits per message
+MAX_FILES = 10
+MAX_CONTENT = 2000
+# re-encoded audio: never above what the originals use, never below what's still listenable
+MAX_BITRATE = 192
+MIN_BITRATE = 48
+# room for the mp3 container and the form encoding around the file
+HEADROOM = 0.95
+
+
+def upload_limit(message, default: int = None):
+    # the guild's limit depends on its boost level; DMs get the default
+    guild = getattr(message, "guild", None)
+    return getattr(guild, "filesize_limit", None) or default or env_int("DELIVERY_DEFAULT_LIMIT", 10 * 1024 ** 2)
+
+
+def format_result(label: str, value):
+    # (text, file path or None) for one pipeline result
+    if isinstance(value, list):
+        # search candidates, best first
+        lines = []
+        for i, video in enumerate(value, 1):
+            # yt_dlp's flat search gives durations as floats (213.0), or none at all
+            d = int(video["duration"] or 0)
+            lines.append(f"{i}. {video['title']} ({d // 60}:{d % 60:02d}) {video['url']}")
+        return label + "\n" + "\n".join(lines), None
+    if isinstance(value, dict):
+        return label + "\n" + value["url"], None
+    if isinstance(value, str) and value.endswith(FILE_EXTENSIONS):
+        return label, value
+    return label, None
+
+
+class _Reply:
+    def __init__(self):
+        self.texts = []
+        self.paths = []
+        self.size = 0
+        # futures of the results in this reply, set to whether it was sent
+        self.waiting = []
+
+
+class Delivery:
+    """
+    Sends pipeline results as Discord replies.
+
+    Every file is checked against the upload limit of the guild it goes to before it is
+    sent. Audio over it is re-encoded to the mp3 bitrate that fits its duration (cached, so
+    a repeat costs nothing); anything that still doesn't fit gets a message saying so.
+    Results of the same message that arrive within DELIVERY_LINGER_MS of each other share
+    replies: files up to DELIVERY_BUNDLE_BYTES (MIDI, MusicXML, short clips) go together
+    in as few messages as Discord's size, count and length limits allow. Larger files get
+    a reply of their own. Replies are sent side by side, DELIVERY_CONCURRENCY at a time
+    per channel; discord.py waits out any rate limit Discord reports.
+    """
+
+    def __init__(self, executor, concurrency: int = None, linger_ms: int = None, bundle_bytes: int = None):
+        self.executor = executor
+        self.concurrency = concurrency or env_int("DELIVERY_CONCURRENCY", 3)
+        self.linger = (linger_ms if linger_ms is not None else env_int("DELIVERY_LINGER_MS", 200)) / 1000
+        self.bundle_bytes = bundle_bytes or env_int("DELIVERY_BUNDLE_BYTES", 1024 ** 2)
+        # message ID -> [(label, value, future)] waiting to be sent
+        self._pending = {}
+        self._channels = {}
+
+        self.replies = 0
+        self.files = 0
+        self.bundled = 0
+        self.reencoded = 0
+        self.too_large = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)
+
+    async def post(self, message, label: str, value):
+        """
+        Sends one result as a reply to message. Returns whether it (and its file) was sent,
+        once it has been.
+        """
+        future = asyncio.get_running_loop().create_future()
+        pending = self._pending.setdefault(message.id, [])
+        pending.append((label, value, future))
+        if len(pending) == 1:
+            asyncio.ensure_future(self._flush(message))
+        return await future
+
+    async def send(self, message, response):
+        # a plain reply, or a list of (label, value) results
+        if isinstance(response, str):
+            return await self.post(message, response, None)
+        sent = await asyncio.gather(*(self.post(message, label, value) for label, value in response))
+        return all(sent)
+
+    async def _flush(self, message):
+        await asyncio.sleep(self.linger)
+        items = self._pending.pop(message.id)
+        started = time.perf_counter()
+        try:
+            replies = await self._prepare(message, items)
+            await asyncio.gather(*(self._reply(message, reply, started) for reply in replies))
+        finally:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_result(False)
+
+    async def _prepare(self, message, items: list):
+        limit = upload_limit(message)
+        replies = []
+        files = []
+        for label, value, future in items:
+            text, path = format_result(label, value)
+            if path is None or not os.path.exists(path):
+                reply = _Reply()
+                reply.texts.append(text)
+                reply.waiting.append(future)
+                replies.append(reply)
+            else:
+                files.append((text, path, future))
+
+        fitted = await asyncio.gather(*(self._fit(path, limit) for _, path, _ in files))
+        bundle = None
+        for (text, original, future), fit in zip(files, fitted):
+            if fit is None:
+                self.too_large += 1
+                size = os.path.getsize(original) / 1024 ** 2
+                reply = _Reply()
+                reply.texts.append(f"{text}\n{os.path.basename(original)} is {size:.0f} MB, too large to send here (the limit is {limit / 1024 ** 2:.0f} MB).")
+                replies.append(reply)
+                # the note goes out, the file doesn't
+                future.set_result(False)
+                continue
+            path, size, note = fit
+            text += note
+            if size > self.bundle_bytes:
+                reply = _Reply()
+            else:
+                fits = (
+                    bundle is not None
+                    and len(bundle.paths) < MAX_FILES
+                    and bundle.size + size <= limit * HEADROOM
+                    and len("\n".join(bundle.texts + [text])) <= MAX_CONTENT
+                )
+                if not fits:
+                    bundle = _Reply()
+                    replies.append(bundle)
+                elif bundle.paths:
+                    self.bundled += 1
+                reply = bundle
+            reply.texts.append(text)
+            reply.paths.append(path)
+            reply.size += size
+            reply.waiting.append(future)
+            if reply is not bundle:
+                replies.append(reply)
+        return replies
+
+    async def _fit(self, path: str, limit: int):
+        """
+        (path, size, note) of a version of the file within limit, or None if there is none.
+        """
+        size = os.path.getsize(path)
+        if size <= limit * HEADROOM:
+            return path, size, ""
+        if not path.endswith(AUDIO_EXTENSIONS):
+            return None
+        try:
+            with telemetry.span("reencode"):
+                duration = await probe_duration(path)
+                bitrate = min(MAX_BITRATE, int(limit * HEADROOM * 8 / duration / 1000))
+                if bitrate < MIN_BITRATE:
+                    return None
+                smaller = await self._reencode(path, bitrate)
+        except (RuntimeError, ValueError) as e:
+            print(f"Re-encoding {path} failed: {e}")
+            return None
+        size = os.path.getsize(smaller)
+        if size > limit * HEADROOM:
+            return None
+        self.reencoded += 1
+        return smaller, size, f" (re-encoded to {bitrate} kbps to fit the {limit / 1024 ** 2:.0f} MB upload limit)"
+
+    async def _reencode(self, path: str, bitrate: int):
+        digest = await self.executor.run_io("lookup", file_digest, path)
+        key = make_key("deliver", digest, bitrate=bitrate)
+        cached = await self.executor.run_io("lookup", get_cache().get, key)
+        if cached is not None:
+            return cached
+        name = os.path.splitext(os.path.basename(path))[0]
+        # stems of different songs share names (vocals.mp3), so the digest keeps them apart
+        output_path = os.path.join(os.getcwd(), "results", f"{name}_{digest[:8]}_{bitrate}k.mp3")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        partial_path = output_path + ".part.mp3"
+        try:
+            await run_command("ffmpeg", "-v", "error", "-y", "-i", path, "-vn", "-b:a", f"{bitrate}k", partial_path)
+            os.replace(partial_path, output_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return await self.executor.run_io("lookup", get_cache().put, key, output_path)
+
+    def _slots(self, channel_id):
+        if channel_id not in self._channels:
+            self._channels[channel_id] = asyncio.Semaphore(self.concurrency)
+        return self._channels[channel_id]
+
+    async def _reply(self, message, reply: _Reply, started: float):
+        text = "\n".join(reply.texts)
+        sent = False
+        async with self._slots(message.channel.id):
+            try:
+                with telemetry.span("upload"):
+                    if reply.paths:
+                        print(f"Sending files: {', '.join(reply.paths)}, with message: {text}")
+                        await message.reply(text, files=[discord.File(path) for path in reply.paths])
+                    else:
+                        await message.reply(text)
+                sent = True
+            except Exception as e:
+                print(f"Error sending reply: {e}")
+                self.failed += 1
+        self.replies += 1
+        self.files += len(reply.paths) if sent else 0
+        self.latencies.append(time.perf_counter() - started)
+        if not sent and reply.paths:
+            # say something rather than nothing
+            try:
+                await message.reply(f"{text}\nSorry, I couldn't upload the file.")
+            except Exception as e:
+                print(f"Error sending reply: {e}")
+        for future in reply.waiting:
+            if not future.done():
+                future.set_result(sent)
+
+    def metrics(self):
+        ordered = sorted(self.latencies)
+        return {
+            "replies": self.replies,
+            "files": self.files,
+            "bundled": self.bundled,
+            "reencoded": self.reencoded,
+            "too_large": self.too_large,
+            "failed": self.failed,
+            "failure_rate": self.failed / self.replies if self.replies else 0.0,
+            "latency_p50": ordered[len(ordered) // 2] if ordered else 0.0,
+            "latency_p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0,
+        }
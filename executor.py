@@ -0,0 +1,123 @@
+# run blocking pipeline stages off the discord event loop
+
+import asyncio
+import functools
+import importlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from config import env_int
+from telemetry import telemetry
+
+# How many jobs of each stage may run at once. Override any of them with
+# STAGE_LIMIT_<STAGE>, e.g. STAGE_LIMIT_SEPARATE=2.
+DEFAULT_STAGE_LIMITS = {
+    "lookup": 8,
+    "decode": 2,
+    "encode": 2,
+    "download": 4,
+    "search": 4,
+    "score": 4,
+    "trim": 2,
+    "transcribe": 1,
+    "separate": 1,
+}
+
+
+def preload(*modules):
+    # imports modules in whichever process runs this, ahead of the first job that needs them
+    for name in modules:
+        importlib.import_module(name)
+
+
+def stage_limits_from_env():
+    return {stage: env_int(f"STAGE_LIMIT_{stage.upper()}", limit) for stage, limit in DEFAULT_STAGE_LIMITS.items()}
+
+
+class StageExecutor:
+    """
+    Runs the blocking stages of the pipeline in worker pools so the event loop only awaits results.
+
+    I/O bound stages (yt_dlp, the scoring service) run in a thread pool and CPU bound stages
+    (demucs, transkun, pydub) run in a process pool. Each stage is also capped by its own semaphore.
+    Every job is timed as a telemetry span named after its stage.
+    """
+
+    def __init__(self, io_workers: int = None, cpu_workers: int = None, stage_limits: dict = None):
+        self.io_workers = io_workers or env_int("IO_WORKERS", 8)
+        self.cpu_workers = cpu_workers or env_int("CPU_WORKERS", 2)
+        self.stage_limits = stage_limits or stage_limits_from_env()
+
+        self._io_pool = None
+        self._cpu_pool = None
+        self._semaphores = {}
+        self.waiting = {}
+        self.running = {}
+
+    @property
+    def io_pool(self):
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="stage-io")
+        return self._io_pool
+
+    @property
+    def cpu_pool(self):
+        if self._cpu_pool is None:
+            # spawn rather than fork: torch does not survive being forked from a process
+            # that already has threads running (the discord client, the I/O pool)
+            self._cpu_pool = ProcessPoolExecutor(
+                max_workers=self.cpu_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._cpu_pool
+
+    def _semaphore(self, stage: str):
+        if stage not in self._semaphores:
+            self._semaphores[stage] = asyncio.Semaphore(self.stage_limits.get(stage, 1))
+        return self._semaphores[stage]
+
+    async def run_io(self, stage: str, fn, *args, **kwargs):
+        return await self._run(self.io_pool, stage, fn, *args, **kwargs)
+
+    async def run_cpu(self, stage: str, fn, *args, **kwargs):
+        # fn and its arguments must be picklable: module level functions or methods of picklable objects
+        return await self._run(self.cpu_pool, stage, fn, *args, **kwargs)
+
+    async def _run(self, pool, stage: str, fn, *args, **kwargs):
+        self.waiting[stage] = self.waiting.get(stage, 0) + 1
+        try:
+            await self._semaphore(stage).acquire()
+        finally:
+            self.waiting[stage] -= 1
+        self.running[stage] = self.running.get(stage, 0) + 1
+        try:
+            # timed from when the job gets its slot, so the span is the stage's own work
+            with telemetry.span(stage):
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.running[stage] -= 1
+            self._semaphore(stage).release()
+
+    def metrics(self):
+        # jobs per stage waiting for a slot and running
+        return {"waiting": dict(self.waiting), "running": dict(self.running)}
+
+    async def preload(self, io_modules: tuple = (), cpu_modules: tuple = ()):
+        """
+        Imports io_modules in this process (which the thread pool shares) and cpu_modules in
+        the process pool's workers, starting them. Nothing is imported on the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        jobs = [loop.run_in_executor(self.io_pool, preload, *io_modules)] if io_modules else []
+        if cpu_modules:
+            # one job per worker; the pool starts a new worker for each job no idle one can take
+            jobs += [loop.run_in_executor(self.cpu_pool, preload, *cpu_modules) for _ in range(self.cpu_workers)]
+        await asyncio.gather(*jobs)
+
+    def shutdown(self, wait: bool = True):
+        if self._io_pool is not None:
+            self._io_pool.shutdown(wait=wait)
+            self._io_pool = None
+        if self._cpu_pool is not None:
+            self._cpu_pool.shutdown(wait=wait)
+            self._cpu_pool = None
@@ -0,0 +1,252 @@
+# Discord uploads: streamed to disk, stored by content hash, checked before any heavy work
+
+import asyncio
+import hashlib
+import os
+import shutil
+from cache import get_cache, make_key, remember_digest
+from config import env_int
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".flac", ".ogg", ".m4a", ".aac", ".opus")
+# the audio track is extracted to mp3
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".webm", ".mkv")
+CHUNK_BYTES = 1 << 16
+
+
+class IngestError(Exception):
+    # the message is shown to the user
+    pass
+
+
+def attachment_path(attachment_id, filename: str):
+    """
+    Where an attachment is saved: unique per attachment, so two "song.mp3"s don't collide,
+    and named after the original so results keep the song's name.
+    """
+    base, ext = os.path.splitext(os.path.basename(filename))
+    if ext.lower() in VIDEO_EXTENSIONS:
+        ext = ".mp3"
+    return os.path.join(os.getcwd(), "uploads", f"{attachment_id}_{base}{ext}")
+
+
+def check_attachment(filename: str, size: int = None, max_bytes: int = None):
+    # what can be checked from the attachment's metadata, before downloading it
+    max_bytes = max_bytes or env_int("INGEST_MAX_BYTES", 100 * 1024 ** 2)
+    ext = os.path.splitext(filename)[1].lower()
+    if ext not in AUDIO_EXTENSIONS + VIDEO_EXTENSIONS:
+        raise IngestError(f"I can't work with {filename}: send an audio or video file ({', '.join(AUDIO_EXTENSIONS + VIDEO_EXTENSIONS)}).")
+    if size is not None and size > max_bytes:
+        raise IngestError(f"{filename} is {size / 1024 ** 2:.0f} MB, over the {max_bytes / 1024 ** 2:.0f} MB limit.")
+
+
+async def run_command(*args):
+    process = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    out, err = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(err.decode(errors="replace").strip() or f"{args[0]} exited with {process.returncode}")
+    return out.decode()
+
+
+async def probe_duration(path: str):
+    out = await run_command("ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", path)
+    return float(out.strip())
+
+
+async def extract_audio(path: str, output_path: str):
+    await run_command("ffmpeg", "-v", "error", "-y", "-i", path, "-vn", "-q:a", "2", output_path)
+    return output_path
+
+
+async def start_extract(output_path: str, max_seconds: int):
+    # an ffmpeg extracting the audio of the video written to its stdin; it stops a second
+    # past the limit, which is enough to tell the video is too long
+    return await asyncio.create_subprocess_exec(
+        "ffmpeg", "-v", "error", "-y", "-i", "pipe:0", "-vn", "-q:a", "2", "-t", str(max_seconds + 1), output_path,
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+
+
+async def _feed(process, chunk: bytes):
+    # the process, or None once it stopped reading: at the time limit, or on a video it
+    # can't read from a pipe (an mp4 with its index at the end)
+    try:
+        process.stdin.write(chunk)
+        await process.stdin.drain()
+        return process
+    except (BrokenPipeError, ConnectionResetError):
+        await process.wait()
+        return None
+
+
+async def _finish(process):
+    # whether the process extracted the whole video
+    try:
+        process.stdin.close()
+        await process.stdin.wait_closed()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    return await process.wait() == 0
+
+
+class Ingest:
+    """
+    Saves attachments under uploads/, by the SHA-256 of their bytes.
+
+    fetch() streams an attachment to disk in chunks, hashing it on the way, and stops as
+    soon as it passes the size limit. A video's chunks also go to an ffmpeg subprocess that
+    extracts its audio while it downloads; that ffmpeg stops a second past the duration
+    limit, and the limit is checked on its output. Videos ffmpeg can't read from a pipe (an
+    mp4 with its index at the end) are extracted from the saved file once it is complete.
+    An upload whose hash is already stored is not probed, converted or kept again: the
+    stored file is linked to the attachment's path, and since its digest is the same, its
+    decoded audio, stems and MIDI come from the artifact cache. The hash is only known at
+    the end, so a re-uploaded video is still extracted while it downloads, and that output
+    is thrown away.
+
+    Audio files are not decoded while they download: decoded PCM is cached by content hash,
+    so decoding starts once the file is complete. Their duration is checked with ffprobe
+    before anything else runs on them.
+    """
+
+    def __init__(self, executor, max_bytes: int = None, max_seconds: int = None, concurrency: int = None):
+        self.executor = executor
+        self.max_bytes = max_bytes or env_int("INGEST_MAX_BYTES", 100 * 1024 ** 2)
+        self.max_seconds = max_seconds or env_int("INGEST_MAX_SECONDS", 20 * 60)
+        self.concurrency = concurrency or env_int("INGEST_CONCURRENCY", 4)
+        self._session = None
+        self._semaphore = None
+
+        self.ingested = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.bytes = 0
+
+    async def _get_session(self):
+        # created on first use so it binds to the running loop
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch(self, url: str, filename: str, path: str, size: int = None):
+        """
+        Saves the attachment at url to path (see attachment_path). Returns path, or raises
+        IngestError when the file breaks a limit.
+        """
+        try:
+            check_attachment(filename, size, self.max_bytes)
+            session = await self._get_session()
+            async with self._semaphore:
+                return await self._fetch(session, url, filename, path)
+        except IngestError:
+            self.rejected += 1
+            raise
+
+    async def _fetch(self, session, url: str, filename: str, path: str):
+        ext = os.path.splitext(filename)[1].lower()
+        video = ext in VIDEO_EXTENSIONS
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f"{path}.part{ext}"
+        # the audio a video's ffmpeg extracts while it downloads
+        converted = f"{path}.part.mp3" if video else None
+        try:
+            digest, streamed = await self._download(session, url, filename, partial_path, converted)
+            key = make_key("upload", digest, format="mp3" if video else ext)
+            stored = await self.executor.run_io("lookup", get_cache().get, key)
+            if stored is not None:
+                self.deduplicated += 1
+            else:
+                stored = await self._store(partial_path, filename, digest, video, ext, converted if streamed else None)
+                stored = await self.executor.run_io("lookup", get_cache().put, key, stored)
+            _link(stored, path)
+            # the attachment's own name counts against the cache budget too, and is evicted with
+            # it; a hard link's bytes are counted twice, which only makes eviction start sooner
+            await self.executor.run_io("lookup", get_cache().put, make_key("attachment", os.path.basename(path)), path)
+            if not video:
+                remember_digest(path, digest)
+            self.ingested += 1
+            return path
+        finally:
+            for leftover in (partial_path, converted):
+                if leftover is not None and os.path.exists(leftover):
+                    os.remove(leftover)
+
+    async def _download(self, session, url: str, filename: str, partial_path: str, converted: str = None):
+        # (digest, whether converted holds the audio extracted on the way)
+        sha = hashlib.sha256()
+        received = 0
+        extractor = await start_extract(converted, self.max_seconds) if converted is not None else None
+        try:
+            async with session.get(url) as response:
+                response.raise_for_status()
+                with open(partial_path, "wb") as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+                        received += len(chunk)
+                        if received > self.max_bytes:
+                            raise IngestError(f"{filename} is over the {self.max_bytes / 1024 ** 2:.0f} MB limit.")
+                        sha.update(chunk)
+                        f.write(chunk)
+                        if extractor is not None:
+                            extractor = await _feed(extractor, chunk)
+            streamed = extractor is not None and await _finish(extractor)
+        except BaseException:
+            if extractor is not None and extractor.returncode is None:
+                extractor.kill()
+                await extractor.wait()
+            raise
+        self.bytes += received
+        return sha.hexdigest(), streamed
+
+    async def _store(self, partial_path: str, filename: str, digest: str, video: bool, ext: str, converted: str = None):
+        # converted: a video's audio, already extracted while it downloaded
+        try:
+            duration = await probe_duration(converted or partial_path)
+        except (RuntimeError, ValueError):
+            raise IngestError(f"I couldn't read {filename} as audio or video.")
+        if duration > self.max_seconds:
+            if converted is not None:
+                # extraction stopped just past the limit, so the full length isn't known
+                raise IngestError(f"{filename} is over the {self.max_seconds / 60:.0f} minute limit.")
+            raise IngestError(f"{filename} is {duration / 60:.0f} minutes long, over the {self.max_seconds / 60:.0f} minute limit.")
+
+        stored_path = os.path.join(os.getcwd(), "uploads", digest + (".mp3" if video else ext))
+        if converted is not None:
+            os.replace(converted, stored_path)
+        elif video:
+            converted = stored_path + ".part.mp3"
+            try:
+                await extract_audio(partial_path, converted)
+                os.replace(converted, stored_path)
+            except RuntimeError as e:
+                raise IngestError(f"I couldn't get the audio out of {filename}.") from e
+            finally:
+                if os.path.exists(converted):
+                    os.remove(converted)
+        else:
+            os.replace(partial_path, stored_path)
+        return stored_path
+
+    def metrics(self):
+        return {
+            "ingested": self.ingested,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+            "bytes": self.bytes,
+        }
+
+
+def _link(stored_path: str, path: str):
+    # a hard link shares the stored bytes, so the file is only gone once both are evicted
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        os.link(stored_path, path)
+    except OSError:
+        shutil.copyfile(stored_path, path)
@@ -0,0 +1,227 @@
+# turn messages into the request list handle_message runs, calling the LLM only when needed
+
+import hashlib
+import json
+import math
+import re
+import time
+from collections import OrderedDict, deque
+from urllib.parse import urlparse
+from config import env_int
+from youtube.links import video_id
+
+URL = re.compile(r"https?://\S+")
+YOUTUBE_HOSTS = ("youtube.com", "youtu.be")
+
+# h:mm:ss or m:ss, and plain seconds or minutes ("90s", "2 minutes")
+CLOCK_TIME = re.compile(r"\b(?:(\d+):)?(\d{1,2}):(\d{2})\b")
+UNIT_TIME = re.compile(r"\b(\d+(?:\.\d+)?)\s*(s|secs?|seconds?|m|mins?|minutes?)\b")
+
+MIDI = re.compile(r"\bmidi\b")
+SHEET_MUSIC = re.compile(r"sheet\s*music|\bsheets?\b|\bscore\b|\bnotation\b|\bmusicxml\b")
+TRIM = re.compile(r"\b(trim|cut|clip|excerpt)\b")
+STEMS = re.compile(r"\b(stems?|separat\w*|isolat\w*|split|extract)\b")
+INSTRUMENTS = {
+    "vocals": r"vocals?|voice|singing|acapella|a cappella",
+    "drums": r"drums?|percussion",
+    "bass": r"bass",
+    "piano": r"piano|keys",
+    "guitar": r"guitars?",
+    # "other" alone is usually "the other instruments", not the stem
+    "other": r"other\s+(?:stem|track)s?",
+}
+# anything that changes the meaning in ways the rules don't model goes to the LLM
+AMBIGUOUS = re.compile(
+    r"\b(search|find|look\s*up|no|not|don'?t|without|only|just|instead|except|previous|last|earlier|same"
+    r"|other(?!\s+(?:stem|track)s?\b))\b"
+)
+
+# fields the pipeline reads without a default
+REQUIRED_FIELDS = {"TRIM": ("start_time", "end_time"), "SEARCH": ("query",), "STEM_SEPARATION": ()}
+
+NONE_REQUEST = [{"type": "none"}]
+
+
+def _youtube_links(text: str):
+    return [url.rstrip(".,)>") for url in URL.findall(text) if urlparse(url).netloc.lower().endswith(YOUTUBE_HOSTS)]
+
+
+def parse_times(text: str):
+    # every time mentioned in text, in seconds, in the order they appear
+    found = []
+    for match in CLOCK_TIME.finditer(text):
+        hours, minutes, seconds = match.groups()
+        found.append((match.start(), int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)))
+    for match in UNIT_TIME.finditer(text):
+        value = float(match.group(1)) * (60 if match.group(2).startswith("m") else 1)
+        found.append((match.start(), int(value) if value.is_integer() else value))
+    return [seconds for _, seconds in sorted(found)]
+
+
+def fast_parse(text: str, has_attachment: bool = False):
+    """
+    Returns the request list for a message that names one YouTube link (or comes with an
+    attachment) and asks plainly for MIDI, sheet music, a trim between two times or stems
+    of named instruments. Returns None for anything else, which then goes to the LLM.
+    """
+    links = _youtube_links(text)
+    if len(links) > 1 or (not links and not has_attachment):
+        return None
+    link = links[0] if links else "none"
+
+    body = URL.sub(" ", text).lower()
+    if AMBIGUOUS.search(body):
+        return None
+
+    times = parse_times(body)
+    wants_trim = bool(TRIM.search(body))
+    wants_stems = bool(STEMS.search(body))
+    if times and not wants_trim:
+        return None
+
+    transcribe = sorted(
+        (match.start(), kind)
+        for kind, pattern in (("MIDI", MIDI), ("SHEET_MUSIC", SHEET_MUSIC))
+        for match in [pattern.search(body)]
+        if match
+    )
+    if wants_stems and (transcribe or wants_trim):
+        # whether the transcription is of the stem or of the whole song is the LLM's call
+        return None
+    instruments = [name for name, pattern in INSTRUMENTS.items() if re.search(rf"\b({pattern})\b", body)]
+    if instruments and not wants_stems:
+        # "with the bass", "give me the vocals": a stem asked for without saying so, or not
+        return None
+
+    requests = []
+    if wants_trim:
+        if len(times) != 2 or times[0] >= times[1]:
+            return None
+        requests.append({"type": "TRIM", "youtube_link": link, "start_time": times[0], "end_time": times[1]})
+
+    for _, kind in transcribe:
+        requests.append({"type": kind, "youtube_link": link, "file_path": "none"})
+
+    if wants_stems:
+        for instrument in instruments or ["vocals"]:
+            requests.append({"type": "STEM_SEPARATION", "youtube_link": link, "file_path": "none", "instrument": instrument})
+
+    return requests or None
+
+
+def parse_reply(content: str):
+    """
+    Reads the request list out of an LLM reply. Tolerates ``` fences, text around the JSON
+    and a single object instead of a list; requests missing fields the pipeline needs are
+    dropped. Returns [{"type": "none"}] if nothing usable is left.
+    """
+    text = (content or "").strip()
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text)
+    candidates = [text]
+    for opening, closing in (("[", "]"), ("{", "}")):
+        start, end = text.find(opening), text.rfind(closing)
+        if 0 <= start < end:
+            candidates.append(text[start:end + 1])
+
+    for candidate in candidates:
+        try:
+            value = json.loads(candidate)
+        except ValueError:
+            continue
+        if isinstance(value, dict):
+            value = [value]
+        if not isinstance(value, list):
+            continue
+        requests = [obj for obj in (_clean(obj) for obj in value) if obj]
+        if requests:
+            return requests
+
+    print(f"Could not parse requests from: {content!r}")
+    return list(NONE_REQUEST)
+
+
+def _clean(obj):
+    if not isinstance(obj, dict) or "type" not in obj:
+        return None
+    if any(field not in obj for field in REQUIRED_FIELDS.get(obj["type"], ())):
+        return None
+    if obj["type"] == "TRIM":
+        for field in ("start_time", "end_time"):
+            if isinstance(obj[field], str):
+                # "1:30" rather than 90
+                times = parse_times(obj[field]) or [None]
+                if times[0] is None:
+                    try:
+                        times = [float(obj[field])]
+                    except ValueError:
+                        return None
+                obj[field] = times[0]
+        start_time, end_time = obj["start_time"], obj["end_time"]
+        numbers = all(isinstance(t, (int, float)) and not isinstance(t, bool) and math.isfinite(t) for t in (start_time, end_time))
+        if not numbers or start_time >= end_time:
+            # null, a list, or an empty or backwards range: nothing sensible to trim
+            return None
+    return obj
+
+
+def normalize(text: str):
+    # the same request typed slightly differently, or with another form of the same link, shares a key
+    text = URL.sub(lambda match: "yt:" + video_id(match.group(0).rstrip(".,)>")), text.lower())
+    return " ".join(text.split()).strip(" .!?")
+
+
+class IntentParser:
+    """
+    Rule-based fast path plus an LRU cache of LLM replies (INTENT_CACHE_SIZE entries),
+    keyed by the normalized message and the song context it was answered with.
+    Counts how requests were served and how long the fast path takes.
+    """
+
+    def __init__(self, cache_size: int = None):
+        self.cache_size = cache_size or env_int("INTENT_CACHE_SIZE", 512)
+        self._cache = OrderedDict()
+        self.fast_path = 0
+        self.cache_hits = 0
+        self.llm_calls = 0
+        self.parse_times = deque(maxlen=1000)
+
+    def parse(self, text: str, has_attachment: bool = False):
+        started = time.perf_counter()
+        requests = fast_parse(text, has_attachment)
+        self.parse_times.append(time.perf_counter() - started)
+        if requests is not None:
+            self.fast_path += 1
+        return requests
+
+    def cache_key(self, text: str, context: str):
+        return hashlib.sha256(json.dumps([normalize(text), context]).encode()).hexdigest()
+
+    def cached(self, key: str):
+        requests = self._cache.get(key)
+        if requests is not None:
+            self._cache.move_to_end(key)
+            self.cache_hits += 1
+        return requests
+
+    def remember(self, key: str, requests: list):
+        self.llm_calls += 1
+        # a failed parse is not worth keeping; the next attempt may do better
+        if requests != NONE_REQUEST:
+            self._cache[key] = requests
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def metrics(self):
+        total = self.fast_path + self.cache_hits + self.llm_calls
+        times = sorted(self.parse_times)
+        return {
+            "requests": total,
+            "fast_path": self.fast_path,
+            "cache_hits": self.cache_hits,
+            "llm_calls": self.llm_calls,
+            "served_without_llm": (self.fast_path + self.cache_hits) / total if total else 0.0,
+            "parse_time_p50": times[len(times) // 2] if times else 0.0,
+            "parse_time_p95": times[min(len(times) - 1, int(len(times) * 0.95))] if times else 0.0,
+            "cache_entries": len(self._cache),
+        }
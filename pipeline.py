@@ -0,0 +1,292 @@
+# compile a message's request list into a graph of stages and run it
+
+import asyncio
+import os
+from youtube.links import video_id
+
+UNKNOWN_REQUEST = "I'm sorry, I don't understand that request."
+
+
+class Node:
+    """
+    One stage run (download, decode, trim, separate, transcribe, score, encode or search). The key names
+    the stage, its parameters and the keys of its inputs, so two requests that need the
+    same work end up sharing a node.
+    """
+
+    def __init__(self, key: tuple, fn, deps: tuple = ()):
+        self.key = key
+        self.fn = fn
+        self.deps = deps
+
+
+class Sink:
+    # a node whose result is posted back to the user, plus its effect on the session
+    def __init__(self, label: str, node: Node, progress: str, failure: str, effect=None):
+        self.label = label
+        self.node = node
+        self.progress = progress
+        self.failure = failure
+        self.effect = effect
+
+
+class Plan:
+    def __init__(self):
+        self.nodes = {}
+        self.sinks = []
+        self.unknown = False
+        # node key -> result, filled in as nodes finish
+        self.values = {}
+
+    def node(self, key: tuple, fn, *deps: Node):
+        if key not in self.nodes:
+            self.nodes[key] = Node(key, fn, deps)
+        return self.nodes[key]
+
+
+def _constant(value):
+    async def fn():
+        return value
+    return fn
+
+
+def compile_requests(json_list: list, stages, session):
+    """
+    Turns the JSON request list into a Plan.
+
+    stages provides the async stage functions (download_audio, decode_audio, encode_audio,
+    search_youtube, trim_audio, stem_separation, transcribe_to_midi, convert_to_sheet_music)
+    and prefetch_search; session holds youtube_to_audio_path, last_audio_path, last_link and
+    songs. Requests are read in order with the same meaning as before: a TRIM or
+    STEM_SEPARATION replaces the audio later requests for that link (or for 'none') work on,
+    and a SEARCH result becomes the audio for 'none'. A session file the artifact cache has
+    evicted is downloaded again from its link.
+    """
+    plan = Plan()
+    link_source = {}
+    last = None
+
+    def kept(vid):
+        # the session's file for a link, unless the artifact cache has evicted it since
+        path = session.youtube_to_audio_path.get(vid)
+        return path if path is not None and os.path.exists(path) else None
+
+    def link_of(path):
+        # the link the session got a file from, to fetch it again
+        for song in reversed(list(session.songs)):
+            if song["file_path"] == path and song["youtube_link"] not in (None, "none"):
+                return song["youtube_link"]
+        return None
+
+    def source(link, file_path):
+        if file_path not in (None, "none"):
+            return plan.node(("file", file_path), _constant(file_path))
+        if link in (None, "none"):
+            if last is not None:
+                return last
+            path = session.last_audio_path
+            if path is None or not os.path.exists(path):
+                # the last search hit, still downloading in the background, or an evicted file
+                link = session.last_link if path is None else link_of(path)
+                if link:
+                    return source(link, "none")
+            return plan.node(("file", path), _constant(path))
+        vid = video_id(link)
+        if vid in link_source:
+            return link_source[vid]
+        path = kept(vid)
+        if path is not None:
+            return plan.node(("file", path), _constant(path))
+        return plan.node(("download", vid), lambda: stages.download_audio(link))
+
+    def fetches_whole(link):
+        # true when the link's audio would otherwise be downloaded in full just for this request
+        if link in (None, "none"):
+            return False
+        vid = video_id(link)
+        return vid not in link_source and kept(vid) is None and ("download", vid) not in plan.nodes
+
+    def decoded(audio):
+        # every source is decoded to PCM once; trims are already views into it
+        if audio.key[0] in ("decode", "trim"):
+            return audio
+        return plan.node(("decode", audio.key), stages.decode_audio, audio)
+
+    def replaces_audio(link, value):
+        # the session update TRIM and STEM_SEPARATION make once their output exists
+        def effect(path):
+            if link not in (None, "none"):
+                session.youtube_to_audio_path[video_id(link)] = path
+            session.last_audio_path = path
+            session.songs.append({"youtube_link": link, "file_path": path, "name": value})
+        return effect
+
+    def remembers(link, name):
+        return lambda path: session.songs.append({"youtube_link": link, "file_path": path, "name": name})
+
+    for obj in json_list:
+        kind = obj["type"]
+        link = obj.get("youtube_link", "none")
+
+        if kind == "none":
+            plan.unknown = True
+            break
+
+        if kind in ("MIDI", "SHEET_MUSIC"):
+            audio = decoded(source(link, obj.get("file_path", "none")))
+            midi = plan.node(("transcribe", audio.key), stages.transcribe_to_midi, audio)
+            if kind == "MIDI":
+                plan.sinks.append(Sink(
+                    "MIDI: ", midi,
+                    "Working on transcribing to MIDI...",
+                    "I'm sorry, I couldn't transcribe the audio to MIDI.",
+                    remembers(link, ""),
+                ))
+            else:
+                score = plan.node(("score", midi.key), stages.convert_to_sheet_music, midi)
+                plan.sinks.append(Sink(
+                    "Editable sheet music: ", score,
+                    "Working on converting to sheet music...this could take ~1 minute...",
+                    "I'm sorry, I couldn't convert the MIDI file to sheet music.",
+                    remembers(link, ""),
+                ))
+
+        if kind == "TRIM":
+            start_time, end_time = obj["start_time"], obj["end_time"]
+            if fetches_whole(link):
+                # nothing else needs the full video, so only the requested window is downloaded
+                encoded = plan.node(
+                    ("download", video_id(link), start_time, end_time),
+                    lambda link=link, start_time=start_time, end_time=end_time: stages.download_audio(link, start_time, end_time),
+                )
+                trimmed = decoded(encoded)
+            else:
+                audio = decoded(source(link, "none"))
+                trimmed = plan.node(
+                    ("trim", audio.key, start_time, end_time),
+                    lambda path, start_time=start_time, end_time=end_time: stages.trim_audio(path, start_time, end_time),
+                    audio,
+                )
+                # later requests work on the view; only the reply needs an encoded file
+                encoded = plan.node(("encode", trimmed.key), stages.encode_audio, trimmed)
+            plan.sinks.append(Sink(
+                "Trimmed audio: ", encoded,
+                "Working on trimming audio...",
+                "I'm sorry, I couldn't trim the audio.",
+                replaces_audio(link, ""),
+            ))
+            if link not in (None, "none"):
+                link_source[video_id(link)] = trimmed
+            last = trimmed
+
+        if kind == "SEARCH":
+            query = obj["query"]
+            found = plan.node(("search", query), lambda query=query: stages.search_youtube(query))
+
+            async def download_hit(candidates):
+                if candidates:
+                    return await stages.download_audio(candidates[0]["url"])
+                return None
+
+            # only run if a later request in this message uses the audio (see below)
+            downloaded = plan.node(("search_download", query), download_hit, found)
+
+            def searched(candidates, query=query, downloaded=downloaded):
+                if not candidates:
+                    return
+                top = candidates[0]["url"]
+                for candidate in reversed(candidates[1:]):
+                    session.songs.append({"youtube_link": candidate["url"], "file_path": None, "name": candidate["title"]})
+                session.songs.append({"youtube_link": top, "file_path": None, "name": query})
+                if downloaded.key in plan.values:
+                    session.youtube_to_audio_path[video_id(top)] = plan.values[downloaded.key]
+                    session.last_audio_path = plan.values[downloaded.key]
+                    session.last_link = None
+                else:
+                    # nothing asked for the audio yet: fetch the best guess in the background
+                    stages.prefetch_search(candidates)
+                    session.last_audio_path = None
+                    session.last_link = top
+
+            plan.sinks.append(Sink(
+                "Search results: ", found,
+                f"Working on searching for {query}...",
+                f"I'm sorry, I couldn't find {query} on YouTube.",
+                searched,
+            ))
+            last = downloaded
+
+        if kind == "STEM_SEPARATION":
+            audio = decoded(source(link, obj.get("file_path", "none")))
+            instrument = obj.get("instrument", "vocals")
+            stem = plan.node(
+                ("separate", audio.key, instrument),
+                lambda path, instrument=instrument: stages.stem_separation(path, instrument),
+                audio,
+            )
+            plan.sinks.append(Sink(
+                f"Stem separation for {instrument}: ", stem,
+                f"Working on separating the audio into {instrument}...(takes ~30 seconds)",
+                f"I'm sorry, I couldn't separate the {instrument} from the audio.",
+                replaces_audio(link, instrument),
+            ))
+            if link not in (None, "none"):
+                link_source[video_id(link)] = stem
+            last = stem
+
+    # a search download nothing depends on is left to the prefetcher
+    used = {dep.key for node in plan.nodes.values() for dep in node.deps}
+    for key in [key for key in plan.nodes if key[0] == "search_download" and key not in used]:
+        del plan.nodes[key]
+
+    return plan
+
+
+async def run_plan(plan: Plan, on_result=None):
+    """
+    Runs every node once, starting each as soon as its inputs are ready, so independent
+    branches (e.g. separation and transcription of the same audio) overlap.
+
+    on_result(label, value) is awaited for each request as soon as its branch finishes.
+    Returns the (label, value) results in request order; session effects are applied in
+    request order after everything has finished.
+    """
+    tasks = {}
+
+    def task(node: Node):
+        if node.key not in tasks:
+            tasks[node.key] = asyncio.ensure_future(run_node(node))
+        return tasks[node.key]
+
+    async def run_node(node: Node):
+        inputs = await asyncio.gather(*(task(dep) for dep in node.deps))
+        value = await node.fn(*inputs)
+        plan.values[node.key] = value
+        return value
+
+    async def finish(sink: Sink):
+        try:
+            result = (sink.label, await task(sink.node))
+        except Exception as e:
+            print(f"Error running {sink.node.key[0]}: {e}")
+            result = (sink.failure, None)
+        if on_result is not None:
+            await on_result(*result)
+        return result
+
+    for node in list(plan.nodes.values()):
+        task(node)
+
+    results = await asyncio.gather(*(finish(sink) for sink in plan.sinks))
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+    for sink, (_, value) in zip(plan.sinks, results):
+        if sink.effect is not None and sink.node.key in plan.values:
+            sink.effect(value)
+
+    if plan.unknown:
+        results.append((UNKNOWN_REQUEST, None))
+        if on_result is not None:
+            await on_result(UNKNOWN_REQUEST, None)
+
+    return results
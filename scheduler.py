@@ -0,0 +1,224 @@
+# queue parsed requests and run them on a fixed number of workers
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from config import env_int
+
+ACCEPTED = "accepted"
+DEFERRED = "deferred"
+REJECTED = "rejected"
+
+
+@dataclass
+class Job:
+    id: int
+    user_id: int
+    channel_id: int
+    message_id: int
+    payload: dict
+    enqueued_at: float
+    started_at: float = None
+    # how many times a worker has picked the job up
+    attempts: int = 0
+
+    @property
+    def fair_key(self):
+        return (self.channel_id, self.user_id)
+
+
+class JobScheduler:
+    """
+    Runs jobs on N workers, taking turns between (channel, user) pairs so one busy user
+    cannot starve everyone else.
+
+    Queued jobs are written to a local SQLite file and reloaded by start(), so anything
+    still waiting (or interrupted mid-run) when the bot stops is picked up again on restart.
+    A job that was already started max_attempts times is dropped instead: it is probably
+    what stopped the bot. Once the queue is past the high-water mark new jobs are deferred
+    (the caller tells the user their place in line), and past max_depth they are rejected.
+
+    on_failure(job, error), if given, is awaited for a job whose handler raised and for one
+    that is dropped, so the user hears about it.
+    """
+
+    def __init__(self, handler, db_path: str = None, workers: int = None, high_water: int = None, max_depth: int = None,
+                 max_attempts: int = None, on_failure=None):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.db_path = db_path or os.path.join(os.getcwd(), "queue.sqlite3")
+        self.workers = workers or env_int("QUEUE_WORKERS", 2)
+        self.high_water = high_water or env_int("QUEUE_HIGH_WATER", 10)
+        self.max_depth = max_depth or env_int("QUEUE_MAX_DEPTH", 50)
+        self.max_attempts = max_attempts or env_int("QUEUE_MAX_ATTEMPTS", 3)
+
+        self._db = sqlite3.connect(self.db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, channel_id INTEGER, message_id INTEGER, "
+            "payload TEXT, status TEXT, enqueued_at REAL, started_at REAL, attempts INTEGER DEFAULT 0)"
+        )
+        columns = [row[1] for row in self._db.execute("PRAGMA table_info(jobs)")]
+        if "attempts" not in columns:
+            # queue files from before attempts were counted
+            self._db.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+        self._db.commit()
+
+        # one FIFO per (channel, user); the OrderedDict order is the round-robin order
+        self._queues = OrderedDict()
+        self._depth = 0
+        self._ready = asyncio.Condition()
+        self._tasks = []
+
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_times = deque(maxlen=1000)
+        self.service_times = deque(maxlen=1000)
+
+    async def start(self):
+        if self._tasks:
+            return
+
+        # jobs that were running when the process stopped go back in the queue
+        self._db.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT id, user_id, channel_id, message_id, payload, enqueued_at, attempts FROM jobs WHERE status = 'queued' ORDER BY id"
+        ).fetchall()
+        known = {job.id for queue in self._queues.values() for job in queue}
+        given_up = []
+        for row in rows:
+            if row[0] in known:
+                continue
+            job = Job(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5], attempts=row[6] or 0)
+            if job.attempts >= self.max_attempts:
+                given_up.append(job)
+                continue
+            self._push(job)
+        for job in given_up:
+            print(f"Dropping job {job.id}: started {job.attempts} times without finishing")
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+            self._db.commit()
+            self.failed += 1
+            await self._report(job, RuntimeError(f"started {job.attempts} times without finishing"))
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, user_id: int, channel_id: int, message_id: int, payload: dict):
+        """
+        Queues a job. Returns (status, position) where status is ACCEPTED, DEFERRED or REJECTED
+        and position is the 1-based place in line the job was given (None if rejected).
+        """
+        if self._depth >= self.max_depth:
+            return REJECTED, None
+
+        enqueued_at = time.time()
+        cursor = self._db.execute(
+            "INSERT INTO jobs (user_id, channel_id, message_id, payload, status, enqueued_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+            (user_id, channel_id, message_id, json.dumps(payload), enqueued_at),
+        )
+        self._db.commit()
+
+        job = Job(cursor.lastrowid, user_id, channel_id, message_id, payload, enqueued_at)
+        position = self.position(job.fair_key, len(self._queues.get(job.fair_key, ())))
+        self._push(job)
+
+        async with self._ready:
+            self._ready.notify()
+
+        status = DEFERRED if self._depth > self.high_water else ACCEPTED
+        return status, position
+
+    def position(self, fair_key, index: int):
+        # under round-robin, every other pair gets up to index + 1 turns before ours comes up
+        ahead = index
+        for key, queue in self._queues.items():
+            if key != fair_key:
+                ahead += min(len(queue), index + 1)
+        return ahead + 1
+
+    def _push(self, job: Job):
+        self._queues.setdefault(job.fair_key, deque()).append(job)
+        self._depth += 1
+
+    def _pop(self):
+        fair_key, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        del self._queues[fair_key]
+        if queue:
+            # back of the line for this pair's next job
+            self._queues[fair_key] = queue
+        self._depth -= 1
+        return job
+
+    async def _worker(self):
+        while True:
+            async with self._ready:
+                await self._ready.wait_for(lambda: self._depth > 0)
+                job = self._pop()
+
+            job.started_at = time.time()
+            job.attempts += 1
+            self.wait_times.append(job.started_at - job.enqueued_at)
+            self._db.execute(
+                "UPDATE jobs SET status = 'running', started_at = ?, attempts = ? WHERE id = ?", (job.started_at, job.attempts, job.id)
+            )
+            self._db.commit()
+
+            self.running += 1
+            try:
+                await self.handler(job)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error running job {job.id}: {e}")
+                self.failed += 1
+                await self._report(job, e)
+            finally:
+                self.running -= 1
+                self.service_times.append(time.time() - job.started_at)
+
+            self._db.execute("DELETE FROM jobs WHERE id = ?", (job.id,))
+            self._db.commit()
+
+    async def _report(self, job: Job, error: Exception):
+        if self.on_failure is None:
+            return
+        try:
+            await self.on_failure(job, error)
+        except Exception as e:
+            print(f"Error reporting the failure of job {job.id}: {e}")
+
+    def metrics(self):
+        return {
+            "queue_depth": self._depth,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+            "wait_time": _summary(self.wait_times),
+            "service_time": _summary(self.service_times),
+        }
+
+
+def _summary(samples):
+    if not samples:
+        return {"count": 0, "mean": 0.0, "p95": 0.0, "max": 0.0}
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
@@ -0,0 +1,193 @@
+# per-channel (or per-user) conversation state: the songs and audio later requests refer to
+
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import env_int
+from song_context import SongContext
+
+# rough cost of an empty session (record, dict, SongContext), used for memory accounting
+SESSION_OVERHEAD = 700
+LINK_OVERHEAD = 200
+
+
+def session_key(channel_id: int, user_id: int):
+    # SESSION_SCOPE=channel shares one session between everyone in a channel
+    if os.getenv("SESSION_SCOPE", "user") == "channel":
+        return str(channel_id)
+    return f"{channel_id}:{user_id}"
+
+
+class Session:
+    __slots__ = ("key", "youtube_to_audio_path", "last_audio_path", "last_link", "songs", "last_used", "active", "bytes")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.youtube_to_audio_path = {}
+        self.last_audio_path = None
+        # a search hit whose audio is being prefetched; stands in for last_audio_path until then
+        self.last_link = None
+        self.songs = SongContext()
+        self.last_used = time.time()
+        # requests currently using the session; it is never evicted while this is above 0
+        self.active = 0
+        self.bytes = SESSION_OVERHEAD
+
+    def measure(self):
+        # the link map is bounded like the song list, oldest links first
+        while len(self.youtube_to_audio_path) > self.songs.max_entries:
+            del self.youtube_to_audio_path[next(iter(self.youtube_to_audio_path))]
+        paths = sum(len(k) + len(v or "") + LINK_OVERHEAD for k, v in self.youtube_to_audio_path.items())
+        self.bytes = SESSION_OVERHEAD + paths + len(self.last_audio_path or "") + len(self.last_link or "") + self.songs.bytes
+        return self.bytes
+
+    def to_json(self):
+        return json.dumps({
+            "youtube_to_audio_path": self.youtube_to_audio_path,
+            "last_audio_path": self.last_audio_path,
+            "last_link": self.last_link,
+            "songs": list(self.songs),
+        })
+
+    @classmethod
+    def from_json(cls, key: str, data: str, last_used: float):
+        state = json.loads(data)
+        session = cls(key)
+        session.youtube_to_audio_path = state["youtube_to_audio_path"]
+        session.last_audio_path = state["last_audio_path"]
+        session.last_link = state.get("last_link")
+        for song in state["songs"]:
+            session.songs.append(song)
+        session.last_used = last_used
+        session.measure()
+        return session
+
+
+class SessionManager:
+    """
+    Holds the sessions of active channels in memory, least recently used first.
+
+    Sessions idle for longer than SESSION_TTL seconds are dropped. When there are more than
+    SESSION_MAX_COUNT sessions, or their estimated size passes SESSION_MEMORY_BYTES, the least
+    recently used ones are evicted from memory. With SESSION_PERSIST (the default) every session
+    is saved to a local SQLite file after each use, so evicted sessions and sessions from before
+    a restart are loaded back on their next message.
+
+    use() pins a session for the duration of a request, so concurrent requests on the same
+    channel share one record and eviction never drops one that is still being changed.
+    """
+
+    def __init__(self, db_path: str = None, ttl: int = None, max_count: int = None, memory_bytes: int = None, persist: bool = None):
+        self.ttl = ttl or env_int("SESSION_TTL", 24 * 3600)
+        self.max_count = max_count or env_int("SESSION_MAX_COUNT", 10000)
+        self.memory_bytes = memory_bytes or env_int("SESSION_MEMORY_BYTES", 64 * 1024 ** 2)
+        persist = env_int("SESSION_PERSIST", 1) if persist is None else persist
+
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._db = None
+        if persist:
+            self._db = sqlite3.connect(db_path or os.path.join(os.getcwd(), "sessions.sqlite3"))
+            # a save per request; losing the last few on a power cut is fine, waiting on fsync is not
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, data TEXT, last_used REAL)")
+            self._db.execute("DELETE FROM sessions WHERE last_used < ?", (time.time() - self.ttl,))
+            self._db.commit()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @property
+    def bytes(self):
+        return self._bytes
+
+    def get(self, key: str):
+        session = self._sessions.get(key)
+        if session is not None and session.active == 0 and session.last_used < time.time() - self.ttl:
+            self._drop(session)
+            self.expirations += 1
+            session = None
+        if session is None:
+            session = self._load(key) or Session(key)
+            self._sessions[key] = session
+            self._bytes += session.bytes
+        self._sessions.move_to_end(key)
+        session.last_used = time.time()
+        return session
+
+    @contextmanager
+    def use(self, key: str):
+        session = self.get(key)
+        session.active += 1
+        try:
+            yield session
+        finally:
+            session.active -= 1
+            session.last_used = time.time()
+            self._update(session)
+
+    def _update(self, session: Session):
+        before = session.bytes
+        self._bytes += session.measure() - before
+        self._save(session)
+        self._evict()
+
+    def _load(self, key: str):
+        if self._db is None:
+            return None
+        row = self._db.execute("SELECT data, last_used FROM sessions WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return Session.from_json(key, row[0], row[1])
+
+    def _save(self, session: Session):
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sessions (key, data, last_used) VALUES (?, ?, ?)",
+                (session.key, session.to_json(), session.last_used),
+            )
+            self._db.commit()
+
+    def _drop(self, session: Session):
+        del self._sessions[session.key]
+        self._bytes -= session.bytes
+
+    def _evict(self):
+        # walk from the least recently used end and stop at the first session worth keeping
+        cutoff = time.time() - self.ttl
+        count, size = len(self._sessions), self._bytes
+        victims = []
+        for session in self._sessions.values():
+            if count <= self.max_count and size <= self.memory_bytes and session.last_used >= cutoff:
+                break
+            if session.active:
+                continue
+            victims.append(session)
+            count -= 1
+            size -= session.bytes
+
+        for session in victims:
+            self._drop(session)
+            if session.last_used < cutoff:
+                self.expirations += 1
+                if self._db is not None:
+                    self._db.execute("DELETE FROM sessions WHERE key = ?", (session.key,))
+                    self._db.commit()
+            else:
+                self.evictions += 1
+
+    def metrics(self):
+        return {
+            "sessions": len(self._sessions),
+            "bytes": self._bytes,
+            "memory_bytes": self.memory_bytes,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
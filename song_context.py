@@ -0,0 +1,149 @@
+# the songs a conversation has touched, and the few of them worth showing the LLM for a message
+
+import heapq
+import json
+import math
+import re
+import time
+from collections import OrderedDict
+from config import env_int
+from youtube.links import video_id
+
+WORD = re.compile(r"[a-z0-9]+")
+URL = re.compile(r"https?://\S+")
+# words that say nothing about which song is meant
+STOPWORDS = {
+    "a", "an", "and", "the", "of", "to", "for", "in", "on", "me", "my", "this", "that", "it", "please",
+    "can", "you", "give", "make", "song", "mp3", "wav", "uploads", "none",
+}
+# the latest songs are always offered: follow-up messages usually mean one of them
+RECENT = 3
+# rough per-entry bookkeeping cost (tuple, index slots, postings), used for memory accounting
+ENTRY_OVERHEAD = 600
+WORD_OVERHEAD = 120
+
+
+def tokens(text: str):
+    if not text:
+        return set()
+    text = URL.sub(lambda match: " " + video_id(match.group(0)) + " ", text)
+    return {word for word in WORD.findall(text.lower()) if word not in STOPWORDS}
+
+
+def estimate_tokens(text: str):
+    # close enough for budgeting; roughly four characters per token for this kind of JSON
+    return len(text) // 4 + 1
+
+
+class SongContext:
+    """
+    Every song, link, trim, stem and upload mentioned so far, kept as an inverted index over
+    the words of its name, link and file name.
+
+    select() returns the entries that share the most (idf weighted) words with a message,
+    plus the most recent few, within top_k entries and a token budget. Entries older than
+    SONG_CONTEXT_MAX_AGE seconds, or beyond SONG_CONTEXT_MAX_ENTRIES, are dropped oldest first.
+    Appends keep the list interface the pipeline already uses; entries are stored as
+    (youtube_link, file_path, name) tuples and handed out as dicts.
+    """
+
+    def __init__(self, top_k: int = None, token_budget: int = None, max_entries: int = None, max_age: int = None):
+        self.top_k = top_k or env_int("SONG_CONTEXT_TOP_K", 8)
+        self.token_budget = token_budget or env_int("SONG_CONTEXT_TOKENS", 600)
+        self.max_entries = max_entries or env_int("SONG_CONTEXT_MAX_ENTRIES", 500)
+        self.max_age = max_age or env_int("SONG_CONTEXT_MAX_AGE", 7 * 24 * 3600)
+
+        # id -> ((youtube_link, file_path, name), words, added_at), oldest first
+        self._entries = OrderedDict()
+        # (youtube_link, file_path, name) -> id, so repeats refresh an entry instead of adding one
+        self._ids = {}
+        self._postings = {}
+        self._next_id = 0
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return (_as_dict(song) for song, _, _ in self._entries.values())
+
+    def append(self, song: dict):
+        identity = (song.get("youtube_link"), song.get("file_path"), song.get("name"))
+        if identity in self._ids:
+            self._remove(self._ids[identity])
+
+        words = tokens(song.get("name")) | tokens(song.get("youtube_link"))
+        if song.get("file_path"):
+            words |= tokens(re.sub(r"[\\/._-]", " ", str(song["file_path"]).rsplit("/", 1)[-1]))
+
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (identity, words, time.time())
+        self._ids[identity] = entry_id
+        for word in words:
+            self._postings.setdefault(word, set()).add(entry_id)
+        self.bytes += _entry_bytes(identity, words)
+        self._age_out()
+
+    def _remove(self, entry_id: int):
+        identity, words, _ = self._entries.pop(entry_id)
+        del self._ids[identity]
+        self.bytes -= _entry_bytes(identity, words)
+        for word in words:
+            posting = self._postings[word]
+            posting.discard(entry_id)
+            if not posting:
+                del self._postings[word]
+
+    def _age_out(self):
+        cutoff = time.time() - self.max_age
+        while self._entries:
+            entry_id, (_, _, added_at) = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_entries and added_at >= cutoff:
+                break
+            self._remove(entry_id)
+
+    def select(self, text: str, top_k: int = None, token_budget: int = None):
+        """
+        The entries most relevant to text, oldest first like the full list they replace.
+        Only entries sharing a word with text are scored, so the cost follows the matches
+        rather than the size of the history.
+        """
+        self._age_out()
+        top_k = top_k or self.top_k
+        token_budget = token_budget or self.token_budget
+
+        scores = {}
+        total = len(self._entries)
+        for word in tokens(text):
+            posting = self._postings.get(word)
+            if posting:
+                weight = math.log(1 + total / len(posting))
+                for entry_id in posting:
+                    scores[entry_id] = scores.get(entry_id, 0.0) + weight
+
+        recent = [entry_id for entry_id, _ in zip(reversed(self._entries), range(RECENT))]
+        ranked = heapq.nlargest(top_k, scores, key=lambda entry_id: (scores[entry_id], entry_id))
+        chosen, used = [], 2
+        for entry_id in ranked + recent:
+            if entry_id in chosen or len(chosen) >= top_k:
+                continue
+            cost = estimate_tokens(json.dumps(_as_dict(self._entries[entry_id][0]))) + 1
+            if used + cost > token_budget:
+                continue
+            chosen.append(entry_id)
+            used += cost
+        return [_as_dict(self._entries[entry_id][0]) for entry_id in sorted(chosen)]
+
+    def prompt(self, text: str):
+        # the relevant songs, wrapped in --- the way the system prompt describes
+        return "---" + json.dumps(self.select(text)) + "---"
+
+
+def _as_dict(song: tuple):
+    youtube_link, file_path, name = song
+    return {"youtube_link": youtube_link, "file_path": file_path, "name": name}
+
+
+def _entry_bytes(song: tuple, words: set):
+    return ENTRY_OVERHEAD + sum(len(str(field or "")) for field in song) + WORD_OVERHEAD * len(words)
@@ -0,0 +1,249 @@
+# per-request stage timings, latency histograms, counters and gauges, kept in memory
+
+import bisect
+import contextvars
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from config import env_int
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PREFIX = "songbot"
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_sampled = contextvars.ContextVar("sampled", default=None)
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        # the latest observations, for the percentiles in !stats
+        self.recent = deque(maxlen=1000)
+
+    def observe(self, seconds: float):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def percentile(self, q: float):
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+
+class _Span:
+    # a plain class rather than @contextmanager: unsampled spans should cost next to nothing
+    __slots__ = ("telemetry", "stage", "sampled", "started")
+
+    def __init__(self, telemetry, stage: str, sampled: bool):
+        self.telemetry = telemetry
+        self.stage = stage
+        self.sampled = sampled
+
+    def __enter__(self):
+        if self.sampled:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        failed = exc_type is not None and issubclass(exc_type, Exception)
+        if failed:
+            self.telemetry.count("stage_errors", stage=self.stage)
+        if self.sampled:
+            self.telemetry.record(self.stage, self.started, time.perf_counter() - self.started, failed)
+        return False
+
+
+class Telemetry:
+    """
+    Timing spans per stage, tied to the request (the Discord message ID) they ran for.
+
+    span() times a block of code into its stage's latency histogram and appends it to the
+    request's trace; failures are counted per stage. Requests are sampled by ID, TRACE_SAMPLE
+    percent of them (all by default), and outside a sampled request span() is a no-op, so
+    turning sampling down turns the cost down with it. Counters are always kept.
+
+    Components register a collector returning their own metrics() dict; those are read only
+    when the metrics are rendered, for the Prometheus text format or !stats.
+    """
+
+    def __init__(self, sample_percent: int = None, keep_traces: int = None):
+        self.sample_percent = sample_percent if sample_percent is not None else env_int("TRACE_SAMPLE", 100)
+        self.histograms = {}
+        self.counters = {}
+        self.collectors = {}
+        # request ID -> [(stage, perf_counter at start, seconds, failed)], the latest requests only
+        self.traces = OrderedDict()
+        self.keep_traces = keep_traces or env_int("TRACE_KEEP", 200)
+        self._lock = threading.Lock()
+
+    def sampled(self, request_id=None):
+        if request_id is None:
+            return self.sample_percent >= 100
+        return zlib.crc32(str(request_id).encode()) % 100 < self.sample_percent
+
+    @contextmanager
+    def request(self, request_id):
+        # the same ID makes the same sampling decision, so a message's parse and its job share one trace
+        id_token = _request_id.set(request_id)
+        sampled_token = _sampled.set(self.sampled(request_id))
+        try:
+            yield
+        finally:
+            _request_id.reset(id_token)
+            _sampled.reset(sampled_token)
+
+    def _sampling(self):
+        sampled = _sampled.get()
+        return self.sampled() if sampled is None else sampled
+
+    def span(self, stage: str):
+        return _Span(self, stage, self._sampling())
+
+    def record(self, stage: str, started: float, seconds: float, failed: bool = False):
+        request_id = _request_id.get()
+        with self._lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = Histogram()
+            self.histograms[stage].observe(seconds)
+            if request_id is None:
+                return
+            trace = self.traces.get(request_id)
+            if trace is None:
+                trace = self.traces[request_id] = []
+                while len(self.traces) > self.keep_traces:
+                    self.traces.popitem(last=False)
+            trace.append((stage, started, seconds, failed))
+
+    def observe(self, stage: str, seconds: float):
+        # for timings measured elsewhere, e.g. inside the transkun worker process
+        if self._sampling():
+            with self._lock:
+                if stage not in self.histograms:
+                    self.histograms[stage] = Histogram()
+                self.histograms[stage].observe(seconds)
+
+    def count(self, name: str, amount: int = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def register(self, name: str, collect):
+        self.collectors[name] = collect
+
+    def trace(self, request_id):
+        """
+        The request's spans as (stage, start offset, seconds, failed), in the order they started.
+        """
+        with self._lock:
+            spans = sorted(self.traces.get(request_id, []), key=lambda span: span[1])
+        if not spans:
+            return []
+        first = spans[0][1]
+        return [(stage, started - first, seconds, failed) for stage, started, seconds, failed in spans]
+
+    def describe(self, request_id):
+        # one line per request for the log: where the time went
+        spans = self.trace(request_id)
+        if not spans:
+            return f"Request {request_id}: not sampled"
+        total = max(started + seconds for _, started, seconds, _ in spans)
+        parts = [f"{stage} {seconds:.2f}s at +{started:.2f}s" + (" (failed)" if failed else "") for stage, started, seconds, failed in spans]
+        return f"Request {request_id} took {total:.2f}s: " + ", ".join(parts)
+
+    def stage_summary(self):
+        # stage -> (count, p50, p95, errors)
+        with self._lock:
+            stages = {stage: (h.count, h.percentile(0.5), h.percentile(0.95)) for stage, h in self.histograms.items()}
+            errors = {dict(labels)["stage"]: value for (name, labels), value in self.counters.items() if name == "stage_errors"}
+        for stage in errors:
+            stages.setdefault(stage, (0, 0.0, 0.0))
+        return {stage: (*values, errors.get(stage, 0)) for stage, values in sorted(stages.items())}
+
+    def gauges(self):
+        # every number the collectors report, flattened to component_key names
+        values = {}
+        for component, collect in list(self.collectors.items()):
+            try:
+                _flatten(component, collect(), values)
+            except Exception as e:
+                print(f"Collecting {component} metrics failed: {e}")
+        return values
+
+    def render(self):
+        """
+        The metrics in the Prometheus text exposition format.
+        """
+        lines = [f"# TYPE {PREFIX}_stage_seconds histogram"]
+        with self._lock:
+            histograms = {stage: (list(h.buckets), h.count, h.sum) for stage, h in self.histograms.items()}
+            counters = dict(self.counters)
+        for stage, (buckets, count, total) in sorted(histograms.items()):
+            cumulative = 0
+            for bound, amount in zip(BUCKETS, buckets):
+                cumulative += amount
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(f"{PREFIX}_{name}_total{_labels(labels)} {value}")
+
+        for name, value in sorted(self.gauges().items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: tuple):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _flatten(prefix: str, value, out: dict):
+    if isinstance(value, dict):
+        for key, inner in value.items():
+            _flatten(f"{prefix}_{key}", inner, out)
+    elif isinstance(value, (bool, int, float)):
+        out[prefix] = float(value)
+
+
+telemetry = Telemetry()
+
+
+async def serve(host: str = "127.0.0.1", port: int = None):
+    """
+    Serves telemetry.render() at http://host:port/metrics (METRICS_PORT, 0 turns it off).
+    Returns the aiohttp runner, or None, also when the port can't be bound: the bot runs
+    on without metrics then.
+    """
+    port = port if port is not None else env_int("METRICS_PORT", 9108)
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(text=telemetry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        print(f"Couldn't serve metrics on {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
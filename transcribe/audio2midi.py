@@ -2,35 +2,64 @@
 
 import subprocess
 import os
-def audio2midi(audio_file_path: str, output_file_path = None):
+import time
+from cache import get_cache, make_key
+from audio.pcm_cache import PcmView, audio_identity, audio_name, encode
+
+
+def audio2midi(audio_file_path, output_file_path = None):
+    cache = get_cache()
+    digest = audio_identity(audio_file_path)
+    key = make_key("midi", digest)
+    cached_path = cache.get(key)
+    if cached_path:
+        return cached_path
+
     if output_file_path is None:
         # basename of the audio file
         print("Audio file path:", audio_file_path)
         print("Current working directory:", os.getcwd())
-        if audio_file_path.endswith(".wav"):
-            midi_filename = os.path.basename(audio_file_path).replace(".wav", ".mid")
-        else:
-            midi_filename = os.path.basename(audio_file_path).replace(".mp3", ".mid")
-        output_file_path = os.path.join(os.getcwd(), "results", midi_filename)
+        output_file_path = midi_output_path(audio_file_path, digest)
+
+    if isinstance(audio_file_path, PcmView):
+        # the CLI needs a file on disk
+        audio_file_path = encode(audio_file_path, "wav")
 
-    run_transkun(audio_file_path, output_file_path, use_gpu=True)
+    started = time.perf_counter()
+    run_transkun(audio_file_path, output_file_path, device=pick_device())
+    print(f"Transkun subprocess took {time.perf_counter() - started:.2f}s (model load + decode + inference)")
 
-    return output_file_path
+    return cache.put(key, output_file_path)
+
+def midi_output_path(audio, digest: str):
+    # the digest prefix keeps different uploads with the same file name apart
+    return os.path.join(os.getcwd(), "results", f"{audio_name(audio)}_{digest[:8]}.mid")
+
+def pick_device():
+    # TRANSKUN_DEVICE wins; otherwise use the GPU when there is one
+    device = os.getenv("TRANSKUN_DEVICE")
+    if device:
+        return device
+    try:
+        import torch
+    except ImportError:
+        return "cpu"
+    return "cuda" if torch.cuda.is_available() else "cpu"
 
-def run_transkun(input_path: str, output_path: str, use_gpu: bool = False):
+def run_transkun(input_path: str, output_path: str, device: str = None):
     """
     Runs the transkun command-line tool with the given input and output file paths.
 
     :param input_path: Path to the input MP3 file.
     :param output_path: Path to the output MIDI file.
-    :param use_gpu: Whether to enable GPU acceleration (default: False).
+    :param device: Torch device to run on, e.g. "cuda" or "cpu" (default: transkun's own default).
     """
     try:
         command = ["transkun", input_path, output_path]
         
-        if use_gpu:
+        if device:
             command.append("--device")
-            command.append("cuda")
+            command.append(device)
 
         result = subprocess.run(command, check=True, capture_output=True, text=True)
         
@@ -0,0 +1,153 @@
+# transcribe long recordings as overlapping windows spread over several processes
+
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from cache import get_cache, make_key
+from audio.pcm_cache import as_view
+from config import env_int
+from transcribe.audio2midi import midi_output_path
+from transcribe.transkun_worker import load_model, decode_audio
+
+# recordings longer than this are transcribed in chunks
+CHUNKED_MIN_SECONDS = env_int("CHUNKED_MIN_SECONDS", 240)
+CHUNK_SECONDS = 60.0
+OVERLAP_SECONDS = 5.0
+# onsets closer than this (same pitch) are treated as the same note
+MERGE_TOLERANCE = 0.05
+# how far a cut-off note's end and its continuation's onset may drift from the window edge
+STITCH_TOLERANCE = 0.25
+_model = None
+
+
+def _init_chunk_worker(threads: int):
+    # each pool process loads its own CPU copy of the model once
+    global _model
+    import torch
+    torch.set_num_threads(threads)
+    _model = load_model("cpu")
+
+
+def _transcribe_chunk(window, window_start: float):
+    import torch
+    # the window is a view into the shared PCM file, so only its own frames get read
+    notes = _model.transcribe(torch.from_numpy(decode_audio(window, _model.fs)))
+    return [(note.start + window_start, note.end + window_start, note.pitch, note.velocity) for note in notes]
+
+
+def windows(duration: float, chunk_seconds: float = CHUNK_SECONDS, overlap_seconds: float = OVERLAP_SECONDS):
+    # (start, end) of each window; consecutive windows share overlap_seconds
+    if duration <= chunk_seconds:
+        return [(0.0, duration)]
+    step = chunk_seconds - overlap_seconds
+    count = math.ceil((duration - overlap_seconds) / step)
+    return [(i * step, min(i * step + chunk_seconds, duration)) for i in range(count)]
+
+
+def merge_chunk_notes(chunks: list, tolerance: float = MERGE_TOLERANCE, stitch_tolerance: float = STITCH_TOLERANCE):
+    """
+    Merges per-window transcriptions into one note list.
+
+    chunks is a list of (window_start, window_end, notes) in time order, with notes as
+    (start, end, pitch, velocity) in seconds from the start of the recording. Each onset
+    is kept by the window that owns it (the boundary between two windows is the middle
+    of their overlap), notes cut off at a window's end are stitched to their continuation
+    in the next window, and near-identical onsets left on either side of a boundary are
+    deduplicated.
+    """
+    merged = []
+    for i, (window_start, window_end, notes) in enumerate(chunks):
+        own_start = -math.inf if i == 0 else (window_start + chunks[i - 1][1]) / 2
+        own_end = math.inf if i == len(chunks) - 1 else (chunks[i + 1][0] + window_end) / 2
+
+        for start, end, pitch, velocity in notes:
+            if not own_start <= start < own_end:
+                continue
+
+            # held past the end of its window: follow it into the next ones
+            j = i
+            while j + 1 < len(chunks) and end >= chunks[j][1] - stitch_tolerance:
+                # the next window sees the same note starting at its onset, or at the window's start if it began earlier
+                expected = max(start, chunks[j + 1][0])
+                tails = [n for n in chunks[j + 1][2] if n[2] == pitch and abs(n[0] - expected) <= stitch_tolerance]
+                if not tails:
+                    break
+                end = max(end, max(tail[1] for tail in tails))
+                j += 1
+
+            merged.append((start, end, pitch, velocity))
+
+    merged.sort(key=lambda note: (note[2], note[0]))
+    deduped = []
+    for note in merged:
+        previous = deduped[-1] if deduped else None
+        if previous and previous[2] == note[2] and note[0] - previous[0] < tolerance:
+            deduped[-1] = (previous[0], max(previous[1], note[1]), note[2], max(previous[3], note[3]))
+        else:
+            deduped.append(note)
+    deduped.sort(key=lambda note: (note[0], note[2]))
+    return deduped
+
+
+def write_midi(notes: list, output_path: str):
+    # pretty_midi comes in with transkun, which uses it for its own MIDI output
+    import pretty_midi
+
+    midi = pretty_midi.PrettyMIDI()
+    piano = pretty_midi.Instrument(program=0)
+    for start, end, pitch, velocity in notes:
+        piano.notes.append(pretty_midi.Note(velocity=int(velocity), pitch=int(pitch), start=start, end=max(end, start + 0.01)))
+    midi.instruments.append(piano)
+    midi.write(output_path)
+
+
+_pool = None
+_pool_workers = None
+
+
+def _get_pool(workers: int):
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        _pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_chunk_worker,
+            initargs=(threads,),
+        )
+        _pool_workers = workers
+    return _pool
+
+
+def transcribe_chunked(audio_file_path, output_file_path: str = None, workers: int = None, use_cache: bool = True):
+    """
+    Splits the decoded audio into overlapping windows, transcribes them in parallel on a
+    process pool (CHUNK_WORKERS, default half the cores and at most 4: each process holds
+    its own copy of the model) and writes the merged MIDI.
+    The pool is kept between calls so its processes only load the model once.
+    """
+    audio = as_view(audio_file_path)
+    digest = audio.identity
+    key = make_key("midi", digest)
+    cache = get_cache()
+    cached_path = cache.get(key) if use_cache else None
+    if cached_path:
+        return cached_path
+
+    workers = workers or env_int("CHUNK_WORKERS", min(4, max(1, (os.cpu_count() or 1) // 2)))
+    output_file_path = output_file_path or midi_output_path(audio, digest)
+
+    spans = windows(audio.duration)
+    pool = _get_pool(workers)
+    futures = [pool.submit(_transcribe_chunk, audio.slice(start, end), start) for start, end in spans]
+    chunks = [(start, end, future.result()) for (start, end), future in zip(spans, futures)]
+
+    write_midi(merge_chunk_notes(chunks), output_file_path)
+    return cache.put(key, output_file_path) if use_cache else output_file_path
+
+
+def audio_duration(audio):
+    return as_view(audio).duration
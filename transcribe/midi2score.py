@@ -1,10 +1,20 @@
 # convert midi to score
 
 import os
-import music21
+from cache import get_cache, make_key, file_digest
+
+def lookup_score(midi_file_path: str):
+    key = make_key("musicxml", file_digest(midi_file_path))
+    return key, get_cache().get(key)
+
 
 def midi2score(midi_file_path: str):
-    return _midi2score(midi_file_path)
+    cache = get_cache()
+    key, cached_path = lookup_score(midi_file_path)
+    if cached_path:
+        return cached_path
+
+    return cache.put(key, _midi2score(midi_file_path))
 
 
 def _midi2score(midi_file_path: str, output_file_path = None):
@@ -23,7 +33,9 @@ def _midi2score(midi_file_path: str, output_file_path = None):
     # Send the MIDI file
     with open(midi_file_path, 'rb') as f:
         files = {'file': f}
-        response = requests.post(url, files=files, json=data)
+        response = requests.post(url, files=files, json=data, timeout=120)
+    # don't save an error page as sheet music
+    response.raise_for_status()
 
     # write the response (musicxml) to the output file path
     with open(output_file_path, 'w') as f:
@@ -33,6 +45,8 @@ def _midi2score(midi_file_path: str, output_file_path = None):
 
 
 def score2pdf(score_file_path: str):
+    import music21
+
     score = music21.converter.parse(score_file_path)
     pdf_file_path = score_file_path.replace(".musicxml", ".pdf")
     score.write("lily.png", pdf_file_path)
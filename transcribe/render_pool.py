@@ -0,0 +1,127 @@
+# warm processes that render MusicXML to PDF, keeping music21 imported between renders
+
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from config import env_int
+from telemetry import telemetry
+
+# set in each worker process: parsed scores by MusicXML content hash, most recent last
+_scores = OrderedDict()
+_cache_size = 8
+
+
+def _warm(cache_size: int):
+    # pool initializer: pay for the music21 import once per worker, not once per render
+    global _cache_size
+    _cache_size = cache_size
+    import music21.converter  # noqa: F401
+
+
+def _ping():
+    return os.getpid()
+
+
+def _parse(score_path: str, digest: str):
+    import music21
+
+    score = _scores.get(digest)
+    if score is not None:
+        _scores.move_to_end(digest)
+        return score, True
+    score = music21.converter.parse(score_path)
+    _scores[digest] = score
+    while len(_scores) > _cache_size:
+        _scores.popitem(last=False)
+    return score, False
+
+
+def render_pdf(score_path: str, digest: str, output_path: str = None):
+    """
+    Renders the MusicXML file with LilyPond. Runs in a pool worker; returns the PDF's path,
+    the parse and render times and whether the parsed score was already in memory.
+    """
+    started = time.perf_counter()
+    score, parsed_before = _parse(score_path, digest)
+    parsed = time.perf_counter()
+    output_path = output_path or os.path.splitext(score_path)[0] + ".pdf"
+    # LilyPond adds the extension itself
+    written = str(score.write("lily.pdf", fp=os.path.splitext(output_path)[0]))
+    if written != output_path:
+        os.replace(written, output_path)
+    return output_path, parsed - started, time.perf_counter() - parsed, parsed_before
+
+
+class RenderPool:
+    """
+    Worker processes for MusicXML -> PDF, started once and kept warm.
+
+    Each worker imports music21 when it starts (in the warm-up after on_ready) and keeps
+    the RENDER_CACHE_SIZE scores it parsed last. Scores are routed to workers by content
+    hash, so a repeat render of one (its PDF evicted, or rendered again with other
+    settings) finds it parsed. LilyPond itself is a separate program and still starts
+    for each render.
+    """
+
+    def __init__(self, workers: int = None, cache_size: int = None):
+        self.workers = workers or env_int("RENDER_WORKERS", 1)
+        self.cache_size = cache_size or env_int("RENDER_CACHE_SIZE", 8)
+        self._pools = None
+
+        self.rendered = 0
+        self.failed = 0
+        self.parse_hits = 0
+        self.latencies = deque(maxlen=1000)
+
+    @property
+    def pools(self):
+        if self._pools is None:
+            # one single-process pool per worker, so a score always goes to the same one;
+            # spawn for the same reason as the stage process pool
+            context = multiprocessing.get_context("spawn")
+            self._pools = [
+                ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_warm, initargs=(self.cache_size,))
+                for _ in range(self.workers)
+            ]
+        return self._pools
+
+    async def warm(self):
+        # starts every worker, which imports music21 on the way
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(pool, _ping) for pool in self.pools))
+
+    async def render(self, score_path: str, digest: str, output_path: str = None):
+        pool = self.pools[int(digest[:8], 16) % len(self.pools)]
+        started = time.perf_counter()
+        try:
+            path, parse_seconds, render_seconds, parsed_before = await asyncio.get_running_loop().run_in_executor(
+                pool, render_pdf, score_path, digest, output_path
+            )
+        except Exception:
+            self.failed += 1
+            raise
+        telemetry.observe("render_parse", parse_seconds)
+        telemetry.observe("render_lilypond", render_seconds)
+        self.rendered += 1
+        self.parse_hits += parsed_before
+        self.latencies.append(time.perf_counter() - started)
+        return path
+
+    def shutdown(self):
+        for pool in self._pools or []:
+            pool.shutdown(cancel_futures=True)
+        self._pools = None
+
+    def metrics(self):
+        ordered = sorted(self.latencies)
+        return {
+            "workers": self.workers,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "parse_hits": self.parse_hits,
+            "latency_p50": ordered[len(ordered) // 2] if ordered else 0.0,
+            "latency_p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0,
+        }
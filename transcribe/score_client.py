@@ -0,0 +1,249 @@
+# async client for the MIDI -> MusicXML scoring service
+
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from config import env_int
+
+SCORING_URL = os.getenv("SCORING_URL", "http://localhost:8080/invocations")
+# optional endpoint taking several files in one request (see score_batch)
+SCORING_BATCH_URL = os.getenv("SCORING_BATCH_URL", "")
+CHUNK_BYTES = 64 * 1024
+# what the start of a MusicXML document can look like; anything else is an error page
+MUSICXML_HEADS = (b"<?xml", b"<!DOCTYPE score", b"<score-partwise", b"<score-timewise")
+
+
+class ScoringError(Exception):
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class CircuitOpen(ScoringError):
+    def __init__(self, retry_in: float):
+        super().__init__(f"scoring service unavailable, retrying in {retry_in:.0f}s", retryable=False)
+
+
+class ScoringClient:
+    """
+    Posts MIDI files to the scoring service over a pool of keep-alive connections.
+
+    At most SCORING_CONCURRENCY requests are in flight. Each attempt has a SCORING_TIMEOUT
+    (seconds) deadline; timeouts, connection errors, 5xx/429 responses and bodies that are
+    not MusicXML are retried up to SCORING_RETRIES times with jittered exponential backoff.
+    After SCORING_BREAKER_FAILURES consecutive failures the circuit opens and calls fail fast
+    for SCORING_BREAKER_SECONDS, after which one trial request decides whether it closes.
+    Uploads are streamed from disk and responses are streamed to a temporary file that only
+    replaces the output once it is complete.
+    """
+
+    def __init__(self, url: str = None, batch_url: str = None, concurrency: int = None, timeout: int = None, retries: int = None,
+                 breaker_failures: int = None, breaker_seconds: int = None):
+        self.url = url or SCORING_URL
+        self.batch_url = batch_url if batch_url is not None else SCORING_BATCH_URL
+        self.concurrency = concurrency or env_int("SCORING_CONCURRENCY", 4)
+        self.timeout = timeout or env_int("SCORING_TIMEOUT", 120)
+        self.retries = retries if retries is not None else env_int("SCORING_RETRIES", 3)
+        self.breaker_failures = breaker_failures or env_int("SCORING_BREAKER_FAILURES", 5)
+        self.breaker_seconds = breaker_seconds or env_int("SCORING_BREAKER_SECONDS", 30)
+
+        self._session = None
+        self._semaphore = None
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+        self.requests = 0
+        self.retried = 0
+        self.failed = 0
+        self.breaker_opens = 0
+        self.latencies = deque(maxlen=1000)
+
+    async def _get_session(self):
+        # created on first use so it binds to the running loop
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=10),
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _check_circuit(self):
+        if self._opened_at is None:
+            return
+        remaining = self._opened_at + self.breaker_seconds - time.monotonic()
+        if remaining > 0 or self._trial:
+            raise CircuitOpen(max(remaining, 0))
+        # half open: let this one request through and see how it goes
+        self._trial = True
+
+    def _record(self, ok: bool):
+        self._trial = False
+        if ok:
+            self._failures = 0
+            self._opened_at = None
+            return
+        self._failures += 1
+        if self._failures >= self.breaker_failures or self._opened_at is not None:
+            if self._opened_at is None:
+                self.breaker_opens += 1
+            self._opened_at = time.monotonic()
+
+    async def _with_retries(self, attempt_fn):
+        import aiohttp
+
+        for attempt in range(self.retries + 1):
+            self._check_circuit()
+            # true when this is the one request let through a half-open circuit
+            trial = self._trial
+            started = time.perf_counter()
+            try:
+                async with self._semaphore:
+                    result = await attempt_fn()
+            except (ScoringError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retryable = getattr(e, "retryable", True)
+                # a request the service rejected says nothing about its health
+                self._record(not retryable)
+                if not retryable or attempt == self.retries:
+                    self.failed += 1
+                    if isinstance(e, ScoringError):
+                        raise
+                    raise ScoringError(f"scoring request failed: {e!r}") from e
+                self.retried += 1
+                # full jitter, so requests that failed together don't retry together
+                await asyncio.sleep(random.uniform(0, min(10.0, 0.5 * 2 ** attempt)))
+                continue
+            finally:
+                if trial:
+                    # also when the request was cancelled, or the circuit would stay shut for good
+                    self._trial = False
+            self._record(True)
+            self.latencies.append(time.perf_counter() - started)
+            return result
+
+    async def score(self, midi_file_path: str, output_file_path: str = None):
+        """Converts one MIDI file and returns the path of the MusicXML written next to the other results."""
+        import aiohttp
+
+        await self._get_session()
+        output_file_path = output_file_path or musicxml_output_path(midi_file_path)
+
+        async def attempt():
+            self.requests += 1
+            with open(midi_file_path, "rb") as f:
+                form = aiohttp.FormData()
+                form.add_field("file", f, filename=os.path.basename(midi_file_path), content_type="audio/midi")
+                async with self._session.post(self.url, data=form) as response:
+                    _check_status(response)
+                    await _stream_to_file(response, output_file_path)
+            return output_file_path
+
+        return await self._with_retries(attempt)
+
+    async def score_batch(self, midi_file_paths: list, output_file_paths: list = None):
+        """
+        Converts several MIDI files. With SCORING_BATCH_URL set they go up in one multipart
+        request and the service answers with a JSON list of MusicXML documents in the same
+        order; otherwise each file is its own request, run concurrently. Returns the output
+        paths in order, with the exception in place of any file that failed.
+        """
+        await self._get_session()
+        output_file_paths = output_file_paths or [musicxml_output_path(path) for path in midi_file_paths]
+        if not self.batch_url:
+            return await asyncio.gather(
+                *(self.score(midi, output) for midi, output in zip(midi_file_paths, output_file_paths)),
+                return_exceptions=True,
+            )
+
+        import aiohttp
+
+        async def attempt():
+            self.requests += 1
+            files = [open(path, "rb") for path in midi_file_paths]
+            try:
+                form = aiohttp.FormData()
+                for path, f in zip(midi_file_paths, files):
+                    form.add_field("files", f, filename=os.path.basename(path), content_type="audio/midi")
+                async with self._session.post(self.batch_url, data=form) as response:
+                    _check_status(response)
+                    documents = json.loads(await response.read())
+            finally:
+                for f in files:
+                    f.close()
+            if not isinstance(documents, list) or len(documents) != len(midi_file_paths):
+                raise ScoringError("batch response does not match the files sent")
+            results = []
+            for document, output in zip(documents, output_file_paths):
+                body = document.encode() if isinstance(document, str) else b""
+                if not body.lstrip().startswith(MUSICXML_HEADS):
+                    results.append(ScoringError("batch entry is not MusicXML", retryable=False))
+                    continue
+                _write_atomic(output, body)
+                results.append(output)
+            return results
+
+        return await self._with_retries(attempt)
+
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "retries": self.retried,
+            "failed": self.failed,
+            "breaker_opens": self.breaker_opens,
+            "breaker_open": self._opened_at is not None,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+        }
+
+
+def musicxml_output_path(midi_file_path: str):
+    music_xml_filename = os.path.splitext(os.path.basename(midi_file_path))[0] + ".musicxml"
+    return os.path.join(os.getcwd(), "results", music_xml_filename)
+
+
+def _check_status(response):
+    if response.status == 200:
+        return
+    # client errors won't get better by asking again, except for rate limiting
+    retryable = response.status >= 500 or response.status == 429
+    raise ScoringError(f"scoring service returned HTTP {response.status}", retryable=retryable)
+
+
+async def _stream_to_file(response, output_file_path: str):
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    partial_path = output_file_path + ".part"
+    head = b""
+    try:
+        with open(partial_path, "wb") as f:
+            async for chunk in response.content.iter_chunked(CHUNK_BYTES):
+                if len(head) < 64:
+                    head += chunk[:64]
+                    if len(head.lstrip()) >= 16 and not head.lstrip().startswith(MUSICXML_HEADS):
+                        raise ScoringError("scoring service returned something other than MusicXML")
+                f.write(chunk)
+        if not head.lstrip().startswith(MUSICXML_HEADS):
+            raise ScoringError("scoring service returned something other than MusicXML")
+        os.replace(partial_path, output_file_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def _write_atomic(output_file_path: str, body: bytes):
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    partial_path = output_file_path + ".part"
+    with open(partial_path, "wb") as f:
+        f.write(body)
+    os.replace(partial_path, output_file_path)
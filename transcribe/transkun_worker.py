@@ -0,0 +1,255 @@
+# long-lived transkun process: load the model once, then transcribe jobs from a queue
+
+import copy
+import itertools
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from cache import get_cache, make_key
+from audio.pcm_cache import SAMPLE_RATE as PCM_SAMPLE_RATE, as_view, audio_identity
+from transcribe.audio2midi import midi_output_path, pick_device
+from config import env_int
+from telemetry import telemetry
+
+# clips shorter than this are candidates for sharing one forward pass
+BATCH_MAX_SECONDS = 30.0
+# silence between batched clips, so notes do not bleed from one clip into the next
+BATCH_GAP_SECONDS = 2.0
+# how long to wait for more jobs once one arrives
+BATCH_WINDOW_SECONDS = 0.05
+BATCH_MAX_JOBS = 8
+
+
+def load_model(device: str):
+    import torch
+    import moduleconf
+    from importlib.resources import files
+
+    pretrained = files("transkun") / "pretrained"
+    conf_manager = moduleconf.parseFromFile(str(pretrained / "2.0.conf"))
+    TransKun = conf_manager["Model"].module.TransKun
+    conf = conf_manager["Model"].config
+
+    checkpoint = torch.load(str(pretrained / "2.0.pt"), map_location=device)
+    model = TransKun(conf=conf).to(device)
+    if "best_state_dict" in checkpoint:
+        model.load_state_dict(checkpoint["best_state_dict"], strict=False)
+    else:
+        model.load_state_dict(checkpoint["state_dict"], strict=False)
+    model.eval()
+    torch.set_grad_enabled(False)
+    return model
+
+
+def decode_audio(audio, sample_rate: int):
+    # float32 array of shape (samples, channels) at the model's sample rate, read from the PCM cache
+    samples = as_view(audio).float32()
+    if sample_rate != PCM_SAMPLE_RATE:
+        import soxr
+        samples = soxr.resample(samples, PCM_SAMPLE_RATE, sample_rate)
+    return samples
+
+
+def _transcribe(model, device: str, clips: list):
+    """
+    Transcribes one or more decoded clips in a single forward pass by laying them end to end
+    with a gap of silence, then splits the notes back out per clip.
+    """
+    import numpy as np
+    import torch
+
+    gap = np.zeros((int(BATCH_GAP_SECONDS * model.fs), clips[0].shape[1]), dtype=np.float32)
+    offsets = []
+    parts = []
+    position = 0
+    for clip in clips:
+        offsets.append((position / model.fs, len(clip) / model.fs))
+        parts.extend([clip, gap])
+        position += len(clip) + len(gap)
+
+    notes = model.transcribe(torch.from_numpy(np.concatenate(parts[:-1])).to(device))
+
+    per_clip = [[] for _ in clips]
+    for note in notes:
+        for i, (offset, duration) in enumerate(offsets):
+            if offset <= note.start < offset + duration + BATCH_GAP_SECONDS / 2:
+                shifted = copy.copy(note)
+                shifted.start = note.start - offset
+                shifted.end = min(note.end - offset, duration)
+                per_clip[i].append(shifted)
+                break
+    return per_clip
+
+
+def _serve(jobs, results, device: str):
+    from transkun.Data import writeMidi
+
+    device = device or pick_device()
+    started = time.perf_counter()
+    model = load_model(device)
+    load_time = time.perf_counter() - started
+    stopping = False
+
+    while not stopping:
+        batch = [jobs.get()]
+        if batch[0] is None:
+            break
+        deadline = time.monotonic() + BATCH_WINDOW_SECONDS
+        while len(batch) < BATCH_MAX_JOBS:
+            try:
+                job = jobs.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if job is None:
+                stopping = True
+                break
+            batch.append(job)
+
+        decoded = []
+        for job_id, audio_path, output_path in batch:
+            started = time.perf_counter()
+            try:
+                decoded.append((job_id, output_path, decode_audio(audio_path, model.fs), time.perf_counter() - started))
+            except Exception as e:
+                results.put((job_id, None, f"decode failed: {e}", {"decode": time.perf_counter() - started}))
+
+        # short clips share one pass, long recordings go through on their own
+        short = [item for item in decoded if len(item[2]) / model.fs <= BATCH_MAX_SECONDS]
+        groups = [short] if short else []
+        groups += [[item] for item in decoded if len(item[2]) / model.fs > BATCH_MAX_SECONDS]
+
+        for group in groups:
+            started = time.perf_counter()
+            try:
+                per_clip = _transcribe(model, device, [item[2] for item in group])
+                error = None
+            except Exception as e:
+                per_clip = [None] * len(group)
+                error = f"inference failed: {e}"
+            inference_time = time.perf_counter() - started
+
+            for (job_id, output_path, _, decode_time), notes in zip(group, per_clip):
+                timings = {"load": load_time, "decode": decode_time, "inference": inference_time, "batch_size": len(group)}
+                if error is None:
+                    writeMidi(notes).write(output_path)
+                results.put((job_id, output_path if error is None else None, error, timings))
+            # only the first jobs pay for loading the model
+            load_time = 0.0
+
+    results.put(None)
+
+
+class TranskunWorker:
+    """
+    Keeps one transkun model loaded in a separate process and feeds it jobs over a queue,
+    instead of paying interpreter start-up, the torch import and weight loading on every
+    request. Short clips that arrive together are transcribed in one forward pass.
+
+    submit() returns a concurrent.futures.Future for the MIDI path. Per-job timings (model
+    load, decode, inference, time in queue) are kept in self.timings.
+    """
+
+    def __init__(self, device: str = None, timeout: int = None):
+        # None lets the worker process pick, so torch is never imported here
+        self.device = device
+        # how long a caller should wait for one job before giving up on it
+        self.timeout = timeout or env_int("TRANSKUN_TIMEOUT", 900)
+        self.timings = deque(maxlen=1000)
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._process = None
+
+    def start(self):
+        # submit() runs on several I/O threads at once: only one of them may start the process
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        if self._process is not None:
+            return
+        context = multiprocessing.get_context("spawn")
+        self._jobs = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(target=_serve, args=(self._jobs, self._results, self.device), daemon=True)
+        self._process.start()
+        self._reader = threading.Thread(target=self._read_results, name="transkun-results", daemon=True)
+        self._reader.start()
+
+    def submit(self, audio_path, output_path: str = None, use_cache: bool = True):
+        # audio_path may also be a PcmView
+        future = Future()
+        digest = audio_identity(audio_path)
+        key = make_key("midi", digest) if use_cache else None
+        cached_path = get_cache().get(key) if use_cache else None
+        if cached_path:
+            future.set_result(cached_path)
+            return future
+
+        with self._lock:
+            self._start()
+            job_id = next(self._ids)
+            self._pending[job_id] = (future, key, time.perf_counter())
+            jobs = self._jobs
+        jobs.put((job_id, audio_path, output_path or midi_output_path(audio_path, digest)))
+        return future
+
+    def _read_results(self):
+        while True:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                if self._process is not None and not self._process.is_alive():
+                    with self._lock:
+                        self._process = None
+                    self._fail_pending(RuntimeError("transkun worker exited"))
+                    break
+                continue
+            if message is None:
+                break
+            job_id, output_path, error, timings = message
+            with self._lock:
+                future, key, submitted = self._pending.pop(job_id)
+
+            timings["total"] = time.perf_counter() - submitted
+            timings["queue"] = timings["total"] - timings.get("load", 0.0) - timings.get("decode", 0.0) - timings.get("inference", 0.0)
+            self.timings.append(timings)
+            for part in ("load", "decode", "inference", "queue"):
+                if timings.get(part):
+                    telemetry.observe(f"transkun_{part}", timings[part])
+            print(
+                f"Transkun job {job_id}: load {timings.get('load', 0.0):.2f}s, decode {timings.get('decode', 0.0):.2f}s, "
+                f"inference {timings.get('inference', 0.0):.2f}s (batch of {timings.get('batch_size', 1)}), total {timings['total']:.2f}s"
+            )
+
+            if error is None and key is not None:
+                output_path = get_cache().put(key, output_path)
+            # the caller may time out and cancel the future at any point up to here; the MIDI is
+            # cached for the next one all the same
+            try:
+                if error is not None:
+                    future.set_exception(RuntimeError(error))
+                else:
+                    future.set_result(output_path)
+            except InvalidStateError:
+                pass
+
+    def _fail_pending(self, error: Exception):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        for future, _, _ in pending.values():
+            try:
+                future.set_exception(error)
+            except InvalidStateError:
+                # cancelled by a caller that timed out
+                pass
+
+    def stop(self):
+        if self._process is None:
+            return
+        self._jobs.put(None)
+        self._process.join(timeout=10)
+        self._process = None
@@ -1,6 +1,28 @@
-import yt_dlp
+from cache import get_cache, make_key
+from youtube.links import video_id
+
+
+def download_audio(video_url, start_time=None, end_time=None, cancel=None):
+    """
+    Downloads the audio of video_url as mp3. Given start_time and end_time (seconds), only
+    that section is fetched and transcoded: ffmpeg seeks into the stream with range requests
+    instead of pulling the whole file, which matters for short excerpts of long videos.
+    Setting the threading.Event cancel stops the download at its next progress update.
+    """
+    ranged = start_time is not None and end_time is not None
+    cache = get_cache()
+    if ranged:
+        key = make_key("download", video_id(video_url), start_time=start_time, end_time=end_time)
+    else:
+        key = make_key("download", video_id(video_url))
+    cached_path = cache.get(key)
+    if cached_path:
+        return cached_path
+
+    import yt_dlp
+
+    suffix = f"_{start_time}_{end_time}" if ranged else ""
 
-def download_audio(video_url):
     # Options for downloading best audio and converting it to MP3
     ydl_opts = {
         'format': 'bestaudio/best',  # Select the best available audio quality
@@ -9,11 +31,20 @@ def download_audio(video_url):
             'preferredcodec': 'mp3',       # Convert to MP3 format
             'preferredquality': '192',     # Set the audio quality (in kbps)
         }],
-        'outtmpl': 'uploads/%(id)s.%(ext)s',    # Output filename template: video title with appropriate extension
+        'outtmpl': 'uploads/%(id)s' + suffix + '.%(ext)s',    # Output filename template: video id (and range) with appropriate extension
     }
+    if cancel is not None:
+        def stop_if_cancelled(progress):
+            if cancel.is_set():
+                raise yt_dlp.utils.DownloadCancelled("download no longer needed")
+        ydl_opts['progress_hooks'] = [stop_if_cancelled]
+    if ranged:
+        ydl_opts['download_ranges'] = yt_dlp.utils.download_range_func(None, [(start_time, end_time)])
+        # cut exactly at the requested times rather than at the nearest keyframe
+        ydl_opts['force_keyframes_at_cuts'] = True
 
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         info_dict = ydl.extract_info(video_url)
-        audio_file_path = 'uploads/' + info_dict.get('id', None) + '.mp3'
-        
-    return audio_file_path
+        audio_file_path = 'uploads/' + info_dict.get('id', None) + suffix + '.mp3'
+
+    return cache.put(key, audio_file_path)
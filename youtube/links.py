@@ -0,0 +1,28 @@
+import re
+from urllib.parse import urlparse, parse_qs
+
+YOUTUBE_LINK = re.compile(r"https?://(?:www\.|m\.)?(?:youtube\.com|youtu\.be)/[^\s<>]+")
+
+
+def video_id(video_url: str):
+    # canonical ID so youtu.be/X, watch?v=X&t=30, shorts/X etc. share one cache entry
+    parsed = urlparse(video_url.strip())
+    host = parsed.netloc.lower().removeprefix("www.").removeprefix("m.")
+    if host == "youtu.be":
+        return parsed.path.strip("/").split("/")[0]
+    if host.endswith("youtube.com"):
+        if parsed.path == "/watch":
+            return parse_qs(parsed.query).get("v", [video_url])[0]
+        parts = parsed.path.strip("/").split("/")
+        if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+            return parts[1]
+    return video_url.strip()
+
+
+def find_links(text: str):
+    # YouTube links in a raw message, in order, one per video
+    links = {}
+    for match in YOUTUBE_LINK.finditer(text or ""):
+        link = match.group(0).rstrip(".,;:!?)")
+        links.setdefault(video_id(link), link)
+    return list(links.values())
@@ -0,0 +1,183 @@
+# start downloads before a request asks for them, and stop the ones that turn out unneeded
+
+import asyncio
+import functools
+import threading
+from intent import URL, parse_times
+from youtube.links import find_links, video_id
+
+
+def _key(url: str, start_time=None, end_time=None):
+    # a ranged download is a different file from the whole video
+    vid = video_id(url)
+    return vid if start_time is None else f"{vid}@{start_time}-{end_time}"
+
+
+def needed_downloads(requests: list, have=()):
+    """
+    (link, start_time, end_time) for each download a request list will make, read in order
+    the way compile_requests plans them: a link is downloaded whole for the first request
+    that needs its audio, unless that is a TRIM, which downloads just its window. Either way
+    a TRIM or STEM_SEPARATION replaces the link's audio for the requests after it, so those
+    need nothing more. Links in have (video IDs whose audio the session already has) need
+    nothing at all.
+    """
+    whole = {}
+    windows = []
+    # video IDs a request in the list replaced the audio of (compile_requests' link_source)
+    replaced = set()
+    for obj in requests:
+        kind = obj["type"]
+        if kind == "none":
+            break
+        link = obj.get("youtube_link")
+        if link in (None, "none") or kind not in ("MIDI", "SHEET_MUSIC", "TRIM", "STEM_SEPARATION"):
+            continue
+        vid = video_id(link)
+        if vid not in replaced and vid not in have:
+            if kind == "TRIM" and vid not in whole:
+                windows.append((link, obj["start_time"], obj["end_time"]))
+            elif kind == "TRIM" or obj.get("file_path", "none") in (None, "none"):
+                whole.setdefault(vid, link)
+        if kind in ("TRIM", "STEM_SEPARATION"):
+            replaced.add(vid)
+    return [(link, None, None) for link in whole.values()] + windows
+
+
+class _Download:
+    def __init__(self, task, cancel: threading.Event):
+        self.task = task
+        self.cancel = cancel
+        # a claimed download has a request waiting on it and is never cancelled
+        self.claimed = False
+        # for a speculative download: the video IDs of the other candidates of its search
+        self.alternatives = set()
+
+
+class Prefetcher:
+    """
+    Downloads started ahead of the request that will need them, keyed by video ID.
+
+    prefetch_message() starts the links and uploads of a new message while the LLM reads it,
+    ranged when all the message wants of a link is a trim.
+    speculate() starts the top search result downloading while the results are being
+    posted. If a later request picks a different candidate from the same search before
+    anything claimed the guess, it is cancelled (yt_dlp checks between progress updates);
+    the guess is forgotten with its download. claim() hands an in-flight download to the
+    request that needs it, so the same video is never fetched twice.
+    """
+
+    def __init__(self, executor, download=None, decode=None):
+        self.executor = executor
+        # youtube.download.download_audio unless a stand-in is given
+        self.download = download
+        # run on each fetched file (e.g. audio.pcm_cache.as_view), or nothing
+        self.decode = decode
+        self._downloads = {}
+
+        self.started = 0
+        self.claimed = 0
+        self.cancelled = 0
+
+    def speculate(self, candidates: list):
+        if not candidates:
+            return
+        top = video_id(candidates[0]["url"])
+        if top in self._downloads:
+            # already fetched for a request of its own, so not a guess
+            return
+        entry = self.start(candidates[0]["url"])
+        entry.alternatives = {video_id(candidate["url"]) for candidate in candidates[1:]} - {top}
+
+    def prefetch_message(self, content: str, uploads: dict = None, requests: list = None, have=()):
+        """
+        Starts fetching what a message will need as soon as it arrives: uploads (path ->
+        coroutine function saving the attachment there) and the audio of its YouTube links.
+        The LLM call runs meanwhile; the requests it returns claim these.
+
+        requests is the request list when the message was parsed locally: then exactly the
+        downloads it makes are started (see needed_downloads). Without it, links are fetched
+        whole, unless the message mentions times: a trim of a long video should download
+        only its window, so those wait for the LLM's answer.
+        """
+        if requests is not None:
+            for link, start_time, end_time in needed_downloads(requests, have):
+                self.start(link, start_time=start_time, end_time=end_time)
+        elif not parse_times(URL.sub(" ", content).lower()):
+            for link in find_links(content):
+                self.start(link)
+        for path, save in (uploads or {}).items():
+            self.start(path, save)
+
+    def start(self, url: str, fetch=None, start_time=None, end_time=None):
+        """
+        Starts downloading url (or awaiting fetch(), for other sources) and then decoding the
+        result, keyed by video ID or path, and the range for a ranged download. Returns the
+        existing entry if one is in flight.
+        """
+        vid = _key(url, start_time, end_time)
+        if vid in self._downloads:
+            return self._downloads[vid]
+
+        cancel = threading.Event()
+        if fetch is None:
+            download = self.download
+            if download is None:
+                from youtube.download import download_audio as download
+            fetch = functools.partial(self.executor.run_io, "download", download, url, start_time, end_time, cancel)
+
+        task = asyncio.ensure_future(self._fetch(fetch))
+        entry = _Download(task, cancel)
+        self._downloads[vid] = entry
+        self.started += 1
+
+        def finished(task):
+            if self._downloads.get(vid) is entry:
+                # the file is in the artifact cache now, so later downloads of it return at once
+                del self._downloads[vid]
+            if not task.cancelled() and task.exception() is not None and not cancel.is_set():
+                print(f"Prefetch of {url} failed: {task.exception()}")
+
+        task.add_done_callback(finished)
+        return entry
+
+    async def _fetch(self, fetch):
+        path = await fetch()
+        if self.decode is not None:
+            try:
+                # decoded PCM is cached on disk, so the pipeline's decode of path finds it ready
+                await self.executor.run_io("decode", self.decode, path)
+            except Exception as e:
+                print(f"Prefetched decode of {path} failed: {e}")
+        return path
+
+    def claim(self, url: str, start_time=None, end_time=None):
+        """
+        Returns a future for the in-flight download of url (or upload path), or None. Claiming one candidate
+        of a search cancels the speculative download of another.
+        """
+        vid = video_id(url)
+        for key, guess in list(self._downloads.items()):
+            if vid in guess.alternatives:
+                self.cancel(key)
+
+        entry = self._downloads.get(_key(url, start_time, end_time))
+        if entry is None:
+            return None
+        entry.claimed = True
+        entry.alternatives = set()
+        self.claimed += 1
+        # shielded so a cancelled request doesn't cancel the download others may share
+        return asyncio.shield(entry.task)
+
+    def cancel(self, vid: str):
+        entry = self._downloads.get(vid)
+        if entry is None or entry.claimed:
+            return
+        del self._downloads[vid]
+        if not entry.task.done():
+            entry.cancel.set()
+            self.cancelled += 1
+
+    def metrics(self):
+        return {"started": self.started, "claimed": self.claimed, "cancelled": self.cancelled, "in_flight": len(self._downloads)}
@@ -1,24 +1,105 @@
-import yt_dlp
-
-def search_youtube(query: str, max_results: int = 10, max_duration: int = 300):
-    ydl_opts = {
-        'quiet': True,
-        'noplaylist': True,
-        'default_search': 'ytsearch' + str(max_results),
-        'skip_download': True,
-        'extract_flat': True
-    }
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        search_results = ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
-        
-        if 'entries' not in search_results:
-            return None  # No results found
-        
-        for video in search_results['entries']:
-            if video and video.get('duration') and video['duration'] <= max_duration:
-                return {
-                    "title": video["title"],
-                    "url": video["url"],
-                    "duration": video["duration"]
-                }
+import re
+import threading
+import time
+from collections import OrderedDict
+from config import env_int
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+class SearchCache:
+    """
+    Recent search results by normalized query, kept for SEARCH_CACHE_TTL seconds
+    (SEARCH_CACHE_SIZE queries at most). Shared by the I/O threads the searches run on.
+    """
+
+    def __init__(self, ttl: int = None, size: int = None):
+        self.ttl = ttl or env_int("SEARCH_CACHE_TTL", 3600)
+        self.size = size or env_int("SEARCH_CACHE_SIZE", 256)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time() - self.ttl:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, candidates: list):
+        with self._lock:
+            self._entries[key] = (time.time(), candidates)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0, "entries": len(self._entries)}
+
+
+search_cache = SearchCache()
+_local = threading.local()
+
+
+def normalize_query(query: str):
+    return " ".join(WORD.findall(query.lower()))
+
+
+def _extract(query: str, max_results: int):
+    import yt_dlp
+
+    # one YoutubeDL per I/O thread instead of one per search
+    if getattr(_local, "ydl", None) is None:
+        ydl_opts = {
+            'quiet': True,
+            'noplaylist': True,
+            'skip_download': True,
+            'extract_flat': True
+        }
+        _local.ydl = yt_dlp.YoutubeDL(ydl_opts)
+    return _local.ydl.extract_info(f"ytsearch{max_results}:{query}", download=False)
+
+
+def rank_candidates(query: str, entries: list, max_duration: int = 300, limit: int = 5):
+    """
+    Orders search entries best first: videos within max_duration before longer ones, then by
+    how many of the query's words the title contains, then by YouTube's own order.
+    """
+    words = set(WORD.findall(query.lower()))
+    ranked = []
+    for position, video in enumerate(entries):
+        if not video or not video.get('duration') or not video.get('url'):
+            continue
+        title_words = set(WORD.findall(video.get('title', '').lower()))
+        overlap = len(words & title_words) / len(words) if words else 0.0
+        ranked.append((video['duration'] > max_duration, -overlap, position, video))
+    ranked.sort(key=lambda item: item[:3])
+    return [
+        {"title": video["title"], "url": video["url"], "duration": video["duration"]}
+        for _, _, _, video in ranked[:limit]
+    ]
+
+
+def search_youtube(query: str, max_results: int = 10, max_duration: int = 300, extractor=None):
+    """
+    Returns up to SEARCH_CANDIDATES ranked results for query as a list of
+    {"title", "url", "duration"}, best first, or None if nothing usable was found.
+    Results are cached by normalized query; extractor stands in for yt_dlp in benchmarks.
+    """
+    key = (normalize_query(query), max_results, max_duration)
+    candidates = search_cache.get(key)
+    if candidates is not None:
+        return candidates or None
+
+    search_results = (extractor or _extract)(query, max_results)
+    entries = search_results.get('entries') if search_results else None
+    candidates = rank_candidates(query, entries or [], max_duration, env_int("SEARCH_CANDIDATES", 5))
+    search_cache.put(key, candidates)
+    return candidates or None